@@ -1,99 +1,872 @@
 import shutil
+import logging
 import os
-from datetime import datetime
+from datetime import datetime, timedelta
 import zipfile
 import time
-import sys
+import json
+import argparse
+import hashlib
+import tempfile
+import glob
+import sqlite3
+import gzip
+import bz2
+import lzma
+from contextlib import nullcontext, closing
+from concurrent.futures import ThreadPoolExecutor
+from log import flush_logs, shutdown_log_writer, load_segment_manifest, LOG_SEGMENT_DIR
+from database import create_connection, create_tables, open_connection, close_all_pools
+from member import member_cache, find_member_id, index_member, decrypt_member_row, MEMBER_COLUMNS
+from encrypt_decrypt import key_manager, load_key_state, blind_index, KEY_STATE_FILE
+from key_rotation import rotate_keys_in_background, stop_key_rotation
 
-def backup_database_and_logs(database_path):
+BACKUP_DIR = "backups"
+# Catalog of every backup: its files, hashes, counts, archive size and checksum and (for incrementals)
+# the backup it builds on, so backups can be listed and inspected without opening the archives
+BACKUP_MANIFEST = os.path.join(BACKUP_DIR, "manifest.json")
+
+# Retention: the newest BACKUP_KEEP_CHAINS chains (a full backup with its incrementals) are always kept;
+# older chains are pruned once all their backups are older than BACKUP_KEEP_DAYS days
+BACKUP_KEEP_CHAINS = 4
+BACKUP_KEEP_DAYS = 30
+
+# Files next to the database that are included in every backup
+DATA_FILES = ["data/logs.csv", "data/encrypted_logs.csv", "data/system.log", "data/data_key.bin", "data/index_key.bin"]
+# Files that are only ever appended to; incrementals store just the bytes added since the previous backup
+APPEND_ONLY_FILES = {"data/logs.csv", "data/encrypted_logs.csv", "data/system.log"}
+
+# Compression of the files in a backup: "deflate" (gzip), "bzip2", "lzma" (xz) or "none", and its level (0-9)
+BACKUP_CODEC = "deflate"
+BACKUP_COMPRESSION_LEVEL = 6
+# Every file is compressed into its own stream with this extension, so files can be compressed in parallel
+BACKUP_CODECS = {"none": "", "deflate": ".gz", "bzip2": ".bz2", "lzma": ".xz"}
+
+# Take a new full backup after this many incrementals, so a restore chain never gets too long
+MAX_INCREMENTAL_CHAIN = 6
+
+# Number of bytes before the previous end of an append-only file that must be unchanged to append to it
+APPEND_CHECK_SIZE = 64 * 1024
+HASH_CHUNK_SIZE = 1024 * 1024
+COPY_CHUNK_SIZE = 1024 * 1024
+
+# The database is snapshotted with the SQLite backup API in steps of this many pages; between steps
+# the application's own connection can keep reading and writing
+SNAPSHOT_PAGES_PER_STEP = 256
+SNAPSHOT_STEP_SLEEP = 0.01
+# After this many restarts caused by concurrent writes, the rest of the snapshot is taken in a single step
+SNAPSHOT_MAX_RESTARTS = 3
+
+# Seconds a restore waits for an exclusive lock on the database before it gives up
+RESTORE_LOCK_TIMEOUT = 2.0
+
+
+class _SnapshotRestarted(Exception):
+    pass
+
+
+def _file_sha256(path, start=0, end=None):
+    """
+    Hash a file (or the byte range [start, end) of it) in chunks.
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        f.seek(start)
+        remaining = None if end is None else end - start
+        while remaining is None or remaining > 0:
+            chunk = f.read(HASH_CHUNK_SIZE if remaining is None else min(HASH_CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            digest.update(chunk)
+            if remaining is not None:
+                remaining -= len(chunk)
+    return digest.hexdigest()
+
+
+def _tail_sha256(path, size):
+    """
+    Hash the last APPEND_CHECK_SIZE bytes before offset size, used to check that an append-only file was only appended to.
+    """
+    return _file_sha256(path, max(0, size - APPEND_CHECK_SIZE), size)
+
+
+def _snapshot_database(database_path, snapshot_path):
+    """
+    Take a consistent, page-level snapshot of a database that may be in use, using the SQLite backup API.
+    The copy is made in steps of SNAPSHOT_PAGES_PER_STEP pages, so other connections are never blocked for the
+    whole copy; if the database is changed by another connection in between, SQLite restarts the copy.
+    """
+    progress = {"remaining": None, "restarts": 0}
+
+    def report_progress(status, remaining, total):
+        if progress["remaining"] is not None and remaining > progress["remaining"]:
+            progress["restarts"] += 1
+            if progress["restarts"] > SNAPSHOT_MAX_RESTARTS:
+                raise _SnapshotRestarted()
+        progress["remaining"] = remaining
+        done = total - remaining
+        percentage = done * 100 // total if total else 100
+        print(f"\rSnapshotting database: {done}/{total} pages ({percentage}%)", end="", flush=True)
+
+    source = open_connection(database_path)
+    snapshot = sqlite3.connect(snapshot_path)
+    try:
+        try:
+            source.backup(snapshot, pages=SNAPSHOT_PAGES_PER_STEP, progress=report_progress, sleep=SNAPSHOT_STEP_SLEEP)
+        except _SnapshotRestarted:
+            # The database keeps changing; copy it in one step, which holds a read lock for the whole copy
+            print("\nDatabase is busy, finishing the snapshot in one step...")
+            source.backup(snapshot, pages=-1)
+    finally:
+        snapshot.close()
+        source.close()
+    print()
+
+
+def _compressor(fileobj, codec, level):
+    """
+    Wrap a binary file object for writing in the given codec.
+    """
+    if codec == "deflate":
+        return gzip.GzipFile(fileobj=fileobj, mode="wb", compresslevel=level, mtime=0)
+    if codec == "bzip2":
+        return bz2.BZ2File(fileobj, "wb", compresslevel=max(1, level))
+    if codec == "lzma":
+        return lzma.LZMAFile(fileobj, "wb", preset=level)
+    return nullcontext(fileobj)
+
+
+def _decompressor(fileobj, codec):
+    """
+    Wrap a binary file object for reading data that was written in the given codec.
+    """
+    if codec == "deflate":
+        return gzip.GzipFile(fileobj=fileobj, mode="rb")
+    if codec == "bzip2":
+        return bz2.BZ2File(fileobj, "rb")
+    if codec == "lzma":
+        return lzma.LZMAFile(fileobj, "rb")
+    return nullcontext(fileobj)
+
+
+def _compress_file(path, part_path, codec, level, size, offset=0):
+    """
+    Stream the bytes [offset, size) of a file through the codec into part_path in chunks,
+    without reading it into memory at once. Bytes appended after size was taken are left for the next backup,
+    so the stored part always matches the size recorded in the manifest.
+    """
+    with open(path, "rb") as source, open(part_path, "wb") as part, _compressor(part, codec, level) as destination:
+        source.seek(offset)
+        remaining = size - offset
+        while remaining > 0:
+            chunk = source.read(min(COPY_CHUNK_SIZE, remaining))
+            if not chunk:
+                raise ValueError(f"{path} shrank while it was backed up.")
+            destination.write(chunk)
+            remaining -= len(chunk)
+
+
+def _prepare_backup_file(path, arcname, old, codec, level, work_dir):
+    """
+    Compress a file, or only the part that changed since the previous backup (old is its manifest entry there,
+    or None), into a part file in work_dir. Returns the manifest entry for this backup, the number of
+    uncompressed bytes stored and the part file (None if nothing needs to be stored).
+    """
+    stat = os.stat(path)
+    info = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+    if path in APPEND_ONLY_FILES:
+        info["tail_sha256"] = _tail_sha256(path, stat.st_size)
+        appended = (
+            old is not None and "tail_sha256" in old and stat.st_size >= old["size"]
+            and _tail_sha256(path, old["size"]) == old["tail_sha256"]
+        )
+        if appended and stat.st_size == old["size"]:
+            info["stored"] = "unchanged"
+            return info, 0, None
+        if appended:
+            # Only the bytes written since the previous backup
+            part_path = os.path.join(work_dir, arcname.replace("/", "_"))
+            _compress_file(path, part_path, codec, level, stat.st_size, offset=old["size"])
+            info["stored"] = "append"
+            info["offset"] = old["size"]
+            return info, stat.st_size - old["size"], part_path
+    else:
+        # Unchanged size and modification time means the previous hash is still valid
+        if old is not None and old["size"] == stat.st_size and old["mtime_ns"] == stat.st_mtime_ns:
+            info["sha256"] = old["sha256"]
+        else:
+            info["sha256"] = _file_sha256(path, 0, stat.st_size)
+        if old is not None and old.get("sha256") == info["sha256"]:
+            info["stored"] = "unchanged"
+            return info, 0, None
+
+    part_path = os.path.join(work_dir, arcname.replace("/", "_"))
+    _compress_file(path, part_path, codec, level, stat.st_size)
+    info["stored"] = "full"
+    return info, stat.st_size, part_path
+
+
+def load_backup_manifest():
+    """
+    Load the backup manifest, or an empty one if no backup was made yet.
+    """
+    if not os.path.exists(BACKUP_MANIFEST):
+        return {"backups": []}
+    with open(BACKUP_MANIFEST, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _save_backup_manifest(manifest):
+    """
+    Write the backup manifest atomically.
+    """
+    temp_file = BACKUP_MANIFEST + ".tmp"
+    with open(temp_file, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_file, BACKUP_MANIFEST)
+
+
+def _count_records(snapshot_path):
+    """
+    Count the users, members and log entries (including closed log segments) in a database snapshot.
+    """
+    with closing(sqlite3.connect(snapshot_path)) as conn:
+        tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        counts = {table: conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0] if table in tables else 0
+                  for table in ("users", "members", "logs")}
+    counts["logs"] += sum(entry["rows"] for entry in load_segment_manifest())
+    return counts
+
+
+def _backup_sources(database_path):
+    """
+    Return (path on disk, name in the archive) for every file that belongs in a backup.
+    """
+    sources = [(database_path, os.path.basename(database_path))]
+    for data_file in DATA_FILES:
+        if os.path.exists(data_file):
+            sources.append((data_file, os.path.basename(data_file)))
+        else:
+            print(f"File {data_file} not found, skipping.")
+
+    # Keys of later key versions and the key state, so data encrypted after a key rotation can be restored
+    for key_file in sorted(glob.glob("data/*_key.*.bin")) + [KEY_STATE_FILE]:
+        if os.path.exists(key_file):
+            sources.append((key_file, os.path.basename(key_file)))
+
+    # Add all closed log segments and their manifest, keeping them in their own directory
+    if os.path.isdir(LOG_SEGMENT_DIR):
+        for file_name in sorted(os.listdir(LOG_SEGMENT_DIR)):
+            if file_name.endswith(".tmp"):
+                continue
+            # Archive names always use '/', so they match the names in the manifest on every platform
+            sources.append((os.path.join(LOG_SEGMENT_DIR, file_name), f"{os.path.basename(LOG_SEGMENT_DIR)}/{file_name}"))
+    return sources
+
+
+def _backup_chain(manifest, backup_name):
+    """
+    Return the manifest entries needed to restore backup_name, starting with its full backup.
+    """
+    entries = {entry["name"]: entry for entry in manifest["backups"]}
+    chain = []
+    while backup_name is not None:
+        entry = entries.get(backup_name)
+        if entry is None:
+            raise FileNotFoundError(f"Backup {backup_name} is not in the backup manifest.")
+        chain.append(entry)
+        backup_name = entry.get("base")
+    return list(reversed(chain))
+
+
+def backup_database_and_logs(database_path, incremental=True, codec=None, level=None):
     """
     Create a backup of the database and log files.
+    An incremental backup only stores files that changed since the previous backup and, for
+    append-only logs, only the newly appended bytes. A full backup is made when there is no
+    previous backup, when incremental is False, or when the chain reaches MAX_INCREMENTAL_CHAIN.
+    Files are compressed in parallel with codec (BACKUP_CODEC by default) at the given level.
     """
-    backup_dir = "backups"
-    os.makedirs(backup_dir, exist_ok=True)
+    codec = codec or BACKUP_CODEC
+    level = BACKUP_COMPRESSION_LEVEL if level is None else level
+    if codec not in BACKUP_CODECS:
+        raise ValueError(f"Unknown backup codec: {codec}")
+    started = time.perf_counter()
+    os.makedirs(BACKUP_DIR, exist_ok=True)
+    # Make sure queued log entries are part of the backup
+    flush_logs()
+
+    manifest = load_backup_manifest()
+    previous = manifest["backups"][-1] if manifest["backups"] and incremental else None
+    if previous is not None:
+        chain = _backup_chain(manifest, previous["name"])
+        # Start a new chain when it gets too long or one of its archives was removed
+        if len(chain) > MAX_INCREMENTAL_CHAIN or not all(
+                os.path.exists(os.path.join(BACKUP_DIR, entry["name"])) for entry in chain):
+            previous = None
+    previous_files = previous["files"] if previous is not None else {}
 
     # Create a unique filename for the backup based on the current timestamp
     timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-    backup_filename = f"{os.path.basename(database_path)}_{timestamp}.zip"
-    backup_path = os.path.join(backup_dir, backup_filename)
-
-    with zipfile.ZipFile(backup_path, 'w') as backup_zip:
-        # Add the database to the zip file
-        backup_zip.write(database_path, os.path.basename(database_path))
-        
-        # List of log files to include in the backup
-        log_files = ["data/logs.csv", "data/encrypted_logs.csv", "data/system.log"]
-
-        for log_file in log_files:
-            if os.path.exists(log_file):
-                backup_zip.write(log_file, os.path.basename(log_file))
-            else:
-                print(f"Log file {log_file} not found, skipping.")
-
-    print(f"Backup successfully created: {backup_path}")
-
-
-def restore_database_from_backup(database_path):
-    """
-    Restore the database and log files from a backup.
-    """
-    backup_dir = "backups"
-    backup_file = input("Enter the name of the backup file (in the 'backups' directory): ")
-    backup_path = os.path.join(backup_dir, backup_file)
-    
-    if os.path.exists(backup_path):
-        with zipfile.ZipFile(backup_path, 'r') as backup_zip:
-            # Extract all files to their respective locations
-            backup_zip.extractall("data")
-
-            # Normalize paths to avoid SameFileError
-            extracted_db_path = os.path.abspath(os.path.join("data", os.path.basename(database_path)))
-            database_path = os.path.abspath(database_path)
-
-            # Check if the extracted database path is different from the target database path
-            if extracted_db_path != database_path:
-                for _ in range(3):  # Retry up to 3 times
-                    try:
-                        if os.path.exists(extracted_db_path):
-                            shutil.move(extracted_db_path, database_path)
-                        break
-                    except PermissionError as e:
-                        print(f"PermissionError: {e}, retrying...")
-                        time.sleep(1)
-                else:
-                    print("Failed to move database file due to persistent PermissionError.")
-            else:
-                print("Source and destination are the same, no move operation needed.")
-
-            # Move the extracted log files to their respective locations
-            for file_name in ["logs.csv", "encrypted_logs.csv", "system.log"]:
-                extracted_file_path = os.path.abspath(os.path.join("data", file_name))
-                if os.path.exists(extracted_file_path):
-                    # Check if the source and destination are the same
-                    if extracted_file_path != extracted_file_path:
-                        for _ in range(3):  # Retry up to 3 times
-                            try:
-                                shutil.move(extracted_file_path, extracted_file_path)
-                                break
-                            except PermissionError as e:
-                                print(f"PermissionError: {e}, retrying...")
-                                time.sleep(1)
-                        else:
-                            print(f"Failed to move {file_name} due to persistent PermissionError.")
-                    else:
-                        print(f"Source and destination are the same for {file_name}, no move operation needed.")
-        
-        print("Backup successfully restored.")
-
-        # Restart the program to apply changes
-        print("Restarting the terminal to apply changes...")
-        time.sleep(2)  # Optional: Add a small delay before restarting
-        os.execv(sys.executable, ['python'] + sys.argv)  # Restart the program
-        
+    kind = "incremental" if previous is not None else "full"
+    suffix = "_incr" if previous is not None else ""
+    backup_filename = f"{os.path.basename(database_path)}_{timestamp}{suffix}.zip"
+    known_names = {entry["name"] for entry in manifest["backups"]}
+    sequence = 1
+    while backup_filename in known_names or os.path.exists(os.path.join(BACKUP_DIR, backup_filename)):
+        # More than one backup within the same second
+        sequence += 1
+        backup_filename = f"{os.path.basename(database_path)}_{timestamp}_{sequence}{suffix}.zip"
+    backup_path = os.path.join(BACKUP_DIR, backup_filename)
+
+    # Working directory for the database snapshot and the compressed parts
+    work_dir = tempfile.mkdtemp(prefix="backup_", dir=BACKUP_DIR)
+    snapshot_path = os.path.join(work_dir, "snapshot.db")
+
+    files = {}
+    stored_bytes = 0
+    try:
+        # The live database file can be written to while it is copied, so back up a consistent snapshot instead
+        _snapshot_database(database_path, snapshot_path)
+        counts = _count_records(snapshot_path)
+        sources = [(snapshot_path if path == database_path else path, arcname)
+                   for path, arcname in _backup_sources(database_path)]
+
+        # Compress all files in parallel; the codecs release the GIL while they work
+        with ThreadPoolExecutor(max_workers=os.cpu_count() or 1) as executor:
+            prepared = list(executor.map(
+                lambda source: _prepare_backup_file(*source, previous_files.get(source[1]), codec, level, work_dir),
+                sources
+            ))
+
+        # The parts are already compressed, so they are stored in the archive as they are
+        with zipfile.ZipFile(backup_path, 'w', zipfile.ZIP_STORED, allowZip64=True) as backup_zip:
+            for (_, arcname), (info, stored, part_path) in zip(sources, prepared):
+                if part_path is not None:
+                    backup_zip.write(part_path, arcname + BACKUP_CODECS[codec])
+                files[arcname] = info
+                stored_bytes += stored
+    except BaseException:
+        # Never leave a half-written archive behind
+        if os.path.exists(backup_path):
+            os.remove(backup_path)
+        raise
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    archive_size = os.path.getsize(backup_path)
+    manifest["backups"].append({
+        "name": backup_filename,
+        "type": kind,
+        "base": previous["name"] if previous is not None else None,
+        "timestamp": datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        "codec": codec,
+        "counts": counts,
+        "data_size": sum(info["size"] for info in files.values()),
+        "stored_size": stored_bytes,
+        "archive_size": archive_size,
+        "archive_sha256": _file_sha256(backup_path),
+        "files": files
+    })
+    _save_backup_manifest(manifest)
+
+    elapsed = time.perf_counter() - started
+    ratio = stored_bytes / archive_size if archive_size else 0
+    throughput = stored_bytes / elapsed / (1024 * 1024) if elapsed else 0
+    print(f"Backup successfully created: {backup_path} ({kind}, {codec})")
+    print(f"{stored_bytes} bytes stored as {archive_size} bytes (ratio {ratio:.1f}:1), "
+          f"{elapsed:.2f} s at {throughput:.1f} MB/s")
+
+    prune_backups()
+    return backup_path
+
+
+def list_backups():
+    """
+    Print all backups in the catalog, oldest first, followed by archives that are not in the catalog.
+    Returns the names of the listed backups in the same order.
+    """
+    manifest = load_backup_manifest()
+    names = []
+    print(f"{'#':>3}  {'Backup':<45} {'Type':<12} {'Created':<20} {'Members':>8} {'Users':>6} {'Logs':>7} {'Size':>10}")
+    for entry in manifest["backups"]:
+        names.append(entry["name"])
+        counts = entry.get("counts", {})
+        print(f"{len(names):>3}  {entry['name']:<45} {entry['type']:<12} {entry['timestamp']:<20} "
+              f"{counts.get('members', '?'):>8} {counts.get('users', '?'):>6} {counts.get('logs', '?'):>7} "
+              f"{entry.get('archive_size', '?'):>10}")
+
+    # Backups made before the catalog existed can still be restored as full backups
+    cataloged = set(names)
+    if os.path.isdir(BACKUP_DIR):
+        for file_name in sorted(os.listdir(BACKUP_DIR)):
+            if file_name.endswith(".zip") and file_name not in cataloged:
+                names.append(file_name)
+                print(f"{len(names):>3}  {file_name:<45} {'(uncataloged)':<12}")
+    return names
+
+
+def inspect_backup(backup_name):
+    """
+    Print the catalog details of a backup: its chain, counts, sizes, checksums and files.
+    """
+    manifest = load_backup_manifest()
+    try:
+        chain = _backup_chain(manifest, backup_name)
+    except FileNotFoundError as e:
+        print(e)
+        return None
+    entry = chain[-1]
+    archive_path = os.path.join(BACKUP_DIR, entry["name"])
+    print(f"Backup:   {entry['name']} ({entry['type']}, {entry.get('codec', 'none')})")
+    print(f"Created:  {entry['timestamp']}")
+    if entry.get("base"):
+        print(f"Base:     {entry['base']} (restore chain of {len(chain)} backups, starting at {chain[0]['name']})")
+    if "counts" in entry:
+        counts = entry["counts"]
+        print(f"Contents: {counts['members']} members, {counts['users']} users, {counts['logs']} log entries")
+    if "archive_size" in entry:
+        print(f"Sizes:    {entry['data_size']} bytes of data, {entry['stored_size']} bytes stored, "
+              f"{entry['archive_size']} bytes archive")
+        print(f"Checksum: {entry['archive_sha256']}")
+    print(f"Archive:  {'present' if os.path.exists(archive_path) else 'MISSING'}")
+    for arcname, info in entry["files"].items():
+        checksum = info.get("sha256", info.get("tail_sha256", ""))[:16]
+        print(f"  {arcname:<40} {info['stored']:<10} {info['size']:>10} bytes  {checksum}")
+    return entry
+
+
+def verify_backup(backup_name):
+    """
+    Check the archives in the restore chain of a backup against the checksums in the catalog.
+    """
+    try:
+        chain = _backup_chain(load_backup_manifest(), backup_name)
+    except FileNotFoundError as e:
+        print(e)
+        return False
+    for entry in chain:
+        archive_path = os.path.join(BACKUP_DIR, entry["name"])
+        if not os.path.exists(archive_path):
+            return False
+        if "archive_sha256" in entry and _file_sha256(archive_path) != entry["archive_sha256"]:
+            return False
+    return True
+
+
+def prune_backups(keep_chains=None, keep_days=None):
+    """
+    Apply the retention policy in one pass: remove whole chains (never part of one, since incrementals need
+    their base) beyond the newest keep_chains once all their backups are older than keep_days.
+    Returns the names of the removed backups.
+    """
+    keep_chains = BACKUP_KEEP_CHAINS if keep_chains is None else keep_chains
+    keep_days = BACKUP_KEEP_DAYS if keep_days is None else keep_days
+    manifest = load_backup_manifest()
+
+    chains = []
+    for entry in manifest["backups"]:
+        if entry.get("base") is None or not chains:
+            chains.append([])
+        chains[-1].append(entry)
+
+    oldest_allowed = (datetime.now() - timedelta(days=keep_days)).strftime('%Y-%m-%d %H:%M:%S')
+    removed = []
+    for chain in chains[:max(0, len(chains) - keep_chains)]:
+        if chain[-1]["timestamp"] >= oldest_allowed:
+            continue
+        for entry in chain:
+            archive_path = os.path.join(BACKUP_DIR, entry["name"])
+            if os.path.exists(archive_path):
+                os.remove(archive_path)
+            removed.append(entry["name"])
+
+    if removed:
+        manifest["backups"] = [entry for entry in manifest["backups"] if entry["name"] not in set(removed)]
+        _save_backup_manifest(manifest)
+        print(f"Pruned {len(removed)} old backup(s).")
+    return removed
+
+
+def _rebuild_backup(manifest, backup_name, target_dir, only=None):
+    """
+    Rebuild the files of backup_name in target_dir by applying its chain from the last full backup.
+    With only (an archive name), just that one file is rebuilt.
+    Backups from before the manifest existed are simply extracted.
+    """
+    try:
+        chain = _backup_chain(manifest, backup_name)
+    except FileNotFoundError:
+        with zipfile.ZipFile(os.path.join(BACKUP_DIR, backup_name), 'r') as backup_zip:
+            if only is None:
+                backup_zip.extractall(target_dir)
+            elif only in backup_zip.namelist():
+                backup_zip.extract(only, target_dir)
+        return None
+
+    for entry in chain:
+        # Backups from before compression was added have no codec
+        codec = entry.get("codec", "none")
+        with zipfile.ZipFile(os.path.join(BACKUP_DIR, entry["name"]), 'r') as backup_zip:
+            for arcname, info in entry["files"].items():
+                if info["stored"] == "unchanged" or (only is not None and arcname != only):
+                    continue
+                target_path = os.path.join(target_dir, arcname)
+                os.makedirs(os.path.dirname(target_path), exist_ok=True)
+                with backup_zip.open(arcname + BACKUP_CODECS[codec]) as member, \
+                        _decompressor(member, codec) as source, \
+                        open(target_path, "wb" if info["stored"] == "full" else "r+b") as f:
+                    if info["stored"] == "append":
+                        f.truncate(info["offset"])
+                        f.seek(info["offset"])
+                    shutil.copyfileobj(source, f, COPY_CHUNK_SIZE)
+
+            # Files that no longer existed at the time of this backup
+            for arcname in set(_rebuilt_files(target_dir)) - set(entry["files"]):
+                os.remove(os.path.join(target_dir, arcname))
+
+    # Verify the result against the hashes recorded for the requested backup
+    for arcname, info in chain[-1]["files"].items():
+        if only is not None and arcname != only:
+            continue
+        target_path = os.path.join(target_dir, arcname)
+        if os.path.getsize(target_path) != info["size"]:
+            raise ValueError(f"Restored {arcname} has an unexpected size.")
+        if "sha256" in info and _file_sha256(target_path) != info["sha256"]:
+            raise ValueError(f"Restored {arcname} does not match its checksum.")
+    return chain
+
+
+def _rebuilt_files(target_dir):
+    """
+    List the files in a rebuild directory as archive names.
+    """
+    for root, _, file_names in os.walk(target_dir):
+        for file_name in file_names:
+            yield os.path.relpath(os.path.join(root, file_name), target_dir).replace(os.sep, "/")
+
+
+def _verify_database(path):
+    """
+    Check that a restored database is intact and contains the application tables.
+    """
+    with closing(sqlite3.connect(path)) as conn:
+        result = conn.execute("PRAGMA integrity_check").fetchone()[0]
+        if result != "ok":
+            raise ValueError(f"Restored database failed the integrity check: {result}")
+        tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        missing = {"users", "members"} - tables
+        if missing:
+            raise ValueError(f"Restored database is missing tables: {', '.join(sorted(missing))}")
+
+
+def _replace_file(source, destination):
+    """
+    Atomically replace a file, retrying a few times when it is locked by another process.
+    The source must be on the same file system as the destination.
+    """
+    os.makedirs(os.path.dirname(destination) or ".", exist_ok=True)
+    for _ in range(3):  # Retry up to 3 times
+        try:
+            os.replace(source, destination)
+            return True
+        except PermissionError as e:
+            print(f"PermissionError: {e}, retrying...")
+            time.sleep(1)
+    print(f"Failed to move {os.path.basename(destination)} due to persistent PermissionError.")
+    return False
+
+
+def _restore_destination(arcname, database_path):
+    """
+    Return where a file from the archive belongs on disk.
+    """
+    if arcname == os.path.basename(database_path):
+        return database_path
+    return os.path.join("data", arcname)
+
+
+def _remove_segments_not_in(arcnames):
+    """
+    Remove log segments (and a segment manifest) that are not part of a restored backup, so the segments on disk
+    match the restored database. Segments written after the backup would otherwise overlap the log numbers that
+    the restored database hands out again.
+    """
+    if not os.path.isdir(LOG_SEGMENT_DIR):
+        return
+    kept = set(arcnames)
+    for file_name in os.listdir(LOG_SEGMENT_DIR):
+        if f"{os.path.basename(LOG_SEGMENT_DIR)}/{file_name}" not in kept:
+            os.remove(os.path.join(LOG_SEGMENT_DIR, file_name))
+
+
+def _restore_dir():
+    """
+    Create a temporary directory for rebuilding a backup, on the same file system as the data.
+    """
+    os.makedirs("data", exist_ok=True)
+    return tempfile.mkdtemp(prefix="restore_", dir="data")
+
+
+def _reopen_after_restore(database_path):
+    """
+    Forget everything the running process cached from the old files and open a new database connection.
+    """
+    key_manager.invalidate()
+    member_cache.clear()
+    conn = create_connection(database_path)
+    if conn is not None:
+        # A backup from an older version is brought up to the current schema
+        create_tables(conn)
+    # A key rotation that was still running when the backup was made continues on the restored data
+    if load_key_state().get("rotating"):
+        rotate_keys_in_background(database_path)
+    return conn
+
+
+def _claim_database(database_path):
+    """
+    Make sure nothing else uses the database before it is replaced, and checkpoint its write-ahead log into
+    the database file. Raises ValueError if another connection or process still has the database open.
+    """
+    if not os.path.exists(database_path):
+        return
+    in_use = ValueError("The database is still in use by another session; close it and try again.")
+    claim = sqlite3.connect(database_path, timeout=RESTORE_LOCK_TIMEOUT, isolation_level=None)
+    try:
+        # In exclusive locking mode the lock is only granted when no other connection has the database open
+        claim.execute("PRAGMA locking_mode=EXCLUSIVE")
+        claim.execute("BEGIN EXCLUSIVE")
+        claim.execute("COMMIT")
+        busy, _, _ = claim.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchone()
+        if busy:
+            raise in_use
+    except sqlite3.OperationalError:
+        raise in_use
+    finally:
+        claim.close()
+    # Closing the last connection removes the write-ahead log; if it is still there, someone opened the database again
+    wal_file = database_path + "-wal"
+    if os.path.exists(wal_file) and os.path.getsize(wal_file) > 0:
+        raise in_use
+
+
+def restore_backup(database_path, backup_file, conn=None):
+    """
+    Restore the database and log files from a backup while the application keeps running.
+    The backup is rebuilt and verified in a temporary directory first; only then are the files swapped in
+    atomically. Returns the new database connection, or conn unchanged if the restore failed.
+    """
+    restore_dir = _restore_dir()
+    closed = False
+    try:
+        chain = _rebuild_backup(load_backup_manifest(), backup_file, restore_dir)
+        if chain is not None and len(chain) > 1:
+            print(f"Rebuilt from {chain[0]['name']} and {len(chain) - 1} incremental backup(s).")
+        database_name = os.path.basename(database_path)
+        if database_name not in set(_rebuilt_files(restore_dir)):
+            raise ValueError("The backup does not contain the database.")
+        _verify_database(os.path.join(restore_dir, database_name))
+
+        # Nothing may still write to the old files while they are replaced
+        stop_key_rotation()
+        shutdown_log_writer()
+        close_all_pools()
+        if conn is not None:
+            conn.close()
+        closed = True
+        _claim_database(database_path)
+        restored = list(_rebuilt_files(restore_dir))
+        for arcname in restored:
+            _replace_file(os.path.join(restore_dir, arcname), _restore_destination(arcname, database_path))
+        _remove_segments_not_in(restored)
+    except (ValueError, OSError, EOFError, lzma.LZMAError, zipfile.BadZipFile, sqlite3.Error) as e:
+        print(f"Backup could not be restored: {e}")
+        return _reopen_after_restore(database_path) if closed else conn
+    finally:
+        shutil.rmtree(restore_dir, ignore_errors=True)
+
+    conn = _reopen_after_restore(database_path)
+    print("Backup successfully restored.")
+    return conn
+
+
+def restore_file_from_backup(database_path, backup_file, arcname):
+    """
+    Restore a single log file (for example 'system.log' or 'log_segments/<file>') from a backup,
+    without extracting the rest of the archive.
+    """
+    if arcname == os.path.basename(database_path):
+        print("Use a full restore to restore the database.")
+        return False
+    restore_dir = _restore_dir()
+    try:
+        _rebuild_backup(load_backup_manifest(), backup_file, restore_dir, only=arcname)
+        source = os.path.join(restore_dir, arcname)
+        if not os.path.exists(source):
+            print(f"{arcname} is not in this backup.")
+            return False
+        # Queued log entries must not end up in the file that is being replaced
+        flush_logs()
+        restored = _replace_file(source, _restore_destination(arcname, database_path))
+    except (ValueError, OSError, EOFError, lzma.LZMAError, zipfile.BadZipFile) as e:
+        print(f"{arcname} could not be restored: {e}")
+        return False
+    finally:
+        shutil.rmtree(restore_dir, ignore_errors=True)
+
+    if restored:
+        print(f"{arcname} successfully restored.")
+    return restored
+
+
+def _find_backup_member(backup_conn, membership_id):
+    """
+    Find a member in a backup database. Returns (database ID, the raw row as a dict, the decrypted member), or None.
+    Backups from before the blind index or the record layout lack those columns, and rows whose blind index was
+    never filled are found by decrypting their membership ID instead.
+    """
+    backup_columns = [row[1] for row in backup_conn.execute("PRAGMA table_info(members)")]
+    select = ", ".join(column if column in backup_columns else f"NULL AS {column}"
+                       for column in MEMBER_COLUMNS.split(", "))
+    if "membership_id_index" in backup_columns:
+        rows = backup_conn.execute(
+            f"SELECT {select} FROM members WHERE membership_id_index = ? OR membership_id_index IS NULL",
+            (blind_index(membership_id),)
+        )
     else:
+        rows = backup_conn.execute(f"SELECT {select} FROM members")
+
+    for row in rows.fetchall():
+        try:
+            member = decrypt_member_row(row)
+        except Exception as e:
+            logging.warning(f"Skipping backup member {row[0]} that could not be decrypted: {e}")
+            continue
+        if str(member["membership_id"]) == membership_id:
+            cur = backup_conn.execute("SELECT * FROM members WHERE id = ?", (row[0],))
+            return row[0], dict(zip([column[0] for column in cur.description], cur.fetchone())), member
+    return None
+
+
+def restore_member_from_backup(conn, database_path, backup_file, membership_id):
+    """
+    Restore a single member from a backup into the live database, without replacing anything else.
+    Only the database is rebuilt from the archive. The member keeps its database ID unless another member
+    has taken that ID since.
+    """
+    restore_dir = _restore_dir()
+    try:
+        _rebuild_backup(load_backup_manifest(), backup_file, restore_dir, only=os.path.basename(database_path))
+        backup_database = os.path.join(restore_dir, os.path.basename(database_path))
+        if not os.path.exists(backup_database):
+            print("The backup does not contain the database.")
+            return False
+
+        with closing(sqlite3.connect(backup_database)) as backup_conn:
+            found = _find_backup_member(backup_conn, membership_id)
+            if found is None:
+                print(f"Member with membership ID {membership_id} is not in this backup.")
+                return False
+            member_id, backup_row, member = found
+            backup_columns = list(backup_row)
+    except (ValueError, OSError, EOFError, lzma.LZMAError, zipfile.BadZipFile, sqlite3.Error) as e:
+        print(f"Member could not be restored: {e}")
+        return False
+    finally:
+        shutil.rmtree(restore_dir, ignore_errors=True)
+
+    # Columns added after the backup was made keep their default value
+    live_columns = [row[1] for row in conn.execute("PRAGMA table_info(members)")]
+    columns = [column for column in backup_columns if column in live_columns]
+    try:
+        # A member that was re-added later under another database ID is replaced as well
+        current_id = find_member_id(conn, membership_id)
+        if current_id is not None and current_id != member_id:
+            conn.execute("DELETE FROM members WHERE id = ?", (current_id,))
+            conn.execute("DELETE FROM member_search_index WHERE member_id = ?", (current_id,))
+            member_cache.invalidate(current_id)
+        # The old database ID may have been given to a new member since; then the restored member gets a new ID
+        if current_id != member_id and conn.execute("SELECT 1 FROM members WHERE id = ?", (member_id,)).fetchone():
+            columns.remove("id")
+            statement = "INSERT INTO members"
+        else:
+            statement = "INSERT OR REPLACE INTO members"
+        cur = conn.execute(
+            f"{statement} ({', '.join(columns)}) VALUES ({', '.join('?' for _ in columns)})",
+            [backup_row[column] for column in columns]
+        )
+        restored_id = cur.lastrowid if "id" not in columns else member_id
+        id_index = blind_index(membership_id)
+        conn.execute("UPDATE members SET membership_id_index = ? WHERE id = ?", (id_index, restored_id))
+        # A member deleted before IDs were reserved must not have its membership ID handed out again
+        conn.execute("INSERT OR IGNORE INTO membership_ids (id_index) VALUES (?)", (id_index,))
+        index_member(conn, restored_id, member)
+        conn.commit()
+    except sqlite3.Error as e:
+        conn.rollback()
+        print(f"Member could not be restored: {e}")
+        return False
+    member_cache.invalidate(restored_id)
+    print(f"Member {membership_id} successfully restored.")
+    return True
+
+
+def restore_database_from_backup(database_path, conn=None):
+    """
+    Prompt for a backup and restore everything, a single member or a single log file from it.
+    Returns the database connection to use from now on.
+    """
+    names = list_backups()
+    backup_file = input("Enter the number or name of the backup to restore: ").strip()
+    if backup_file.isdigit() and 1 <= int(backup_file) <= len(names):
+        backup_file = names[int(backup_file) - 1]
+    if not os.path.exists(os.path.join(BACKUP_DIR, backup_file)):
         print("Backup file not found.")
+        return conn
+
+    print("1. Restore everything")
+    print("2. Restore a single member")
+    print("3. Restore a single log file")
+    choice = input("Enter your choice: ").strip()
+    if choice == "1":
+        return restore_backup(database_path, backup_file, conn)
+    if choice == "2":
+        if conn is None:
+            print("A database connection is required to restore a member.")
+            return conn
+        membership_id = input("Enter the membership ID of the member to restore: ").strip()
+        restore_member_from_backup(conn, database_path, backup_file, membership_id)
+    elif choice == "3":
+        arcname = input("Enter the name of the log file (for example system.log): ").strip()
+        restore_file_from_backup(database_path, backup_file, arcname)
+    else:
+        print("Invalid choice.")
+    return conn
 
 
 if __name__ == "__main__":
-    database = "data/unique_meal.db"
-    restore_database_from_backup(database)
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Manage the backups in the 'backups' directory.")
+    parser.add_argument("command", nargs="?", default="restore", choices=["restore", "list", "inspect", "verify", "prune"],
+                        help="restore: restore (part of) a backup; list: list all backups; inspect: show the details "
+                             "of a backup; verify: check the archives of a backup against the catalog; "
+                             "prune: remove old backups according to the retention policy")
+    parser.add_argument("backup", nargs="?", help="name of the backup to inspect or verify")
+    parser.add_argument("--database", default="data/unique_meal.db")
+    args = parser.parse_args()
+
+    if args.command == "restore":
+        restore_database_from_backup(args.database)
+    elif args.command == "list":
+        list_backups()
+    elif args.command in ("inspect", "verify") and not args.backup:
+        parser.error(f"{args.command} needs the name of a backup")
+    elif args.command == "inspect":
+        inspect_backup(args.backup)
+    elif args.command == "verify":
+        print("Backup is intact." if verify_backup(args.backup) else "Backup is damaged or incomplete.")
+    elif args.command == "prune":
+        prune_backups()
@@ -0,0 +1,26 @@
+import os
+import pytest
+from database import create_connection, create_tables, close_all_pools
+from encrypt_decrypt import generate_keys, ensure_data_key, key_manager
+from log import shutdown_log_writer
+from member import member_cache
+
+
+@pytest.fixture
+def conn(tmp_path, monkeypatch):
+    """
+    A fresh database with its own keys in a temporary working directory.
+    """
+    monkeypatch.chdir(tmp_path)
+    os.makedirs("data")
+    key_manager.invalidate()
+    member_cache.clear()
+    generate_keys()
+    ensure_data_key()
+    conn = create_connection("data/unique_meal.db")
+    create_tables(conn)
+    yield conn
+    conn.close()
+    shutdown_log_writer()
+    close_all_pools()
+    key_manager.invalidate()
@@ -1,23 +1,234 @@
+import os
 import sqlite3
+import threading
+from contextlib import contextmanager
 from datetime import datetime
-from encrypt_decrypt import encrypt_data, decrypt_data
+from encrypt_decrypt import encrypt_data, decrypt_data, blind_index
 from utils import hash_password
 import logging
 from sqlite3 import Error
 
+# Location of the application database
+DATABASE_FILE = "data/unique_meal.db"
+
+# Settings applied to every connection the application opens
+DATABASE_PRAGMAS = {
+    "journal_mode": "WAL",          # Readers, the log writer and the session connection no longer block each other
+    "synchronous": "NORMAL",        # Safe with WAL; a power failure can only lose the last commits, not corrupt the file
+    "cache_size": -16384,           # Page cache per connection in KiB (16 MB)
+    "mmap_size": 64 * 1024 * 1024,  # Read pages through memory-mapped I/O instead of read() calls
+    "temp_store": "MEMORY",         # Sorts and temporary indexes stay in memory
+    "busy_timeout": 30000,          # Wait up to 30 s for a lock held by another connection
+}
+# Prepared statements kept per connection; pooled connections keep them between uses
+STATEMENT_CACHE_SIZE = 256
+# Idle connections kept per database
+POOL_SIZE = 4
+
+
+def open_connection(db_file, read_only=False):
+    """
+    Open a connection with DATABASE_PRAGMAS applied. The connection may be used from any thread,
+    but only by one thread at a time.
+    """
+    if read_only:
+        conn = sqlite3.connect(f"file:{os.path.abspath(db_file)}?mode=ro", uri=True,
+                               cached_statements=STATEMENT_CACHE_SIZE, check_same_thread=False)
+    else:
+        conn = sqlite3.connect(db_file, timeout=DATABASE_PRAGMAS["busy_timeout"] / 1000,
+                               cached_statements=STATEMENT_CACHE_SIZE, check_same_thread=False)
+    for pragma, value in DATABASE_PRAGMAS.items():
+        # The journal mode is stored in the database file and cannot be changed through a read-only connection
+        if read_only and pragma == "journal_mode":
+            continue
+        conn.execute(f"PRAGMA {pragma} = {value}")
+    return conn
+
+
+class ConnectionPool:
+    """
+    Keep a few open connections to one database, so short-lived users do not pay for opening a connection,
+    applying the settings and preparing their statements every time.
+    """
+
+    def __init__(self, db_file, size=POOL_SIZE):
+        self.db_file = db_file
+        self.size = size
+        self._idle = []
+        self._open = set()  # Connections opened since the pool was last closed
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Take an idle connection from the pool, or open a new one.
+        """
+        with self._lock:
+            if self._idle:
+                return self._idle.pop()
+        conn = open_connection(self.db_file)
+        with self._lock:
+            self._open.add(conn)
+        return conn
+
+    def release(self, conn):
+        """
+        Return a connection to the pool; it is closed if the pool is full or was closed in the meantime.
+        """
+        if conn.in_transaction:
+            conn.rollback()
+        with self._lock:
+            if conn in self._open and len(self._idle) < self.size:
+                self._idle.append(conn)
+                return
+            self._open.discard(conn)
+        conn.close()
+
+    @contextmanager
+    def connection(self):
+        """
+        Borrow a connection for the duration of a with-block.
+        """
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    def close_all(self):
+        """
+        Close all idle connections; connections that are in use are closed when they are returned.
+        """
+        with self._lock:
+            idle, self._idle = self._idle, []
+            self._open.clear()
+        for conn in idle:
+            conn.close()
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(db_file=DATABASE_FILE):
+    """
+    Return the shared connection pool for a database file.
+    """
+    key = os.path.abspath(db_file)
+    with _pools_lock:
+        if key not in _pools:
+            _pools[key] = ConnectionPool(db_file)
+        return _pools[key]
+
+
+def close_all_pools():
+    """
+    Close the pooled connections of every database, for example before the database file is replaced.
+    """
+    with _pools_lock:
+        pools = list(_pools.values())
+    for pool in pools:
+        pool.close_all()
+
+
+@contextmanager
+def read_connection(conn):
+    """
+    Borrow a pooled connection to the same database as conn for a read-only query. The read runs on its own
+    WAL snapshot, so it neither waits for nor blocks a write that is being committed on the session connection.
+    While conn has an open transaction, or for an in-memory database, conn itself is used, so the read sees
+    its uncommitted changes.
+    """
+    db_file = conn.execute("PRAGMA database_list").fetchone()[2]
+    if conn.in_transaction or not db_file:
+        yield conn
+        return
+    with get_pool(db_file).connection() as pooled:
+        yield pooled
+
+
+def connection_settings(conn):
+    """
+    Return the effective values of DATABASE_PRAGMAS for a connection.
+    """
+    return {pragma: conn.execute(f"PRAGMA {pragma}").fetchone()[0] for pragma in DATABASE_PRAGMAS}
+
+
+def report_connection_settings(conn):
+    """
+    Print the effective connection settings, so a misconfigured database is noticed at startup.
+    """
+    settings = ", ".join(f"{pragma}={value}" for pragma, value in connection_settings(conn).items())
+    print(f"SQLite settings: {settings}, cached_statements={STATEMENT_CACHE_SIZE}, pool_size={POOL_SIZE}")
+    logging.info(f"SQLite settings: {settings}")
+
+
 def create_connection(db_file):
     """
     Create a database connection to the SQLite database specified by db_file.
     """
     conn = None
     try:
-        conn = sqlite3.connect(db_file)
+        conn = open_connection(db_file)
         print(f"SQLite connection is successful: {sqlite3.version}")
     except Error as e:
         print(e)
     return conn
 
 
+def add_column_if_missing(conn, table, column, definition):
+    """
+    Add a column to an existing table if it does not exist yet.
+    """
+    cursor = conn.cursor()
+    cursor.execute(f"PRAGMA table_info({table})")
+    existing_columns = [row[1] for row in cursor.fetchall()]
+    if column not in existing_columns:
+        cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+        conn.commit()
+
+
+def create_logs_table(conn):
+    """
+    Create the audit log table and its indexes.
+    Only the log number, date and time are stored in plaintext, next to a suspicious flag that can be indexed.
+    """
+    cursor = conn.cursor()
+
+    # The logs table of older releases was never written to and lacks AUTOINCREMENT; recreate it
+    cursor.execute("SELECT sql FROM sqlite_master WHERE type='table' AND name='logs'")
+    row = cursor.fetchone()
+    if row and "AUTOINCREMENT" not in row[0].upper():
+        cursor.execute("SELECT COUNT(*) FROM logs")
+        if cursor.fetchone()[0] == 0:
+            cursor.execute("DROP TABLE logs")
+
+    sql_create_logs_table = """CREATE TABLE IF NOT EXISTS logs (
+                                   id INTEGER PRIMARY KEY AUTOINCREMENT,  -- Log number, never reused
+                                   date TEXT NOT NULL,
+                                   time TEXT NOT NULL,
+                                   created_at TEXT NOT NULL DEFAULT '',  -- Sortable 'YYYY-MM-DD HH:MM:SS'
+                                   username TEXT,
+                                   description TEXT NOT NULL,
+                                   additional_info TEXT,
+                                   suspicious TEXT NOT NULL,
+                                   is_suspicious INTEGER NOT NULL DEFAULT 0
+                               );"""
+    cursor.execute(sql_create_logs_table)
+    add_column_if_missing(conn, "logs", "created_at", "TEXT NOT NULL DEFAULT ''")
+    add_column_if_missing(conn, "logs", "is_suspicious", "INTEGER NOT NULL DEFAULT 0")
+    add_column_if_missing(conn, "logs", "username_index", "TEXT")  # Blind index of the lowercased username
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_logs_created_at ON logs (created_at)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_logs_username_index ON logs (username_index, id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_logs_is_suspicious ON logs (is_suspicious, id)")
+
+    # Per admin the highest log number up to which suspicious activity has been seen
+    cursor.execute("""CREATE TABLE IF NOT EXISTS log_watermarks (
+                          user_id INTEGER PRIMARY KEY,
+                          last_read_log_id INTEGER NOT NULL
+                      );""")
+    conn.commit()
+
+
 def create_tables(conn):
     """
     Create the necessary tables in the SQLite database.
@@ -30,7 +241,8 @@ def create_tables(conn):
                                         role TEXT NOT NULL,
                                         first_name TEXT NOT NULL,
                                         last_name TEXT NOT NULL,
-                                        registration_date TEXT NOT NULL
+                                        registration_date TEXT NOT NULL,
+                                        username_index TEXT  -- Blind index of the lowercased username
                                     );"""
 
         sql_create_members_table = """CREATE TABLE IF NOT EXISTS members (
@@ -44,28 +256,96 @@ def create_tables(conn):
                                         email TEXT,
                                         phone TEXT,
                                         registration_date TEXT NOT NULL,
-                                        membership_id TEXT NOT NULL
+                                        membership_id TEXT NOT NULL,
+                                        record TEXT,  -- All sensitive fields as one encrypted payload
+                                        membership_id_index TEXT  -- Blind index of the membership ID
                                     );"""
 
-        sql_create_logs_table = """CREATE TABLE IF NOT EXISTS logs (
-                                       id INTEGER PRIMARY KEY,
-                                       date TEXT NOT NULL,
-                                       time TEXT NOT NULL,
-                                       username TEXT,
-                                       description TEXT NOT NULL,
-                                       additional_info TEXT,
-                                       suspicious TEXT NOT NULL
-                                   );"""
+        # Keyed n-gram tokens of the searchable member fields, used to narrow down partial-match searches
+        sql_create_member_search_index_table = """CREATE TABLE IF NOT EXISTS member_search_index (
+                                                      token TEXT NOT NULL,
+                                                      member_id INTEGER NOT NULL,
+                                                      PRIMARY KEY (token, member_id)
+                                                  ) WITHOUT ROWID;"""
+
+        # Blind indexes of every membership ID ever handed out, so a new ID can be checked without decrypting
+        sql_create_membership_ids_table = """CREATE TABLE IF NOT EXISTS membership_ids (
+                                                 id_index TEXT PRIMARY KEY
+                                             ) WITHOUT ROWID;"""
 
         cursor = conn.cursor()
         cursor.execute(sql_create_users_table)
         cursor.execute(sql_create_members_table)
-        cursor.execute(sql_create_logs_table)
+        create_logs_table(conn)
+        cursor.execute(sql_create_member_search_index_table)
+        cursor.execute(sql_create_membership_ids_table)
+
+        # Columns added after the first release; older databases need them as well
+        add_column_if_missing(conn, "members", "record", "TEXT")
+        add_column_if_missing(conn, "users", "username_index", "TEXT")
+        add_column_if_missing(conn, "members", "membership_id_index", "TEXT")
+
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_users_username_index ON users (username_index)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_members_membership_id_index ON members (membership_id_index)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_member_search_index_member_id ON member_search_index (member_id)")
+        # Watermarks of users that were deleted before their watermark was deleted along with them
+        cursor.execute("DELETE FROM log_watermarks WHERE user_id NOT IN (SELECT id FROM users)")
+        conn.commit()
         print("Tables created successfully.")
+
+        backfill_blind_indexes(conn)
+        backfill_search_index(conn)
     except Error as e:
         logging.error(f"Error creating tables: {e}")
 
 
+def backfill_blind_indexes(conn):
+    """
+    Fill the blind index columns of users and members that were stored before the columns existed.
+    """
+    # Imported here because member.py imports this module
+    from member import MEMBER_COLUMNS, decrypt_member_row
+
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT id, username FROM users WHERE username_index IS NULL")
+        for user_id, encrypted_username in cursor.fetchall():
+            try:
+                username = decrypt_data(encrypted_username)
+            except Exception as e:
+                logging.error(f"Error decrypting username of user {user_id} for the blind index: {e}")
+                continue
+            cursor.execute("UPDATE users SET username_index=? WHERE id=?", (blind_index(username.lower()), user_id))
+
+        cursor.execute(f"SELECT {MEMBER_COLUMNS} FROM members WHERE membership_id_index IS NULL")
+        for row in cursor.fetchall():
+            try:
+                membership_id = decrypt_member_row(row)["membership_id"]
+            except Exception as e:
+                logging.error(f"Error decrypting membership ID of member {row[0]} for the blind index: {e}")
+                continue
+            cursor.execute("UPDATE members SET membership_id_index=? WHERE id=?", (blind_index(membership_id), row[0]))
+
+        # Reserve the membership IDs of existing members, so they are never handed out again
+        cursor.execute("""INSERT OR IGNORE INTO membership_ids (id_index)
+                          SELECT membership_id_index FROM members WHERE membership_id_index IS NOT NULL""")
+        conn.commit()
+    except Error as e:
+        logging.error(f"Error backfilling blind indexes: {e}")
+
+
+def backfill_search_index(conn):
+    """
+    Add members that were stored before the search index existed to the search index.
+    """
+    from member import backfill_search_index as backfill_member_search_index
+
+    try:
+        backfill_member_search_index(conn)
+    except Error as e:
+        logging.error(f"Error backfilling the member search index: {e}")
+
+
 def add_super_admin(conn):
     """
     Voeg de super admin gebruiker toe aan de database als deze nog niet bestaat.
@@ -81,7 +361,7 @@ def add_super_admin(conn):
 
         # Controleer of een super admin al bestaat op basis van de gebruikersnaam
         cur = conn.cursor()
-        cur.execute("SELECT username FROM users")
+        cur.execute("SELECT username FROM users WHERE username_index=?", (blind_index("super_admin"),))
         rows = cur.fetchall()
 
         for row in rows:
@@ -99,11 +379,12 @@ def add_super_admin(conn):
 
         # Voeg de super admin toe aan de database
         sql = """
-            INSERT INTO users (username, password, role, first_name, last_name, registration_date)
-            VALUES (?, ?, ?, ?, ?, ?)
+            INSERT INTO users (username, username_index, password, role, first_name, last_name, registration_date)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
         """
         cur.execute(sql, (
             encrypted_username,
+            blind_index("super_admin"),
             hashed_password,
             encrypted_role,
             encrypted_first_name,
@@ -1,11 +1,109 @@
+import base64
 import hashlib
+import hmac
+import json
+import os
+import threading
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from cryptography.hazmat.primitives import serialization, hashes
 from cryptography.hazmat.primitives.asymmetric import rsa, padding
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
 
-def generate_keys():
+# Definieer constanten voor sleutelbestanden
+PRIVATE_KEY_FILE = "data/private_key.pem"
+PUBLIC_KEY_FILE = "data/public_key.pem"
+DATA_KEY_FILE = "data/data_key.bin"  # AES-datasleutel, versleuteld met de RSA publieke sleutel
+INDEX_KEY_FILE = "data/index_key.bin"  # HMAC-sleutel voor blind indexes, versleuteld met de RSA publieke sleutel
+
+# Na een sleutelrotatie staan de sleutels van elke nieuwe versie in eigen bestanden (zie key_files);
+# dit bestand houdt bij welke versie actief is en of er nog een rotatie loopt
+KEY_STATE_FILE = "data/key_state.json"
+# De oorspronkelijke sleutelbestanden; waarden zonder sleutelversie zijn hiermee versleuteld
+LEGACY_KEY_ID = 1
+
+# Versleutelingsmodus voor nieuwe waarden: "envelope" (AES-GCM met RSA-verpakte datasleutel) of "rsa"
+CIPHER_MODE = "envelope"
+
+# Prefix voor envelope-versleutelde waarden; waarden zonder prefix zijn oude RSA-waarden
+ENVELOPE_PREFIX = "v2:"
+NONCE_SIZE = 12
+
+# Opslagformaat voor nieuwe versleutelde waarden:
+#   "binary" - ruwe bytes (BLOB in SQLite): een typebyte gevolgd door de ciphertext
+#   "base64" - dezelfde bytes als base64-tekst met BASE64_PREFIX, voor plekken waar alleen tekst kan
+#   "hex"    - het oude hex-formaat (twee keer zo groot)
+# Bestaande waarden in elk van deze formaten worden altijd herkend.
+CIPHER_ENCODING = "binary"
+BASE64_PREFIX = "b64:"
+
+# Typebytes voor het binaire formaat. Waarden van een nieuwere sleutelversie krijgen de typebyte plus
+# KEYED_TAG_OFFSET, gevolgd door de sleutelversie in twee bytes; in het hex-formaat krijgen ze KEYED_PREFIX
+RSA_TAG = 0x01
+ENVELOPE_TAG = 0x02
+KEYED_TAG_OFFSET = 0x02
+KEYED_PREFIX = "v3:"
+
+# Vanaf dit aantal RSA-bewerkingen wordt het werk over meerdere processen verdeeld;
+# daaronder kost het opstarten van de processen meer dan het oplevert
+PARALLEL_THRESHOLD = 32
+
+# OAEP-padding is stateless en kan dus door alle aanroepen gedeeld worden
+OAEP_PADDING = padding.OAEP(
+    mgf=padding.MGF1(algorithm=hashes.SHA256()),
+    algorithm=hashes.SHA256(),
+    label=None
+)
+
+def key_files(key_id: int = None) -> dict:
+    """
+    Geef de bestandsnamen van de sleutels van een sleutelversie terug (standaard de actieve versie).
+    Versie LEGACY_KEY_ID gebruikt de oorspronkelijke bestandsnamen.
+    """
+    key_id = key_id or active_key_id()
+    if key_id == LEGACY_KEY_ID:
+        return {"private": PRIVATE_KEY_FILE, "public": PUBLIC_KEY_FILE, "data": DATA_KEY_FILE, "index": INDEX_KEY_FILE}
+    return {
+        "private": f"data/private_key.{key_id}.pem",
+        "public": f"data/public_key.{key_id}.pem",
+        "data": f"data/data_key.{key_id}.bin",
+        "index": f"data/index_key.{key_id}.bin",
+    }
+
+def load_key_state() -> dict:
+    """
+    Lees de sleutelstatus: de actieve sleutelversie, de vorige versie en of er een rotatie loopt.
+    """
+    if not os.path.exists(KEY_STATE_FILE):
+        return {"active": LEGACY_KEY_ID, "previous": None, "rotating": False}
+    with open(KEY_STATE_FILE, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def save_key_state(state: dict):
+    """
+    Schrijf de sleutelstatus atomair weg.
+    """
+    temp_file = KEY_STATE_FILE + ".tmp"
+    with open(temp_file, "w", encoding="utf-8") as f:
+        json.dump(state, f, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_file, KEY_STATE_FILE)
+    key_manager.invalidate()
+
+def active_key_id() -> int:
+    """
+    Geef de sleutelversie terug waarmee nieuwe waarden versleuteld worden.
+    """
+    return key_manager.key_state()["active"]
+
+def generate_keys(key_id: int = None):
     """
     Genereer RSA publieke en private sleutels en sla ze op in bestanden.
     """
+    files = key_files(key_id)
     private_key = rsa.generate_private_key(
         public_exponent=65537,
         key_size=2048,
@@ -13,7 +111,7 @@ def generate_keys():
     public_key = private_key.public_key()
 
     # Sla de private sleutel op
-    with open("data/private_key.pem", "wb") as f:
+    with open(files["private"], "wb") as f:
         f.write(private_key.private_bytes(
             encoding=serialization.Encoding.PEM,
             format=serialization.PrivateFormat.PKCS8,
@@ -21,65 +119,467 @@ def generate_keys():
         ))
 
     # Sla de publieke sleutel op
-    with open("data/public_key.pem", "wb") as f:
+    with open(files["public"], "wb") as f:
         f.write(public_key.public_bytes(
             encoding=serialization.Encoding.PEM,
             format=serialization.PublicFormat.SubjectPublicKeyInfo
         ))
 
-def load_private_key() -> rsa.RSAPrivateKey:
+    # Zorg ervoor dat er geen oude sleutels in het geheugen blijven hangen
+    key_manager.invalidate()
+
+def load_private_key(path: str = PRIVATE_KEY_FILE) -> rsa.RSAPrivateKey:
     """
     Laad de private sleutel uit het bestand.
     """
     try:
-        with open("data/private_key.pem", "rb") as key_file:
+        with open(path, "rb") as key_file:
             private_key = serialization.load_pem_private_key(
                 key_file.read(),
                 password=None,
             )
         return private_key
     except FileNotFoundError:
-        raise Exception("Private key file not found. Ensure 'private_key.pem' is generated and placed in 'data' directory.")
+        raise Exception(f"Private key file not found. Ensure '{os.path.basename(path)}' is generated and placed in 'data' directory.")
 
-def load_public_key() -> rsa.RSAPublicKey:
+def load_public_key(path: str = PUBLIC_KEY_FILE) -> rsa.RSAPublicKey:
     """
     Laad de publieke sleutel uit het bestand.
     """
     try:
-        with open("data/public_key.pem", "rb") as key_file:
+        with open(path, "rb") as key_file:
             public_key = serialization.load_pem_public_key(
                 key_file.read()
             )
         return public_key
     except FileNotFoundError:
-        raise Exception("Public key file not found. Ensure 'public_key.pem' is generated and placed in 'data' directory.")
+        raise Exception(f"Public key file not found. Ensure '{os.path.basename(path)}' is generated and placed in 'data' directory.")
+
+def generate_data_key(key_id: int = None):
+    """
+    Genereer een nieuwe AES-256 datasleutel en sla deze versleuteld met de RSA publieke sleutel op.
+    """
+    files = key_files(key_id)
+    data_key = AESGCM.generate_key(bit_length=256)
+    wrapped_key = load_public_key(files["public"]).encrypt(data_key, OAEP_PADDING)
+    with open(files["data"], "wb") as f:
+        f.write(wrapped_key)
+    key_manager.invalidate()
+
+def load_data_key(key_id: int = None) -> AESGCM:
+    """
+    Laad de datasleutel uit het bestand en pak deze uit met de RSA private sleutel.
+    """
+    files = key_files(key_id)
+    try:
+        with open(files["data"], "rb") as key_file:
+            wrapped_key = key_file.read()
+    except FileNotFoundError:
+        raise Exception(f"Data key file not found. Ensure '{os.path.basename(files['data'])}' is generated and placed in 'data' directory.")
+    return AESGCM(key_manager.private_key(key_id).decrypt(wrapped_key, OAEP_PADDING))
+
+def generate_index_key(key_id: int = None, index_key: bytes = None):
+    """
+    Genereer een nieuwe HMAC-sleutel voor blind indexes en sla deze versleuteld met de RSA publieke sleutel op.
+    Met index_key wordt een bestaande HMAC-sleutel onder de sleutels van deze versie opgeslagen.
+    """
+    files = key_files(key_id)
+    wrapped_key = load_public_key(files["public"]).encrypt(index_key or os.urandom(32), OAEP_PADDING)
+    with open(files["index"], "wb") as f:
+        f.write(wrapped_key)
+    key_manager.invalidate()
+
+def load_index_key(key_id: int = None) -> bytes:
+    """
+    Laad de HMAC-sleutel voor blind indexes en pak deze uit met de RSA private sleutel.
+    """
+    files = key_files(key_id)
+    try:
+        with open(files["index"], "rb") as key_file:
+            wrapped_key = key_file.read()
+    except FileNotFoundError:
+        raise Exception(f"Index key file not found. Ensure '{os.path.basename(files['index'])}' is generated and placed in 'data' directory.")
+    return key_manager.private_key(key_id).decrypt(wrapped_key, OAEP_PADDING)
+
+def ensure_data_key():
+    """
+    Genereer de datasleutel en de indexsleutel van de actieve sleutelversie als deze nog niet bestaan.
+    """
+    files = key_files()
+    if not os.path.exists(files["data"]):
+        generate_data_key()
+    if not os.path.exists(files["index"]):
+        generate_index_key()
 
-def encrypt_data(data: str) -> str:
+def create_key_version() -> int:
+    """
+    Maak een nieuwe sleutelversie aan: een nieuw RSA-sleutelpaar en een nieuwe datasleutel.
+    De HMAC-sleutel van de blind indexes wordt overgenomen (opnieuw verpakt), zodat alle indexen tijdens en na
+    een rotatie blijven werken. De nieuwe versie wordt nog niet actief; geeft het versienummer terug.
+    """
+    # Versies worden alleen opgehoogd; sleutels van een versie die na het terugzetten van een oudere back-up
+    # niet meer actief is, worden nooit overschreven
+    key_id = load_key_state()["active"] + 1
+    while os.path.exists(key_files(key_id)["private"]):
+        key_id += 1
+    index_key = key_manager.index_key()
+    generate_keys(key_id)
+    generate_data_key(key_id)
+    generate_index_key(key_id, index_key)
+    return key_id
+
+class KeyManager:
+    """
+    Houd de RSA-sleutels voor de levensduur van het proces in het geheugen.
+    Een sleutel wordt alleen opnieuw ingelezen als het bestand op schijf is gewijzigd.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._keys = {}  # pad -> (bestandshandtekening, sleutel)
+
+    @staticmethod
+    def _file_signature(path: str):
+        """
+        Geef een goedkope handtekening van het sleutelbestand terug, of None als het ontbreekt.
+        """
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+
+    def _get_key(self, path: str, loader):
+        signature = self._file_signature(path)
+        cached = self._keys.get(path)
+        if cached is not None and signature is not None and cached[0] == signature:
+            return cached[1]
+
+        with self._lock:
+            # Een andere thread kan de sleutel inmiddels al geladen hebben
+            cached = self._keys.get(path)
+            if cached is not None and signature is not None and cached[0] == signature:
+                return cached[1]
+            key = loader()
+            self._keys[path] = (signature, key)
+            return key
+
+    def key_state(self) -> dict:
+        """
+        Geef de (gecachte) sleutelstatus terug.
+        """
+        return self._get_key(KEY_STATE_FILE, load_key_state)
+
+    def private_key(self, key_id: int = None) -> rsa.RSAPrivateKey:
+        """
+        Geef de (gecachte) private sleutel van een sleutelversie terug (standaard de actieve).
+        """
+        path = key_files(key_id)["private"]
+        return self._get_key(path, lambda: load_private_key(path))
+
+    def public_key(self, key_id: int = None) -> rsa.RSAPublicKey:
+        """
+        Geef de (gecachte) publieke sleutel van een sleutelversie terug (standaard de actieve).
+        """
+        path = key_files(key_id)["public"]
+        return self._get_key(path, lambda: load_public_key(path))
+
+    def data_key(self, key_id: int = None) -> AESGCM:
+        """
+        Geef de (gecachte) uitgepakte AES-GCM datasleutel van een sleutelversie terug (standaard de actieve).
+        """
+        return self._get_key(key_files(key_id)["data"], lambda: load_data_key(key_id))
+
+    def index_key(self) -> bytes:
+        """
+        Geef de (gecachte) uitgepakte HMAC-sleutel voor blind indexes terug.
+        """
+        return self._get_key(key_files()["index"], load_index_key)
+
+    def invalidate(self):
+        """
+        Vergeet alle gecachte sleutels zodat ze bij het volgende gebruik opnieuw geladen worden.
+        """
+        with self._lock:
+            self._keys.clear()
+
+
+# Gedeelde sleutelbeheerder voor het hele proces
+key_manager = KeyManager()
+
+def _binary_ciphertext(tag: int, raw: bytes, key_id: int) -> bytes:
+    """
+    Zet ruwe ciphertext om naar het binaire formaat; waarden van een nieuwere sleutelversie dragen hun versie mee.
+    """
+    if key_id == LEGACY_KEY_ID:
+        return bytes([tag]) + raw
+    return bytes([tag + KEYED_TAG_OFFSET]) + key_id.to_bytes(2, "big") + raw
+
+def encode_ciphertext(tag: int, raw: bytes, encoding: str = None, key_id: int = LEGACY_KEY_ID):
+    """
+    Zet ruwe ciphertext om naar het opslagformaat (standaard CIPHER_ENCODING).
+    Geeft bytes terug voor "binary" en tekst voor "base64" en "hex".
+    """
+    encoding = encoding or CIPHER_ENCODING
+    if encoding == "binary":
+        return _binary_ciphertext(tag, raw, key_id)
+    if encoding == "base64":
+        return BASE64_PREFIX + base64.b64encode(_binary_ciphertext(tag, raw, key_id)).decode("ascii")
+    if key_id != LEGACY_KEY_ID:
+        return KEYED_PREFIX + _binary_ciphertext(tag, raw, key_id).hex()
+    if tag == ENVELOPE_TAG:
+        return ENVELOPE_PREFIX + raw.hex()
+    return raw.hex()
+
+def _decode_binary(data: bytes) -> tuple:
+    tag = data[0]
+    if tag > KEYED_TAG_OFFSET:
+        return tag - KEYED_TAG_OFFSET, data[3:], int.from_bytes(data[1:3], "big")
+    return tag, data[1:], LEGACY_KEY_ID
+
+def decode_ciphertext(encrypted_data) -> tuple:
+    """
+    Herken het opslagformaat van een versleutelde waarde en geef (typebyte, ruwe ciphertext, sleutelversie) terug.
+    """
+    if isinstance(encrypted_data, memoryview):
+        encrypted_data = bytes(encrypted_data)
+    if isinstance(encrypted_data, bytes):
+        return _decode_binary(encrypted_data)
+    if encrypted_data.startswith(BASE64_PREFIX):
+        return _decode_binary(base64.b64decode(encrypted_data[len(BASE64_PREFIX):]))
+    if encrypted_data.startswith(KEYED_PREFIX):
+        return _decode_binary(bytes.fromhex(encrypted_data[len(KEYED_PREFIX):]))
+    if encrypted_data.startswith(ENVELOPE_PREFIX):
+        return ENVELOPE_TAG, bytes.fromhex(encrypted_data[len(ENVELOPE_PREFIX):]), LEGACY_KEY_ID
+    return RSA_TAG, bytes.fromhex(encrypted_data), LEGACY_KEY_ID
+
+def ciphertext_encoding(encrypted_data) -> str:
+    """
+    Geef het opslagformaat ("binary", "base64" of "hex") van een versleutelde waarde terug.
+    """
+    if isinstance(encrypted_data, (bytes, memoryview)):
+        return "binary"
+    if encrypted_data.startswith(BASE64_PREFIX):
+        return "base64"
+    return "hex"
+
+def ciphertext_key_id(encrypted_data) -> int:
+    """
+    Geef de sleutelversie terug waarmee een waarde versleuteld is.
+    """
+    return decode_ciphertext(encrypted_data)[2]
+
+def encrypt_data(data: str):
+    """
+    Versleutel de gegeven data volgens de ingestelde CIPHER_MODE en CIPHER_ENCODING.
+    """
+    if CIPHER_MODE == "envelope":
+        return encrypt_envelope(data)
+    return encrypt_rsa(data)
+
+def decrypt_data(encrypted_data) -> str:
+    """
+    Ontsleutel de gegeven versleutelde data; het formaat en de sleutelversie worden aan de typebyte of prefix herkend.
+    """
+    tag, raw, key_id = decode_ciphertext(encrypted_data)
+    if tag == ENVELOPE_TAG:
+        return _decrypt_envelope_raw(raw, key_id)
+    return _decrypt_rsa_raw(raw, key_id)
+
+def encrypt_rsa(data: str):
     """
     Versleutel de gegeven data met behulp van RSA publieke sleutel encryptie.
     """
-    public_key = load_public_key()
-    encrypted_data = public_key.encrypt(
-        data.encode(),
-        padding.OAEP(
-            mgf=padding.MGF1(algorithm=hashes.SHA256()),
-            algorithm=hashes.SHA256(),
-            label=None
-        )
-    )
-    return encrypted_data.hex()
+    key_id = active_key_id()
+    public_key = key_manager.public_key(key_id)
+    encrypted_data = public_key.encrypt(data.encode(), OAEP_PADDING)
+    return encode_ciphertext(RSA_TAG, encrypted_data, key_id=key_id)
 
-def decrypt_data(encrypted_data: str) -> str:
+def decrypt_rsa(encrypted_data) -> str:
     """
     Ontsleutel de gegeven versleutelde data met behulp van RSA private sleutel decryptie.
     """
-    private_key = load_private_key()
-    decrypted_data = private_key.decrypt(
-        bytes.fromhex(encrypted_data),
-        padding.OAEP(
-            mgf=padding.MGF1(algorithm=hashes.SHA256()),
-            algorithm=hashes.SHA256(),
-            label=None
-        )
-    )
-    return decrypted_data.decode()
\ No newline at end of file
+    _, raw, key_id = decode_ciphertext(encrypted_data)
+    return _decrypt_rsa_raw(raw, key_id)
+
+def _decrypt_rsa_raw(raw: bytes, key_id: int) -> str:
+    decrypted_data = key_manager.private_key(key_id).decrypt(raw, OAEP_PADDING)
+    return decrypted_data.decode()
+
+def encrypt_envelope(data: str):
+    """
+    Versleutel de gegeven data met AES-GCM en de door RSA verpakte datasleutel.
+    """
+    key_id = active_key_id()
+    nonce = os.urandom(NONCE_SIZE)
+    encrypted_data = key_manager.data_key(key_id).encrypt(nonce, data.encode(), None)
+    return encode_ciphertext(ENVELOPE_TAG, nonce + encrypted_data, key_id=key_id)
+
+def decrypt_envelope(encrypted_data) -> str:
+    """
+    Ontsleutel een envelope-versleutelde waarde.
+    """
+    _, raw, key_id = decode_ciphertext(encrypted_data)
+    return _decrypt_envelope_raw(raw, key_id)
+
+def _decrypt_envelope_raw(raw: bytes, key_id: int) -> str:
+    decrypted_data = key_manager.data_key(key_id).decrypt(raw[:NONCE_SIZE], raw[NONCE_SIZE:], None)
+    return decrypted_data.decode()
+
+def is_envelope(encrypted_data) -> bool:
+    """
+    Controleer of een versleutelde waarde met de envelope-versleuteling gemaakt is.
+    """
+    return decode_ciphertext(encrypted_data)[0] == ENVELOPE_TAG
+
+def needs_reencryption(encrypted_data) -> bool:
+    """
+    Controleer of een versleutelde waarde nog niet in de huidige CIPHER_MODE of met de actieve sleutelversie
+    versleuteld is.
+    """
+    tag, _, key_id = decode_ciphertext(encrypted_data)
+    return (tag == ENVELOPE_TAG) != (CIPHER_MODE == "envelope") or key_id != active_key_id()
+
+def reencrypt_data(encrypted_data):
+    """
+    Versleutel een bestaande waarde opnieuw in de huidige CIPHER_MODE met de actieve sleutelversie.
+    """
+    return encrypt_data(decrypt_data(encrypted_data))
+
+def needs_reencoding(encrypted_data) -> bool:
+    """
+    Controleer of een versleutelde waarde nog niet in het huidige CIPHER_ENCODING staat.
+    """
+    return ciphertext_encoding(encrypted_data) != CIPHER_ENCODING
+
+def reencode_data(encrypted_data):
+    """
+    Zet een bestaande waarde om naar het huidige CIPHER_ENCODING. Hiervoor hoeft niets ontsleuteld te worden.
+    """
+    tag, raw, key_id = decode_ciphertext(encrypted_data)
+    return encode_ciphertext(tag, raw, key_id=key_id)
+
+def blind_index(value: str) -> str:
+    """
+    Bereken een blind index (HMAC-SHA256 met de indexsleutel) van een waarde.
+    Gelijke waarden geven dezelfde index, zodat er zonder ontsleutelen op gezocht kan worden.
+    """
+    return hmac.new(key_manager.index_key(), value.encode(), hashlib.sha256).hexdigest()
+
+_executor = None
+_executor_lock = threading.Lock()
+
+def _get_executor() -> ProcessPoolExecutor:
+    """
+    Geef de gedeelde procespool terug, met een proces per CPU-kern.
+    De processen worden niet geforkt: een fork terwijl de log- of rotatiethread een lock vasthoudt
+    (van de KeyManager, logging of SQLite) kan het kindproces laten vastlopen.
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+            _executor = ProcessPoolExecutor(max_workers=os.cpu_count() or 1, mp_context=multiprocessing.get_context(method))
+        return _executor
+
+def shutdown_executor():
+    """
+    Stop de gedeelde procespool; bij het volgende gebruik wordt een nieuwe gestart.
+    """
+    global _executor
+    with _executor_lock:
+        executor, _executor = _executor, None
+    if executor is not None:
+        executor.shutdown()
+
+def _decrypt_chunk(encrypted_values: list) -> list:
+    return [_decrypt_or_error(value) for value in encrypted_values]
+
+def _encrypt_chunk(values: list) -> list:
+    return [encrypt_data(value) for value in values]
+
+def _decrypt_or_error(encrypted_data):
+    """
+    Ontsleutel een waarde; een fout wordt teruggegeven in plaats van opgegooid.
+    """
+    try:
+        return decrypt_data(encrypted_data)
+    except Exception as e:
+        return e
+
+def _run_parallel(function, values: list) -> list:
+    """
+    Verdeel de waarden in blokken over de procespool en geef de resultaten in dezelfde volgorde terug.
+    Als de pool niet (meer) bruikbaar is, bijvoorbeeld wanneer de achtergrondschrijver bij het afsluiten
+    nog logs wegschrijft, wordt alles in dit proces gedaan.
+    """
+    global _executor
+    workers = os.cpu_count() or 1
+    chunk_size = max(1, -(-len(values) // (workers * 4)))
+    chunks = [values[i:i + chunk_size] for i in range(0, len(values), chunk_size)]
+    try:
+        results = []
+        for chunk_result in _get_executor().map(function, chunks):
+            results.extend(chunk_result)
+        return results
+    except (RuntimeError, BrokenProcessPool) as e:
+        logging.warning(f"Process pool unavailable, continuing without it: {e}")
+        if isinstance(e, BrokenProcessPool):
+            with _executor_lock:
+                _executor = None
+        return function(values)
+
+def _as_ciphertext(value):
+    """
+    Laat bytes (BLOB) en tekst ongemoeid; andere waarden worden als tekst behandeld.
+    """
+    if isinstance(value, (bytes, str)):
+        return value
+    if isinstance(value, memoryview):
+        return bytes(value)
+    return str(value)
+
+def _is_envelope_or_error(encrypted_data) -> bool:
+    # Onleesbare waarden worden niet naar de procespool gestuurd; de fout komt bij het ontsleutelen
+    try:
+        return is_envelope(encrypted_data)
+    except Exception:
+        return True
+
+def decrypt_many(encrypted_values: list, errors: str = "raise") -> list:
+    """
+    Ontsleutel een lijst van waarden en geef de resultaten in dezelfde volgorde terug.
+    Dure RSA-waarden worden over alle CPU-kernen verdeeld; envelope-waarden worden direct ontsleuteld.
+    Met errors="ignore" wordt een waarde die niet ontsleuteld kan worden None in plaats van een fout.
+    """
+    encrypted_values = [_as_ciphertext(value) for value in encrypted_values]
+    results = [None] * len(encrypted_values)
+
+    rsa_positions = [i for i, value in enumerate(encrypted_values) if not _is_envelope_or_error(value)]
+    if len(rsa_positions) < PARALLEL_THRESHOLD:
+        rsa_positions = []
+    rsa_results = _run_parallel(_decrypt_chunk, [encrypted_values[i] for i in rsa_positions]) if rsa_positions else []
+    for position, result in zip(rsa_positions, rsa_results):
+        results[position] = result
+
+    parallel_positions = set(rsa_positions)
+    for i, value in enumerate(encrypted_values):
+        if i not in parallel_positions:
+            results[i] = _decrypt_or_error(value)
+
+    for i, result in enumerate(results):
+        if isinstance(result, Exception):
+            if errors == "raise":
+                raise result
+            results[i] = None
+    return results
+
+def encrypt_many(values: list) -> list:
+    """
+    Versleutel een lijst van waarden en geef de resultaten in dezelfde volgorde terug.
+    In de RSA-modus wordt het werk over alle CPU-kernen verdeeld.
+    """
+    values = [str(value) for value in values]
+    if CIPHER_MODE != "envelope" and len(values) >= PARALLEL_THRESHOLD:
+        return _run_parallel(_encrypt_chunk, values)
+    return [encrypt_data(value) for value in values]
@@ -0,0 +1,297 @@
+import time
+import logging
+import sqlite3
+import argparse
+import threading
+from contextlib import closing
+from datetime import datetime
+from encrypt_decrypt import (
+    load_key_state, save_key_state, create_key_version, ensure_data_key, decode_ciphertext, decrypt_many,
+    encrypt_envelope, encrypt_rsa, ENVELOPE_TAG
+)
+from database import DATABASE_FILE, open_connection
+from log import log_activity, flush_logs, import_log_file, load_segment_manifest, LOG_SEGMENT_DIR
+from migrate import USER_ENCRYPTED_COLUMNS, MEMBER_RECORD_COLUMNS, LOG_ENCRYPTED_COLUMNS
+
+# Aantal rijen dat per transactie opnieuw versleuteld wordt; kleine batches houden de schrijfvergrendeling kort
+ROTATION_BATCH_SIZE = 200
+# Pauze tussen twee batches, zodat de sessies van de admins steeds tussendoor kunnen schrijven
+ROTATION_PAUSE = 0.05
+
+# Tabellen met versleutelde kolommen, in de volgorde waarin ze geroteerd worden
+ROTATION_TABLES = (
+    ("users", USER_ENCRYPTED_COLUMNS),
+    ("members", MEMBER_RECORD_COLUMNS),
+    ("logs", LOG_ENCRYPTED_COLUMNS),
+)
+
+_rotation_thread = None
+_rotation_stop = threading.Event()
+
+
+def _create_progress_table(conn):
+    """
+    Maak de tabel aan waarin per bron het laatst verwerkte id van de lopende rotatie staat.
+    """
+    conn.execute("""CREATE TABLE IF NOT EXISTS key_rotation_progress (
+                        source TEXT PRIMARY KEY,
+                        key_id INTEGER NOT NULL,
+                        last_id INTEGER NOT NULL,
+                        done INTEGER NOT NULL DEFAULT 0
+                    )""")
+    conn.commit()
+
+
+def _load_checkpoint(conn, source: str, key_id: int) -> tuple:
+    """
+    Geef (laatst verwerkte id, klaar) van een bron voor de rotatie naar key_id terug.
+    """
+    row = conn.execute("SELECT last_id, done FROM key_rotation_progress WHERE source = ? AND key_id = ?",
+                       (source, key_id)).fetchone()
+    return (row[0], bool(row[1])) if row else (0, False)
+
+
+def _save_checkpoint(conn, source: str, key_id: int, last_id: int, done: bool = False):
+    """
+    Leg de voortgang van een bron vast. De aanroeper commit de transactie.
+    """
+    conn.execute("""INSERT INTO key_rotation_progress (source, key_id, last_id, done) VALUES (?, ?, ?, ?)
+                    ON CONFLICT(source) DO UPDATE SET key_id = excluded.key_id, last_id = excluded.last_id, done = excluded.done""",
+                 (source, key_id, last_id, int(done)))
+
+
+def _needs_rotation(value, key_id: int) -> bool:
+    """
+    Controleer of een kolomwaarde nog met een andere sleutelversie dan key_id versleuteld is.
+    """
+    if value is None or value == "":
+        return False
+    try:
+        return decode_ciphertext(value)[2] != key_id
+    except (ValueError, IndexError):
+        return False
+
+
+def _rekey(value, plaintext: str):
+    """
+    Versleutel plaintext opnieuw met de actieve sleutelversie, in dezelfde modus als de oude waarde.
+    Het omzetten naar een andere CIPHER_MODE blijft het werk van migrate.py.
+    """
+    if decode_ciphertext(value)[0] == ENVELOPE_TAG:
+        return encrypt_envelope(plaintext)
+    return encrypt_rsa(plaintext)
+
+
+def _rotate_batch(conn, table: str, columns: tuple, key_id: int, last_id: int, batch_size: int):
+    """
+    Versleutel de volgende batch rijen (na last_id) opnieuw met de actieve sleutelversie in een korte transactie.
+    Een rij wordt alleen bijgewerkt als de waarden niet intussen door een sessie gewijzigd zijn; zo'n sessie heeft
+    ze dan al met de nieuwe sleutel versleuteld. Geeft het laatst verwerkte id terug, of None als de tabel klaar is.
+    De transactie wordt niet gecommit, zodat de aanroeper de voortgang in dezelfde transactie kan vastleggen.
+    """
+    rows = conn.execute(f"SELECT id, {', '.join(columns)} FROM {table} WHERE id > ? ORDER BY id LIMIT ?",
+                        (last_id, batch_size)).fetchall()
+    if not rows:
+        return None
+
+    # Ontsleutelen gebeurt buiten de schrijfvergrendeling, verdeeld over alle kernen
+    positions = [(r, c) for r, row in enumerate(rows) for c, value in enumerate(row[1:])
+                 if _needs_rotation(value, key_id)]
+    plaintexts = decrypt_many([rows[r][c + 1] for r, c in positions], errors="ignore")
+
+    changes = {}
+    for (r, c), plaintext in zip(positions, plaintexts):
+        if plaintext is not None:
+            changes.setdefault(r, {})[c] = _rekey(rows[r][c + 1], plaintext)
+
+    if not conn.in_transaction:
+        conn.execute("BEGIN IMMEDIATE")
+    for r, row_changes in changes.items():
+        row = rows[r]
+        assignments = ", ".join(f"{columns[c]} = ?" for c in row_changes)
+        conditions = " AND ".join(f"{columns[c]} IS ?" for c in row_changes)
+        conn.execute(f"UPDATE {table} SET {assignments} WHERE id = ? AND {conditions}",
+                     (*row_changes.values(), row[0], *(row[c + 1] for c in row_changes)))
+    return rows[-1][0]
+
+
+def _rotate_source(conn, checkpoint_conn, source: str, table: str, columns: tuple, key_id: int,
+                   batch_size: int, report) -> bool:
+    """
+    Roteer een tabel batch voor batch vanaf het laatste checkpoint. Staat de tabel in dezelfde database als de
+    checkpoints, dan worden batch en checkpoint samen gecommit; anders (logsegmenten) direct na elkaar, wat veilig
+    is omdat een herhaalde batch alleen nog waarden met een oude sleutelversie aanpast.
+    Geeft False terug als de rotatie gepauzeerd is.
+    """
+    last_id, done = _load_checkpoint(checkpoint_conn, source, key_id)
+    while not done:
+        if _rotation_stop.is_set():
+            return False
+        try:
+            new_last_id = _rotate_batch(conn, table, columns, key_id, last_id, batch_size)
+            done = new_last_id is None
+            last_id = last_id if done else new_last_id
+            if conn is not checkpoint_conn:
+                conn.commit()
+            _save_checkpoint(checkpoint_conn, source, key_id, last_id, done)
+            checkpoint_conn.commit()
+        except sqlite3.Error:
+            conn.rollback()
+            checkpoint_conn.rollback()
+            raise
+        report(f"Key rotation: {source} {'done' if done else f'up to id {last_id}'}")
+        time.sleep(ROTATION_PAUSE)
+    return True
+
+
+def start_key_rotation() -> int:
+    """
+    Maak een nieuwe sleutelversie aan en maak deze actief; vanaf nu worden alle nieuwe waarden met deze versie
+    versleuteld, terwijl waarden van de vorige versie leesbaar blijven. Loopt er al een rotatie, dan gebeurt er niets.
+    Geeft de actieve sleutelversie terug.
+    """
+    state = load_key_state()
+    if state.get("rotating"):
+        return state["active"]
+    ensure_data_key()
+    key_id = create_key_version()
+    save_key_state({
+        "active": key_id,
+        "previous": state["active"],
+        "rotating": True,
+        "started": datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    })
+    return key_id
+
+
+def run_key_rotation(database_path: str = DATABASE_FILE, batch_size: int = ROTATION_BATCH_SIZE, report=print) -> bool:
+    """
+    Versleutel alle gegevens die nog met een oude sleutelversie versleuteld zijn opnieuw met de actieve versie:
+    de tabellen in ROTATION_TABLES en daarna de afgesloten logsegmenten. Elke batch wordt gecommit met een
+    checkpoint, zodat een onderbroken rotatie later verder gaat waar ze gebleven was.
+    Geeft True terug als de rotatie voltooid is, False als ze gepauzeerd is.
+    """
+    state = load_key_state()
+    if not state.get("rotating"):
+        report("No key rotation in progress.")
+        return True
+    key_id = state["active"]
+
+    # Een nog niet geïmporteerd CSV-logbestand wordt eerst naar de logs-tabel overgezet
+    flush_logs()
+    import_log_file(report=report)
+
+    with closing(open_connection(database_path)) as conn:
+        _create_progress_table(conn)
+        for table, columns in ROTATION_TABLES:
+            if not _rotate_source(conn, conn, table, table, columns, key_id, batch_size, report):
+                return False
+
+        for entry in load_segment_manifest():
+            path = f"{LOG_SEGMENT_DIR}/{entry['file']}"
+            with closing(sqlite3.connect(path)) as segment_conn:
+                if not _rotate_source(segment_conn, conn, f"segment:{entry['file']}", "logs", LOG_ENCRYPTED_COLUMNS,
+                                      key_id, batch_size, report):
+                    return False
+
+        with conn:
+            conn.execute("DELETE FROM key_rotation_progress WHERE key_id = ?", (key_id,))
+
+    # De sleutels van de vorige versie blijven bewaard, zodat oudere back-ups leesbaar blijven
+    state["rotating"] = False
+    state["completed"] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    save_key_state(state)
+    log_activity("System", "Key rotation completed", f"Key version {key_id}")
+    report(f"Key rotation to key version {key_id} completed.")
+    return True
+
+
+def _run_in_background(database_path: str):
+    try:
+        run_key_rotation(database_path, report=logging.info)
+    except Exception as e:
+        logging.error(f"Key rotation stopped: {e}")
+
+
+def rotate_keys_in_background(database_path: str = DATABASE_FILE) -> threading.Thread:
+    """
+    Voer (het restant van) de lopende rotatie uit op een achtergrondthread, zodat er gewoon doorgewerkt kan worden.
+    """
+    global _rotation_thread
+    if _rotation_thread is not None and _rotation_thread.is_alive():
+        return _rotation_thread
+    _rotation_stop.clear()
+    _rotation_thread = threading.Thread(target=_run_in_background, args=(database_path,), name="key-rotation", daemon=True)
+    _rotation_thread.start()
+    return _rotation_thread
+
+
+def stop_key_rotation():
+    """
+    Pauzeer een rotatie op de achtergrond na de huidige batch; ze kan later hervat worden.
+    """
+    _rotation_stop.set()
+    if _rotation_thread is not None:
+        _rotation_thread.join()
+
+
+def key_rotation_status(database_path: str = DATABASE_FILE) -> dict:
+    """
+    Geef de sleutelstatus terug, aangevuld met de voortgang per bron als er een rotatie loopt.
+    """
+    state = dict(load_key_state())
+    state["running"] = _rotation_thread is not None and _rotation_thread.is_alive()
+    state["progress"] = {}
+    if state.get("rotating"):
+        with closing(open_connection(database_path)) as conn:
+            _create_progress_table(conn)
+            rows = conn.execute("SELECT source, last_id, done FROM key_rotation_progress WHERE key_id = ?",
+                                (state["active"],)).fetchall()
+        state["progress"] = {source: ("done" if done else f"up to id {last_id}") for source, last_id, done in rows}
+    return state
+
+
+def key_rotation_prompt(database_path: str = DATABASE_FILE):
+    """
+    Toon de status van de sleutelrotatie en start of hervat deze op de achtergrond.
+    """
+    status = key_rotation_status(database_path)
+    print(f"Active key version: {status['active']}")
+    if status.get("rotating"):
+        print(f"Rotation from key version {status['previous']} started at {status['started']} "
+              f"({'running' if status['running'] else 'paused'}).")
+        for source, progress in status["progress"].items():
+            print(f"  {source}: {progress}")
+        if not status["running"]:
+            rotate_keys_in_background(database_path)
+            print("Key rotation resumed in the background.")
+        return
+
+    confirm = input("Generate new keys and re-encrypt all data in the background? (y/n): ").strip().lower()
+    if confirm != 'y':
+        return
+    key_id = start_key_rotation()
+    log_activity("System", "Key rotation started", f"Key version {key_id}")
+    rotate_keys_in_background(database_path)
+    print(f"Key version {key_id} is now active; existing data is re-encrypted in the background.")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rotate the encryption keys and re-encrypt all stored data.")
+    parser.add_argument("command", choices=["start", "resume", "status"],
+                        help="start: create a new key version and re-encrypt everything; "
+                             "resume: continue an interrupted rotation; status: show the rotation progress")
+    parser.add_argument("--database", default=DATABASE_FILE)
+    parser.add_argument("--batch-size", type=int, default=ROTATION_BATCH_SIZE)
+    args = parser.parse_args()
+
+    if args.command == "status":
+        status = key_rotation_status(args.database)
+        print(f"Active key version: {status['active']}, rotating: {bool(status.get('rotating'))}")
+        for source, progress in status["progress"].items():
+            print(f"  {source}: {progress}")
+    else:
+        if args.command == "start":
+            print(f"Key version {start_key_rotation()} is active.")
+        run_key_rotation(args.database, args.batch_size)
+        flush_logs()
@@ -1,10 +1,50 @@
 import os
 import csv
-from datetime import datetime
-from encrypt_decrypt import encrypt_data, decrypt_data
+import json
+import time
+import queue
+import atexit
+import logging
+import sqlite3
+import threading
+from contextlib import closing, contextmanager
+from itertools import islice
+from datetime import datetime, timedelta
+from encrypt_decrypt import encrypt_many, decrypt_data, decrypt_many, blind_index
+from database import DATABASE_FILE, create_logs_table, open_connection, get_pool
 
 # Definieer constanten voor bestandslocaties
-LOG_FILE = 'data/logs.csv'
+LOG_DATABASE = DATABASE_FILE  # Logvermeldingen staan in de logs-tabel van de database
+LOG_FILE = 'data/logs.csv'    # Oud logbestand; wordt eenmalig in de logs-tabel geïmporteerd
+LOG_SEGMENT_DIR = 'data/log_segments'  # Afgesloten logsegmenten, elk een eigen SQLite-bestand
+LOG_SEGMENT_MANIFEST = os.path.join(LOG_SEGMENT_DIR, 'manifest.json')
+
+# De live logs-tabel wordt naar een segment verplaatst zodra deze zoveel vermeldingen bevat,
+# of zodra de oudste vermelding ouder is dan het opgegeven aantal dagen
+LOG_SEGMENT_MAX_ROWS = 10000
+LOG_SEGMENT_MAX_AGE_DAYS = 30
+
+# Formaten van de datum- en tijdkolommen
+LOG_DATE_FORMAT = '%d-%m-%Y'
+LOG_TIME_FORMAT = '%H:%M:%S'
+LOG_TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'  # Sorteerbaar, voor de index op created_at
+
+# Kolommen in de volgorde waarin ze getoond worden
+LOG_COLUMNS = "id, date, time, username, description, additional_info, suspicious"
+
+# Aantal logvermeldingen per pagina in de logviewer
+LOG_PAGE_SIZE = 50
+
+# Instellingen voor de achtergrondschrijver van het auditlog
+LOG_QUEUE_SIZE = 10000      # Maximaal aantal wachtende vermeldingen; daarna wacht de aanroeper
+LOG_BATCH_SIZE = 100        # Schrijf zodra er zoveel vermeldingen klaarstaan
+LOG_FLUSH_INTERVAL = 1.0    # Of zodra de oudste wachtende vermelding zo lang (in seconden) wacht
+LOG_RETRY_INTERVAL = 2.0    # Wachttijd (in seconden) voordat een mislukte batch opnieuw geschreven wordt
+LOG_SHUTDOWN_RETRIES = 3    # Aantal pogingen om de laatste vermeldingen bij het afsluiten weg te schrijven
+LOG_ROTATION_CHECK_INTERVAL = 60.0  # Zo vaak (in seconden) controleert de schrijver of de live logs geroteerd moeten worden
+
+# Aantal vermeldingen per blok bij het importeren van het oude CSV-logbestand
+LOG_IMPORT_CHUNK_SIZE = 5000
 
 def ensure_data_directory_exists():
     """
@@ -16,37 +56,226 @@ def ensure_data_directory_exists():
 # Zorg ervoor dat de data directory bestaat
 ensure_data_directory_exists()
 
-def get_next_log_number() -> int:
+def connect_log_database():
+    """
+    Open een verbinding met de database waarin de logvermeldingen staan.
+    """
+    conn = open_connection(LOG_DATABASE)
+    create_logs_table(conn)
+    return conn
+
+_logs_table_ready = False
+_logs_table_lock = threading.Lock()
+
+@contextmanager
+def log_connection():
+    """
+    Leen een verbinding met de logdatabase uit de gedeelde pool.
+    De logs-tabel wordt alleen bij het eerste gebruik in dit proces aangemaakt of bijgewerkt.
+    """
+    global _logs_table_ready
+    with get_pool(LOG_DATABASE).connection() as conn:
+        if not _logs_table_ready:
+            with _logs_table_lock:
+                if not _logs_table_ready:
+                    create_logs_table(conn)
+                    _logs_table_ready = True
+        yield conn
+
+def _write_log_entries(conn, entries: list):
+    """
+    Versleutel een groep logvermeldingen en voeg ze in één transactie toe aan de logs-tabel.
+    Elke vermelding is een tuple (tijdstip, gebruikersnaam, beschrijving, aanvullende informatie, verdacht).
+    """
+    encrypted_fields = encrypt_many([field for entry in entries for field in entry[1:]])
+
+    rows = []
+    for index, entry in enumerate(entries):
+        logged_at, suspicious = entry[0], entry[4]
+        rows.append((
+            logged_at.strftime(LOG_DATE_FORMAT),
+            logged_at.strftime(LOG_TIME_FORMAT),
+            logged_at.strftime(LOG_TIMESTAMP_FORMAT),
+            *encrypted_fields[4 * index:4 * index + 4],
+            1 if suspicious.lower() == 'yes' else 0,
+            blind_index(entry[1].lower())
+        ))
+
+    with conn:
+        conn.executemany(
+            """INSERT INTO logs (date, time, created_at, username, description, additional_info, suspicious, is_suspicious, username_index)
+               VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+            rows
+        )
+
+
+class _FlushRequest:
+    """
+    Verzoek aan de schrijfthread om alle eerdere vermeldingen weg te schrijven, met het resultaat.
+    """
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.written = False
+
+
+class LogWriter:
+    """
+    Schrijf logvermeldingen op een achtergrondthread, zodat de aanroeper niet op versleuteling en schijf-I/O wacht.
+    Vermeldingen worden gegroepeerd weggeschreven zodra LOG_BATCH_SIZE bereikt is of LOG_FLUSH_INTERVAL verstreken is.
+    Een batch die niet geschreven kan worden (bijvoorbeeld omdat de database vergrendeld is) blijft bewaard en
+    wordt na LOG_RETRY_INTERVAL opnieuw geprobeerd. Na het schrijven wordt elke LOG_ROTATION_CHECK_INTERVAL
+    gecontroleerd of de live logs naar een segment moeten, zodat ook een lang draaiend proces roteert.
+    """
+
+    _STOP = object()
+
+    def __init__(self, batch_size: int = LOG_BATCH_SIZE, flush_interval: float = LOG_FLUSH_INTERVAL, max_queue_size: int = LOG_QUEUE_SIZE):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue = queue.Queue(maxsize=max_queue_size)
+        self._thread = None
+        self._lock = threading.Lock()
+        self._conn = None
+
+    def _ensure_started(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="log-writer", daemon=True)
+                self._thread.start()
+
+    def submit(self, entry: tuple):
+        """
+        Zet een logvermelding in de wachtrij.
+        """
+        self._ensure_started()
+        self._queue.put(entry)
+
+    def flush(self, timeout: float = None) -> bool:
+        """
+        Wacht tot alle vermeldingen die tot nu toe in de wachtrij staan zijn weggeschreven.
+        Geeft False terug als dat niet (binnen timeout) gelukt is; de vermeldingen worden dan later opnieuw geprobeerd.
+        """
+        if self._thread is None or not self._thread.is_alive():
+            return True
+        request = _FlushRequest()
+        self._queue.put(request)
+        return request.done.wait(timeout) and request.written
+
+    def shutdown(self):
+        """
+        Schrijf alle wachtende vermeldingen weg en stop de achtergrondthread.
+        """
+        if self._thread is None or not self._thread.is_alive():
+            return
+        self._queue.put(self._STOP)
+        self._thread.join()
+
+    def _write(self, pending: list) -> bool:
+        """
+        Schrijf de wachtende vermeldingen weg. Bij een fout blijven ze in pending staan en wordt de verbinding
+        gesloten, zodat de volgende poging met een nieuwe verbinding begint. Geeft True terug als alles geschreven is.
+        """
+        if not pending:
+            return True
+        try:
+            # Een SQLite-verbinding hoort bij de thread die hem geopend heeft
+            if self._conn is None:
+                self._conn = connect_log_database()
+            _write_log_entries(self._conn, pending)
+        except Exception as e:
+            logging.error(f"Error writing {len(pending)} log entries, retrying in {LOG_RETRY_INTERVAL} s: {e}")
+            self._close()
+            return False
+        pending.clear()
+        return True
+
+    def _close(self):
+        if self._conn is not None:
+            try:
+                self._conn.close()
+            except sqlite3.Error:
+                pass
+            self._conn = None
+
+    def _run(self):
+        pending = []
+        deadline = None
+        retrying = False  # De vorige poging is mislukt; wacht tot deadline voordat opnieuw geschreven wordt
+
+        next_rotation_check = time.monotonic() + LOG_ROTATION_CHECK_INTERVAL
+
+        def write():
+            nonlocal deadline, retrying, next_rotation_check
+            retrying = not self._write(pending)
+            if retrying:
+                deadline = time.monotonic() + LOG_RETRY_INTERVAL
+            elif time.monotonic() >= next_rotation_check:
+                next_rotation_check = time.monotonic() + LOG_ROTATION_CHECK_INTERVAL
+                try:
+                    _rotate_live_logs()
+                except Exception as e:
+                    logging.error(f"Error rotating the live logs: {e}")
+            return not retrying
+
+        try:
+            while True:
+                timeout = None if not pending else max(0.0, deadline - time.monotonic())
+                try:
+                    item = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    write()
+                    continue
+
+                if item is self._STOP:
+                    for attempt in range(LOG_SHUTDOWN_RETRIES):
+                        if write():
+                            break
+                        if attempt + 1 < LOG_SHUTDOWN_RETRIES:
+                            time.sleep(LOG_RETRY_INTERVAL)
+                    else:
+                        logging.critical(f"{len(pending)} log entries could not be written before shutdown.")
+                    return
+                if isinstance(item, _FlushRequest):
+                    item.written = write()
+                    item.done.set()
+                    continue
+
+                if not pending:
+                    deadline = time.monotonic() + self.flush_interval
+                pending.append(item)
+                if len(pending) >= self.batch_size and not retrying:
+                    write()
+        finally:
+            self._close()
+
+
+# Gedeelde achtergrondschrijver; wachtende vermeldingen worden bij het afsluiten weggeschreven
+log_writer = LogWriter()
+atexit.register(log_writer.shutdown)
+
+def flush_logs(timeout: float = None) -> bool:
+    """
+    Wacht tot alle wachtende logvermeldingen zijn weggeschreven. Geeft False terug als dat niet gelukt is.
+    """
+    return log_writer.flush(timeout)
+
+def shutdown_log_writer():
     """
-    Bepaal het volgende lognummer op basis van de huidige logvermeldingen.
+    Schrijf alle wachtende logvermeldingen weg en stop de achtergrondschrijver.
     """
-    if not os.path.exists(LOG_FILE):
-        return 1
-    with open(LOG_FILE, 'r', newline='', encoding='utf-8') as file:
-        reader = csv.reader(file)
-        log_entries = list(reader)
-        return len(log_entries) + 1
+    log_writer.shutdown()
 
-def log_activity(username: str, description: str, additional_info: str = '', suspicious: str = 'No'):
+def log_activity(username: str, description: str, additional_info: str = '', suspicious: str = 'No', wait: bool = False) -> bool:
     """
     Log een activiteit met de opgegeven details.
+    De vermelding wordt op de achtergrond versleuteld en weggeschreven; met wait=True wordt
+    gewacht tot de vermelding op schijf staat. Geeft False terug als dat wachten mislukt is.
     """
-    date = datetime.now().strftime('%d-%m-%Y')
-    time = datetime.now().strftime('%H:%M:%S')
-    log_number = get_next_log_number()
-    
-    # Versleutel de logdetails
-    encrypted_username = encrypt_data(username)
-    encrypted_description = encrypt_data(description)
-    encrypted_additional_info = encrypt_data(additional_info)
-    encrypted_suspicious = encrypt_data(suspicious)
-    
-    log_entry = [log_number, date, time, encrypted_username, encrypted_description, encrypted_additional_info, encrypted_suspicious]
-    
-    # Voeg de logvermelding toe aan het CSV-bestand
-    with open(LOG_FILE, 'a', newline='', encoding='utf-8') as file:
-        writer = csv.writer(file)
-        writer.writerow(log_entry)
+    log_writer.submit((datetime.now(), username, description, additional_info, suspicious))
+    if wait:
+        return log_writer.flush()
+    return True
 
 def decrypt_log_row(row: list) -> list:
     """
@@ -66,21 +295,456 @@ def decrypt_log_row(row: list) -> list:
     ]
     return decrypted_row
 
-def decrypt_log_file() -> list:
+def decrypt_log_rows(rows: list) -> list:
     """
-    Lees en ontsleutel alle logvermeldingen uit het logbestand.
+    Ontsleutel meerdere logrijen in één keer, zodat het werk over alle CPU-kernen verdeeld kan worden.
     """
-    if not os.path.exists(LOG_FILE):
-        return []
-    
+    values = iter(decrypt_many([field for row in rows if len(row) == 7 for field in row[3:]]))
     logs = []
-    with open(LOG_FILE, 'r', newline='', encoding='utf-8') as file:
-        reader = csv.reader(file)
-        for row in reader:
-            decrypted_row = decrypt_log_row(row)
-            logs.append(decrypted_row)
+    for row in rows:
+        if len(row) != 7:
+            logs.append(decrypt_log_row(row))  # Meldt de onverwachte rij en geeft deze ongewijzigd terug
+        else:
+            logs.append(list(row[:3]) + [next(values) for _ in range(4)])
     return logs
 
+def load_segment_manifest() -> list:
+    """
+    Lees de manifest met per logsegment het bestand, de datums, het eerste en laatste lognummer en de grootte.
+    """
+    if not os.path.exists(LOG_SEGMENT_MANIFEST):
+        return []
+    with open(LOG_SEGMENT_MANIFEST, 'r', encoding='utf-8') as file:
+        return json.load(file)
+
+def _save_segment_manifest(manifest: list):
+    """
+    Schrijf de manifest atomair weg.
+    """
+    temp_file = LOG_SEGMENT_MANIFEST + '.tmp'
+    with open(temp_file, 'w', encoding='utf-8') as file:
+        json.dump(manifest, file, indent=2)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temp_file, LOG_SEGMENT_MANIFEST)
+
+def _log_sources(min_log_id: int = None, max_log_id: int = None, start: str = None, end: str = None) -> list:
+    """
+    Geef de bronnen (segmenten en de live tabel) terug die vermeldingen binnen het gevraagde bereik kunnen bevatten,
+    in volgorde van lognummer. Segmenten die volgens de manifest buiten het bereik vallen worden overgeslagen.
+    Elke bron is een tuple (pad, manifestregel); de live tabel heeft geen manifestregel.
+    """
+    sources = []
+    for entry in load_segment_manifest():
+        if min_log_id is not None and entry["last_log_number"] < min_log_id:
+            continue
+        if max_log_id is not None and entry["first_log_number"] > max_log_id:
+            continue
+        if start is not None and entry["end"] < start:
+            continue
+        if end is not None and entry["start"] > end:
+            continue
+        sources.append((os.path.join(LOG_SEGMENT_DIR, entry["file"]), entry))
+    sources.append((LOG_DATABASE, None))
+    return sources
+
+def _open_log_source(path: str):
+    """
+    Open een logbron als context manager; de live tabel komt uit de pool, segmenten worden alleen-lezen geopend.
+    """
+    if path == LOG_DATABASE:
+        return log_connection()
+    return closing(open_connection(path, read_only=True))
+
+def _log_filter(min_log_id: int = None, max_log_id: int = None, start: str = None, end: str = None,
+                suspicious: bool = None, username_index: str = None):
+    """
+    Bouw de WHERE-clausule en parameters voor de opgegeven filters.
+    start en end zijn tijdstippen in LOG_TIMESTAMP_FORMAT (inclusief).
+    """
+    conditions, parameters = [], []
+    if min_log_id is not None:
+        conditions.append("id >= ?")
+        parameters.append(min_log_id)
+    if max_log_id is not None:
+        conditions.append("id <= ?")
+        parameters.append(max_log_id)
+    if start is not None:
+        conditions.append("created_at >= ?")
+        parameters.append(start)
+    if end is not None:
+        conditions.append("created_at <= ?")
+        parameters.append(end)
+    if suspicious is not None:
+        conditions.append("is_suspicious = ?")
+        parameters.append(1 if suspicious else 0)
+    if username_index is not None:
+        # Vermeldingen zonder index worden na het ontsleutelen gefilterd
+        conditions.append("(username_index = ? OR username_index IS NULL)")
+        parameters.append(username_index)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+    return where, tuple(parameters)
+
+def _has_column(conn, column: str) -> bool:
+    """
+    Controleer of de logs-tabel van een bron een bepaalde kolom heeft (oudere segmenten missen nieuwere kolommen).
+    """
+    return any(row[1] == column for row in conn.execute("PRAGMA table_info(logs)"))
+
+def iter_log_rows(min_log_id: int = None, max_log_id: int = None, start: str = None, end: str = None,
+                  suspicious: bool = None, username: str = None, newest_first: bool = False):
+    """
+    Lees (versleutelde) logrijen uit de segmenten en de live logs-tabel als generator, gesorteerd op lognummer.
+    Alleen de segmenten die binnen de filters kunnen vallen worden geopend. Het filter op gebruikersnaam loopt via
+    de blind index; bronnen zonder die kolom geven alle rijen terug en moeten na het ontsleutelen gefilterd worden.
+    """
+    flush_logs()  # Zorg dat ook de nog wachtende vermeldingen meegenomen worden
+    username_index = blind_index(username.lower()) if username is not None else None
+    sources = _log_sources(min_log_id, max_log_id, start, end)
+    if newest_first:
+        sources.reverse()
+
+    for path, entry in sources:
+        with _open_log_source(path) as conn:
+            source_username_index = username_index if username_index is not None and _has_column(conn, "username_index") else None
+            where, parameters = _log_filter(min_log_id, max_log_id, start, end, suspicious, source_username_index)
+            cur = conn.cursor()
+            cur.execute(f"SELECT {LOG_COLUMNS} FROM logs {where} ORDER BY id {'DESC' if newest_first else 'ASC'}", parameters)
+            while True:
+                rows = cur.fetchmany(LOG_PAGE_SIZE)
+                if not rows:
+                    break
+                yield from rows
+
+def read_log_rows(min_log_id: int = None, max_log_id: int = None, suspicious: bool = None,
+                  newest_first: bool = False, limit: int = None, offset: int = 0) -> list:
+    """
+    Lees (versleutelde) logrijen, gesorteerd op lognummer, eventueel beperkt tot limit rijen vanaf offset.
+    """
+    rows = iter_log_rows(min_log_id, max_log_id, suspicious=suspicious, newest_first=newest_first)
+    return list(islice(rows, offset, None if limit is None else offset + limit))
+
+def iter_logs(newest_first: bool = False, batch_size: int = LOG_PAGE_SIZE):
+    """
+    Lees en ontsleutel logvermeldingen als generator.
+    Er wordt per blok van batch_size rijen ontsleuteld, pas op het moment dat het blok nodig is.
+    """
+    rows = iter_log_rows(newest_first=newest_first)
+    while True:
+        batch = list(islice(rows, batch_size))
+        if not batch:
+            return
+        yield from decrypt_log_rows(batch)
+
+def decrypt_log_file() -> list:
+    """
+    Lees en ontsleutel alle logvermeldingen.
+    """
+    return list(iter_logs())
+
+def latest_log_number() -> int:
+    """
+    Geef het hoogste lognummer terug, ook als de live tabel net geroteerd is; None als er geen logs zijn.
+    """
+    flush_logs()
+    with log_connection() as conn:
+        latest = conn.execute("SELECT MAX(id) FROM logs").fetchone()[0]
+    manifest = load_segment_manifest()
+    if latest is None and manifest:
+        latest = manifest[-1]["last_log_number"]
+    return latest
+
+def count_logs(max_log_id: int = None) -> int:
+    """
+    Tel het aantal logvermeldingen, eventueel tot en met een bepaald lognummer.
+    Voor segmenten die helemaal binnen het bereik vallen wordt het aantal uit de manifest gebruikt.
+    """
+    flush_logs()
+    where, parameters = _log_filter(max_log_id=max_log_id)
+    total = 0
+    for path, entry in _log_sources(max_log_id=max_log_id):
+        if entry is not None and (max_log_id is None or entry["last_log_number"] <= max_log_id):
+            total += entry["rows"]
+            continue
+        with _open_log_source(path) as conn:
+            total += conn.execute(f"SELECT COUNT(*) FROM logs {where}", parameters).fetchone()[0]
+    return total
+
+def read_log_page(page: int, page_size: int = LOG_PAGE_SIZE, newest_first: bool = True, max_log_id: int = None) -> list:
+    """
+    Lees en ontsleutel één pagina (vanaf 1) met logvermeldingen; alleen de rijen van die pagina worden ontsleuteld.
+    Met max_log_id blijven de pagina's gelijk, ook als er ondertussen nieuwe vermeldingen bijkomen.
+    """
+    rows = read_log_rows(max_log_id=max_log_id, newest_first=newest_first, limit=page_size, offset=(page - 1) * page_size)
+    return decrypt_log_rows(rows)
+
+def _parse_log_date(value, end_of_day: bool = False) -> str:
+    """
+    Zet een datum (date/datetime of tekst in LOG_DATE_FORMAT) om naar een grens in LOG_TIMESTAMP_FORMAT.
+    """
+    if isinstance(value, str):
+        value = datetime.strptime(value, LOG_DATE_FORMAT)
+    if not isinstance(value, datetime):
+        value = datetime(value.year, value.month, value.day)
+        if end_of_day:
+            value = value.replace(hour=23, minute=59, second=59)
+    elif end_of_day and value.time() == datetime.min.time():
+        value = value.replace(hour=23, minute=59, second=59)
+    return value.strftime(LOG_TIMESTAMP_FORMAT)
+
+def query_logs(start_date=None, end_date=None, username: str = None, suspicious: bool = None,
+               limit: int = None, newest_first: bool = True) -> list:
+    """
+    Zoek logvermeldingen met filters en geef ze ontsleuteld terug.
+    Datum, verdacht-vlag en gebruikersnaam (via de blind index) worden in de query gefilterd voordat er iets
+    ontsleuteld wordt, segmenten buiten de datums worden niet geopend, en het lezen stopt zodra limit bereikt is.
+    Datums zijn date/datetime-objecten of tekst in LOG_DATE_FORMAT; end_date is inclusief.
+    """
+    start = _parse_log_date(start_date) if start_date is not None else None
+    end = _parse_log_date(end_date, end_of_day=True) if end_date is not None else None
+    rows = iter_log_rows(start=start, end=end, suspicious=suspicious, username=username, newest_first=newest_first)
+
+    results = []
+    batch_size = LOG_PAGE_SIZE if limit is None else min(limit, LOG_PAGE_SIZE)
+    while limit is None or len(results) < limit:
+        batch = list(islice(rows, batch_size))
+        if not batch:
+            break
+        for log in decrypt_log_rows(batch):
+            # Bronnen zonder blind index zijn niet op gebruikersnaam gefilterd
+            if username is not None and str(log[3]).lower() != username.lower():
+                continue
+            results.append(log)
+            if limit is not None and len(results) >= limit:
+                break
+    rows.close()
+    return results
+
+def _remove_segmented_rows(conn, manifest: list):
+    """
+    Verwijder vermeldingen uit de live logs-tabel die al in een segment staan, omdat een rotatie na het wegschrijven
+    van het segment onderbroken is. Alleen rijen die met hetzelfde lognummer, tijdstip en dezelfde (willekeurig
+    versleutelde) omschrijving in het segment voorkomen worden verwijderd; een lognummer alleen zegt niets als
+    de tabel na het terugzetten van een back-up opnieuw genummerd is.
+    """
+    first_live = conn.execute("SELECT MIN(id) FROM logs").fetchone()[0]
+    if first_live is None:
+        return
+    for entry in manifest:
+        if entry["last_log_number"] < first_live:
+            continue
+        path = os.path.join(LOG_SEGMENT_DIR, entry["file"])
+        if not os.path.exists(path):
+            continue
+        conn.execute("ATTACH DATABASE ? AS segment", (path,))
+        try:
+            with conn:
+                conn.execute("""DELETE FROM main.logs
+                                WHERE id BETWEEN ? AND ?
+                                  AND EXISTS (SELECT 1 FROM segment.logs AS s
+                                              WHERE s.id = main.logs.id
+                                                AND s.created_at IS main.logs.created_at
+                                                AND s.description IS main.logs.description)""",
+                             (entry["first_log_number"], entry["last_log_number"]))
+        finally:
+            conn.execute("DETACH DATABASE segment")
+
+def rotate_logs(force: bool = False):
+    """
+    Verplaats de vermeldingen uit de live logs-tabel naar een nieuw, afgesloten logsegment als de tabel
+    LOG_SEGMENT_MAX_ROWS vermeldingen bevat of de oudste vermelding ouder is dan LOG_SEGMENT_MAX_AGE_DAYS.
+    Geeft de manifestregel van het nieuwe segment terug, of None als er niet geroteerd is.
+    """
+    flush_logs()
+    return _rotate_live_logs(force)
+
+_rotation_lock = threading.Lock()
+
+def _rotate_live_logs(force: bool = False):
+    """
+    Voer de rotatie van rotate_logs uit zonder eerst op de achtergrondschrijver te wachten;
+    de schrijver roept deze functie zelf aan na het wegschrijven van een batch.
+    """
+    with _rotation_lock:
+        manifest = load_segment_manifest()
+
+        with log_connection() as conn:
+            # Herstel na een onderbroken rotatie: deze vermeldingen staan al in een segment
+            _remove_segmented_rows(conn, manifest)
+
+            first, last, rows, start, end = conn.execute(
+                "SELECT MIN(id), MAX(id), COUNT(*), MIN(created_at), MAX(created_at) FROM logs"
+            ).fetchone()
+            if not rows:
+                return None
+            oldest_allowed = (datetime.now() - timedelta(days=LOG_SEGMENT_MAX_AGE_DAYS)).strftime(LOG_TIMESTAMP_FORMAT)
+            if not (force or rows >= LOG_SEGMENT_MAX_ROWS or start < oldest_allowed):
+                return None
+
+            os.makedirs(LOG_SEGMENT_DIR, exist_ok=True)
+            file_name = f"logs_{first:010d}_{last:010d}.db"
+            path = os.path.join(LOG_SEGMENT_DIR, file_name)
+            temp_path = path + '.tmp'
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+            # Schrijf het segment eerst naar een tijdelijk bestand, zodat er nooit een half segment bestaat
+            conn.execute("ATTACH DATABASE ? AS segment", (temp_path,))
+            try:
+                conn.execute("CREATE TABLE segment.logs AS SELECT * FROM main.logs WHERE id <= ?", (last,))
+                conn.execute("CREATE UNIQUE INDEX segment.idx_logs_id ON logs (id)")
+                conn.execute("CREATE INDEX segment.idx_logs_created_at ON logs (created_at)")
+                conn.execute("CREATE INDEX segment.idx_logs_is_suspicious ON logs (is_suspicious, id)")
+                conn.commit()
+            finally:
+                conn.execute("DETACH DATABASE segment")
+            os.replace(temp_path, path)
+
+            entry = {
+                "file": file_name,
+                "first_log_number": first,
+                "last_log_number": last,
+                "start": start,
+                "end": end,
+                "rows": rows,
+                "byte_size": os.path.getsize(path)
+            }
+            manifest.append(entry)
+            _save_segment_manifest(manifest)
+
+            with conn:
+                conn.execute("DELETE FROM logs WHERE id <= ?", (last,))
+        return entry
+
+def convert_log_segments(convert) -> int:
+    """
+    Pas convert(conn) toe op elk afgesloten logsegment, verklein het bestand daarna met VACUUM
+    en werk de grootte in de manifest bij. convert geeft het aantal aangepaste vermeldingen terug;
+    deze functie geeft het totaal over alle segmenten terug.
+    """
+    manifest = load_segment_manifest()
+    converted = 0
+    for entry in manifest:
+        path = os.path.join(LOG_SEGMENT_DIR, entry["file"])
+        with closing(sqlite3.connect(path)) as conn:
+            converted += convert(conn)
+            conn.execute("VACUUM")
+        entry["byte_size"] = os.path.getsize(path)
+    if manifest:
+        _save_segment_manifest(manifest)
+    return converted
+
+def _import_rows(reader, log_file: str):
+    """
+    Lees de rijen van het oude logbestand één voor één en sla rijen met een onverwachte lengte over.
+    """
+    for line_number, row in enumerate(reader, start=1):
+        if len(row) == 7:
+            yield row
+        else:
+            logging.warning(f"Skipping malformed row {line_number} while importing {log_file}")
+
+def _load_import_state(log_file: str) -> dict:
+    """
+    Lees of bepaal hoe de lognummers van het oude logbestand worden toegekend.
+    De keuze wordt naast het logbestand bewaard, zodat een onderbroken import na een herstart dezelfde nummers
+    gebruikt en al geïmporteerde vermeldingen overslaat.
+    """
+    state_file = log_file + '.importing'
+    if os.path.exists(state_file):
+        with open(state_file, 'r', encoding='utf-8') as file:
+            return json.load(file)
+
+    with log_connection() as conn:
+        count, max_id = conn.execute("SELECT COUNT(*), COALESCE(MAX(id), 0) FROM logs").fetchone()
+    max_number = 0
+    with open(log_file, 'r', newline='', encoding='utf-8') as file:
+        for row in csv.reader(file):
+            if row and row[0].isdigit():
+                max_number = max(max_number, int(row[0]))
+    # Behoud de oude lognummers als de tabel nog leeg is; andere vermeldingen krijgen een nummer na het hoogste
+    state = {"keep_numbers": count == 0, "base": max(max_id, max_number)}
+
+    temp_file = state_file + '.tmp'
+    with open(temp_file, 'w', encoding='utf-8') as file:
+        json.dump(state, file)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temp_file, state_file)
+    return state
+
+def import_log_file(log_file: str = LOG_FILE, chunk_size: int = LOG_IMPORT_CHUNK_SIZE, report=print) -> int:
+    """
+    Importeer het oude CSV-logbestand eenmalig in de logs-tabel, per blok van chunk_size vermeldingen.
+    Elke vermelding krijgt een vast lognummer, zodat een na een onderbreking herhaalde import de al
+    geïmporteerde vermeldingen overslaat. Het bestand wordt daarna hernoemd naar '<naam>.imported'.
+    Geeft het aantal geïmporteerde vermeldingen terug.
+    """
+    if not os.path.exists(log_file):
+        return 0
+
+    flush_logs()
+    state = _load_import_state(log_file)
+    used_numbers = set()
+    position = 0
+    imported = 0
+
+    with open(log_file, 'r', newline='', encoding='utf-8') as file, log_connection() as conn:
+        rows = _import_rows(csv.reader(file), log_file)
+        while True:
+            chunk = list(islice(rows, chunk_size))
+            if not chunk:
+                break
+
+            # De gebruikersnaam en het verdacht-veld zijn versleuteld; ontsleutel ze eenmalig voor de indexen
+            usernames = decrypt_many([row[3] for row in chunk], errors="ignore")
+            flags = decrypt_many([row[6] for row in chunk], errors="ignore")
+
+            records = []
+            for row, username, flag in zip(chunk, usernames, flags):
+                position += 1
+                if state["keep_numbers"] and row[0].isdigit() and int(row[0]) not in used_numbers:
+                    log_number = int(row[0])
+                    used_numbers.add(log_number)
+                else:
+                    log_number = state["base"] + position
+                try:
+                    created_at = datetime.strptime(f"{row[1]} {row[2]}", f"{LOG_DATE_FORMAT} {LOG_TIME_FORMAT}").strftime(LOG_TIMESTAMP_FORMAT)
+                except ValueError:
+                    created_at = ''
+                records.append((
+                    log_number, row[1], row[2], created_at, *row[3:7],
+                    1 if flag and flag.lower() == 'yes' else 0,
+                    blind_index(username.lower()) if username is not None else None
+                ))
+
+            with conn:
+                cur = conn.executemany(
+                    """INSERT OR IGNORE INTO logs (id, date, time, created_at, username, description, additional_info, suspicious, is_suspicious, username_index)
+                       VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+                    records
+                )
+            imported += cur.rowcount
+            report(f"Importing {log_file}: {position} entries processed.")
+
+    os.replace(log_file, log_file + '.imported')
+    os.remove(log_file + '.importing')
+    return imported
+
+def backfill_log_username_index() -> int:
+    """
+    Vul de blind index van de gebruikersnaam aan voor vermeldingen in de live tabel die van vóór die kolom zijn.
+    Geeft het aantal bijgewerkte vermeldingen terug.
+    """
+    flush_logs()
+    with log_connection() as conn:
+        rows = conn.execute("SELECT id, username FROM logs WHERE username_index IS NULL").fetchall()
+        usernames = decrypt_many([row[1] for row in rows], errors="ignore")
+        updates = [(blind_index(username.lower()), row[0]) for row, username in zip(rows, usernames) if username is not None]
+        with conn:
+            conn.executemany("UPDATE logs SET username_index = ? WHERE id = ?", updates)
+    return len(updates)
+
 def display_logs(logs: list):
     """
     Toon logs in een tabelvorm met kopteksten.
@@ -103,16 +767,118 @@ def display_logs(logs: list):
         log_row = " | ".join(str(log[i]).ljust(column_widths[i]) for i in range(len(headers)))
         print(log_row)
 
+def query_logs_prompt():
+    """
+    Vraag om filters en toon de logvermeldingen die eraan voldoen.
+    """
+    try:
+        start_date = input("Start date (DD-MM-YYYY, empty for no limit): ").strip() or None
+        end_date = input("End date (DD-MM-YYYY, empty for no limit): ").strip() or None
+        for value in (start_date, end_date):
+            if value is not None:
+                datetime.strptime(value, LOG_DATE_FORMAT)
+    except ValueError:
+        print("Invalid date. Use the format DD-MM-YYYY.")
+        return
+
+    username = input("Username (empty for all users): ").strip() or None
+
+    suspicious_input = input("Suspicious only? (y = only suspicious, n = only normal, empty = both): ").strip().lower()
+    suspicious = {'y': True, 'n': False}.get(suspicious_input)
+
+    limit_input = input(f"Maximum number of entries (empty for {LOG_PAGE_SIZE}): ").strip()
+    limit = int(limit_input) if limit_input.isdigit() and int(limit_input) > 0 else LOG_PAGE_SIZE
+
+    logs = query_logs(start_date, end_date, username, suspicious, limit=limit, newest_first=True)
+    if logs:
+        display_logs(logs)
+        print(f"\n{len(logs)} entries shown, newest first.")
+    else:
+        print("No log entries match the filters.")
+
+def view_logs_prompt(page_size: int = LOG_PAGE_SIZE):
+    """
+    Toon de logs per pagina, de nieuwste eerst, met navigatie naar de volgende, vorige of een gekozen pagina.
+    Desgewenst worden de logs eerst gefilterd op datum, gebruikersnaam en verdacht.
+    """
+    if input("Filter the logs? (y/n): ").strip().lower() == 'y':
+        query_logs_prompt()
+        return
+
+    max_log_id = latest_log_number()
+    if max_log_id is None:
+        print("No log entries found.")
+        return
+
+    total = count_logs(max_log_id)
+    page_count = max(1, -(-total // page_size))
+    page = 1
+    while True:
+        display_logs(read_log_page(page, page_size, max_log_id=max_log_id))
+        print(f"\nPage {page} of {page_count} ({total} entries, newest first)")
+
+        choice = input("(N)ext, (P)revious, (J)ump to page, (Q)uit: ").strip().lower()
+        if choice == 'n':
+            if page < page_count:
+                page += 1
+            else:
+                print("This is the last page.")
+        elif choice == 'p':
+            if page > 1:
+                page -= 1
+            else:
+                print("This is the first page.")
+        elif choice == 'j':
+            page_input = input(f"Page number (1-{page_count}): ").strip()
+            if page_input.isdigit() and 1 <= int(page_input) <= page_count:
+                page = int(page_input)
+            else:
+                print(f"Please enter a number between 1 and {page_count}.")
+        elif choice == 'q':
+            break
+        else:
+            print("Invalid choice. Try again.")
+
 def get_suspicious_logs() -> list:
     """
     Haal logs op die als verdacht zijn gemarkeerd.
     """
-    logs = decrypt_log_file()
-    suspicious_logs = [log for log in logs if log[6].lower() == 'yes']
+    # Dankzij de geïndexeerde vlag worden alleen de verdachte rijen gelezen en ontsleuteld
+    suspicious_logs = decrypt_log_rows(read_log_rows(suspicious=True))
     return suspicious_logs
 
+def get_unread_suspicious_logs(user_id: int) -> list:
+    """
+    Haal de verdachte logs op die de gebruiker nog niet gezien heeft.
+    Alleen verdachte vermeldingen na het 'gelezen tot'-punt van de gebruiker worden gelezen en ontsleuteld.
+    """
+    flush_logs()
+    with log_connection() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT last_read_log_id FROM log_watermarks WHERE user_id = ?", (user_id,))
+        row = cur.fetchone()
+        last_read_log_id = row[0] if row else 0
+    return decrypt_log_rows(read_log_rows(min_log_id=last_read_log_id + 1, suspicious=True))
+
+def mark_logs_read(user_id: int, log_id: int):
+    """
+    Leg vast dat de gebruiker de verdachte logs tot en met het opgegeven lognummer gezien heeft.
+    """
+    with log_connection() as conn:
+        with conn:
+            conn.execute(
+                """INSERT INTO log_watermarks (user_id, last_read_log_id) VALUES (?, ?)
+                   ON CONFLICT(user_id) DO UPDATE SET last_read_log_id = MAX(last_read_log_id, excluded.last_read_log_id)""",
+                (user_id, log_id)
+            )
+
 def log_suspicious_activity(username: str, description: str, additional_info: str = ''):
     """
     Log een activiteit als verdacht.
+    Verdachte activiteiten worden direct weggeschreven voordat de aanroeper verder gaat.
+    Geeft False terug als de vermelding (nog) niet weggeschreven kon worden; de schrijver probeert het later opnieuw.
     """
-    log_activity(username, description, additional_info, suspicious='Yes')
\ No newline at end of file
+    written = log_activity(username, description, additional_info, suspicious='Yes', wait=True)
+    if not written:
+        logging.error(f"Suspicious activity of {username} could not be written to the audit log yet: {description}")
+    return written
\ No newline at end of file
@@ -2,10 +2,15 @@ import sqlite3
 import logging
 import random
 import re
+import csv
+import json
+import os
+import threading
+from collections import OrderedDict
 from datetime import datetime
 from log import log_activity, log_suspicious_activity
-from encrypt_decrypt import encrypt_data, decrypt_data
-from database import create_connection
+from encrypt_decrypt import encrypt_data, encrypt_many, decrypt_data, decrypt_many, encrypt_envelope, blind_index
+from database import create_connection, read_connection
 from sqlite3 import Error
 
 
@@ -14,9 +19,99 @@ CITIES = [
     "Tilburg", "Groningen", "Almere", "Breda", "Nijmegen"
 ]
 
+# Storage layout for new and updated members:
+# "record"  - all sensitive fields serialized into one encrypted payload column (one crypto operation per member)
+# "columns" - every field encrypted in its own column (the original layout)
+MEMBER_STORAGE = "record"
+
+# Sensitive member fields, in the order of their per-column layout
+MEMBER_FIELDS = ("first_name", "last_name", "membership_id", "age", "gender", "weight", "address", "email", "phone")
+
+# Columns to select for decrypt_member_row, which understands both layouts
+MEMBER_COLUMNS = "id, record, " + ", ".join(MEMBER_FIELDS)
+
+# Fields that can be searched with a partial match, and the n-gram size of the search index
+SEARCHABLE_FIELDS = ("first_name", "last_name", "address", "email", "phone", "membership_id")
+NGRAM_SIZE = 3
+
+# Maximum number of decrypted members kept in memory during a session
+MEMBER_CACHE_SIZE = 1000
+
+# Random draws per membership ID before giving up; with ten million IDs per year a second draw is already rare
+MEMBERSHIP_ID_ATTEMPTS = 100
+
+# Format of a Dutch zip code, e.g. 3011AB
+ZIP_CODE_PATTERN = r'^\d{4}[A-Z]{2}$'
+
+# Number of members encrypted and inserted per transaction during a bulk import
+IMPORT_CHUNK_SIZE = 500
+# Columns of a bulk import file (CSV header or JSONL keys)
+IMPORT_FIELDS = ("first_name", "last_name", "age", "gender", "weight", "street", "house_number",
+                 "zip_code", "city", "email", "phone")
+
+# Number of members read and decrypted at a time during an export
+EXPORT_BATCH_SIZE = 500
+# Fields that can be exported; registration_date is not encrypted
+EXPORT_FIELDS = MEMBER_FIELDS + ("registration_date",)
+
+
+class MemberCache:
+    """
+    In-memory LRU cache of decrypted members, keyed by database ID.
+    Every entry remembers the ciphertext it was decrypted from, so a row that changed in the
+    database is decrypted again. The cache only lives in process memory and is never written to disk.
+    """
+
+    def __init__(self, max_size: int = MEMBER_CACHE_SIZE):
+        self.max_size = max_size
+        self._entries = OrderedDict()  # member id -> (ciphertext, decrypted member)
+        self._lock = threading.Lock()
+
+    def get(self, row):
+        """
+        Return a copy of the cached member for a row selected with MEMBER_COLUMNS, or None.
+        """
+        with self._lock:
+            entry = self._entries.get(row[0])
+            if entry is None or entry[0] != tuple(row[1:]):
+                return None
+            self._entries.move_to_end(row[0])
+            return dict(entry[1])
+
+    def put(self, row, member: dict):
+        """
+        Cache the decrypted member of a row, evicting the least recently used members if needed.
+        """
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self._entries[row[0]] = (tuple(row[1:]), dict(member))
+            self._entries.move_to_end(row[0])
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, member_id: int):
+        """
+        Remove a member from the cache.
+        """
+        with self._lock:
+            self._entries.pop(member_id, None)
+
+    def clear(self):
+        """
+        Remove all members from the cache.
+        """
+        with self._lock:
+            self._entries.clear()
+
+
+# Decrypted members of the current session
+member_cache = MemberCache()
+
 def generate_membership_id() -> str:
     """
-    Generate a unique membership ID based on the current year and random digits.
+    Generate a membership ID based on the current year and random digits.
+    Use allocate_membership_ids for an ID that is guaranteed not to be taken yet.
     """
     current_year = datetime.now().year
     short_year = str(current_year)[-2:]  # Get last two digits of the current year, e.g., "23" for 2023
@@ -28,6 +123,32 @@ def generate_membership_id() -> str:
     return membership_id
 
 
+def allocate_membership_ids(conn, count: int = 1) -> list:
+    """
+    Generate count new membership IDs and reserve them in the membership_ids table, keyed by their blind index.
+    The primary key makes a reservation atomic: when two sessions draw the same ID, only one insert succeeds
+    and the other draws again. Reservations are committed right away and never released, so an ID is not
+    handed out twice, not even after its member has been deleted.
+    """
+    cur = conn.cursor()
+    membership_ids = []
+    try:
+        for _ in range(count):
+            for _ in range(MEMBERSHIP_ID_ATTEMPTS):
+                membership_id = generate_membership_id()
+                cur.execute("INSERT OR IGNORE INTO membership_ids (id_index) VALUES (?)", (blind_index(membership_id),))
+                if cur.rowcount == 1:
+                    membership_ids.append(membership_id)
+                    break
+            else:
+                raise Error(f"No free membership ID found after {MEMBERSHIP_ID_ATTEMPTS} attempts")
+        conn.commit()
+    except Error:
+        conn.rollback()
+        raise
+    return membership_ids
+
+
 def validate_email(email: str) -> bool:
     """
     Validate the format of an email address.
@@ -45,28 +166,185 @@ def validate_phone(phone: str) -> bool:
     return re.match(regex, phone) is not None
 
 
+def validate_zip_code(zip_code: str) -> bool:
+    """
+    Validate the format of a zip code (DDDDXX).
+    """
+    return re.match(ZIP_CODE_PATTERN, zip_code) is not None
+
+
+def validate_city(city: str) -> bool:
+    """
+    Check that a city is one of the supported CITIES.
+    """
+    return city in CITIES
+
+
+def encrypt_member(member: dict, storage: str = None) -> dict:
+    """
+    Encrypt the sensitive fields of a member into column values for the given storage layout
+    (MEMBER_STORAGE by default), including the blind index of the membership ID.
+    """
+    if (storage or MEMBER_STORAGE) == "record":
+        values = {field: "" for field in MEMBER_FIELDS}
+        # A serialized record does not fit in a single RSA block, so records always use the envelope cipher
+        values["record"] = encrypt_envelope(json.dumps({field: str(member[field]) for field in MEMBER_FIELDS}))
+    else:
+        values = {field: encrypt_data(str(member[field])) for field in MEMBER_FIELDS}
+        values["record"] = None
+    values["membership_id_index"] = blind_index(str(member["membership_id"]))
+    return values
+
+
+def encrypt_members(members: list, storage: str = None) -> list:
+    """
+    Encrypt many members at once, returning the column values of each member in the same order.
+    In the per-column layout all fields go through encrypt_many, which spreads RSA work over all cores;
+    records always use the envelope cipher, which is fast enough to run in-line.
+    """
+    if (storage or MEMBER_STORAGE) == "record":
+        return [encrypt_member(member, "record") for member in members]
+
+    encrypted = iter(encrypt_many([str(member[field]) for member in members for field in MEMBER_FIELDS]))
+    encrypted_members = []
+    for member in members:
+        values = {field: next(encrypted) for field in MEMBER_FIELDS}
+        values["record"] = None
+        values["membership_id_index"] = blind_index(str(member["membership_id"]))
+        encrypted_members.append(values)
+    return encrypted_members
+
+
+def decrypt_member_row(row) -> dict:
+    """
+    Decrypt a row selected with MEMBER_COLUMNS into a dict with the plaintext member fields.
+    Rows in the record layout cost one decryption, rows in the per-column layout one per field.
+    """
+    member_id, record = row[0], row[1]
+    if record:
+        member = json.loads(decrypt_data(record))
+    else:
+        member = {field: decrypt_data(value) for field, value in zip(MEMBER_FIELDS, row[2:])}
+    member["id"] = member_id
+    return member
+
+
+def decrypt_member_rows(rows: list) -> list:
+    """
+    Decrypt many rows selected with MEMBER_COLUMNS at once, so the work can be spread over all cores.
+    Members that are still in the session cache are not decrypted again.
+    Returns the members in the same order; a row that cannot be decrypted becomes None.
+    """
+    members = [member_cache.get(row) for row in rows]
+    uncached_rows = [row for row, member in zip(rows, members) if member is None]
+
+    encrypted_values = []
+    for row in uncached_rows:
+        encrypted_values.extend([row[1]] if row[1] else row[2:])
+    values = iter(decrypt_many(encrypted_values, errors="ignore"))
+
+    decrypted_members = {}
+    for row in uncached_rows:
+        if row[1]:
+            record = next(values)
+            member = json.loads(record) if record is not None else None
+        else:
+            fields = [next(values) for _ in MEMBER_FIELDS]
+            member = dict(zip(MEMBER_FIELDS, fields)) if None not in fields else None
+        if member is not None:
+            member["id"] = row[0]
+            member_cache.put(row, member)
+        decrypted_members[row[0]] = member
+
+    return [member if member is not None else decrypted_members.get(row[0]) for row, member in zip(rows, members)]
+
+
+def _ngram_tokens(text: str) -> set:
+    """
+    Return the keyed search tokens of all n-grams in a (lowercased) text.
+    Tokens are truncated HMACs, so a collision only adds a candidate that is filtered out after decryption.
+    """
+    text = text.lower()
+    return {blind_index("ngram:" + text[i:i + NGRAM_SIZE])[:16] for i in range(len(text) - NGRAM_SIZE + 1)}
+
+
+def index_member(conn, member_id: int, member: dict):
+    """
+    Replace the search index tokens of a member. The caller commits the transaction.
+    """
+    tokens = set()
+    for field in SEARCHABLE_FIELDS:
+        tokens |= _ngram_tokens(str(member[field]))
+    cur = conn.cursor()
+    cur.execute("DELETE FROM member_search_index WHERE member_id = ?", (member_id,))
+    cur.executemany("INSERT OR IGNORE INTO member_search_index (token, member_id) VALUES (?, ?)",
+                    [(token, member_id) for token in tokens])
+
+
+def backfill_search_index(conn) -> int:
+    """
+    Add search index tokens for members that are not in the search index yet.
+    Returns the number of indexed members.
+    """
+    cur = conn.cursor()
+    cur.execute(f"SELECT {MEMBER_COLUMNS} FROM members WHERE id NOT IN (SELECT member_id FROM member_search_index)")
+    indexed = 0
+    for row in cur.fetchall():
+        try:
+            index_member(conn, row[0], decrypt_member_row(row))
+            indexed += 1
+        except Exception as e:
+            logging.error(f"Error indexing member {row[0]} for search: {e}")
+    conn.commit()
+    return indexed
+
+
+def find_member_id(conn, membership_id: str):
+    """
+    Look up the database ID of a member through the blind index of the membership ID.
+    Returns None if no member has this membership ID.
+    """
+    cur = conn.cursor()
+    cur.execute("SELECT id FROM members WHERE membership_id_index = ?", (blind_index(membership_id),))
+    row = cur.fetchone()
+    return row[0] if row else None
+
+
 def add_member(conn, first_name: str, last_name: str, age: int, gender: str, weight: float, address: str, email: str, phone: str, membership_id: str) -> int:
     """
     Add a new member to the database.
     """
-    encrypted_first_name = encrypt_data(first_name)
-    encrypted_last_name = encrypt_data(last_name)
-    encrypted_age = encrypt_data(str(age))
-    encrypted_gender = encrypt_data(gender)
-    encrypted_weight = encrypt_data(str(weight))
-    encrypted_address = encrypt_data(address)
-    encrypted_email = encrypt_data(email)
-    encrypted_phone = encrypt_data(phone)
-    encrypted_membership_id = encrypt_data(membership_id)
+    values = encrypt_member({
+        "first_name": first_name,
+        "last_name": last_name,
+        "membership_id": membership_id,
+        "age": age,
+        "gender": gender,
+        "weight": weight,
+        "address": address,
+        "email": email,
+        "phone": phone
+    })
+    values["registration_date"] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
 
     try:
-        sql = """INSERT INTO members (first_name, last_name, age, gender, weight, address, email, phone, registration_date, membership_id)
-                 VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"""
+        sql = f"""INSERT INTO members ({', '.join(values)})
+                 VALUES ({', '.join('?' for _ in values)})"""
         cur = conn.cursor()
-        cur.execute(sql, (encrypted_first_name, encrypted_last_name, encrypted_age, encrypted_gender, encrypted_weight, encrypted_address, encrypted_email, encrypted_phone, datetime.now().strftime('%Y-%m-%d %H:%M:%S'), encrypted_membership_id))
+        cur.execute(sql, tuple(values.values()))
+        member_id = cur.lastrowid
+        member_cache.invalidate(member_id)
+        index_member(conn, member_id, {
+            "first_name": first_name,
+            "last_name": last_name,
+            "address": address,
+            "email": email,
+            "phone": phone,
+            "membership_id": membership_id
+        })
         conn.commit()
         log_activity(membership_id, "Member added", f"Name: {first_name} {last_name}")
-        return cur.lastrowid  # Return the ID of the added member
+        return member_id  # Return the ID of the added member
     except Error as e:
         logging.error(f"Error adding member: {e}")
         log_suspicious_activity(membership_id, "Failed to add member", f"Attempted to add member {first_name} {last_name}")
@@ -109,7 +387,7 @@ def add_member_prompt(conn):
     
     while True:
         zip_code = input("Zip Code (format DDDDXX): ")
-        if re.match(r'^\d{4}[A-Z]{2}$', zip_code):
+        if validate_zip_code(zip_code):
             break
         print("Invalid zip code. Please use the format DDDDXX.")
 
@@ -143,7 +421,12 @@ def add_member_prompt(conn):
             break
         print("Invalid phone number. Please use the format +31-6-XXXXXXXX.")
     
-    membership_id = generate_membership_id()
+    try:
+        membership_id = allocate_membership_ids(conn)[0]
+    except Error as e:
+        logging.error(f"Error allocating a membership ID: {e}")
+        print("Failed to add member.")
+        return
     member_id = add_member(conn, first_name, last_name, age, gender, weight, address, email, phone, membership_id)
     if member_id:
         print(f"Member {first_name} {last_name} successfully added with membership ID {membership_id}.")
@@ -152,18 +435,349 @@ def add_member_prompt(conn):
         print("Failed to add member.")
 
 
+def validate_import_record(record: dict) -> dict:
+    """
+    Validate one member from an import file with the same rules as add_member_prompt.
+    Returns the member fields (the membership ID is allocated on insert), or raises ValueError describing the first problem.
+    """
+    record = {key: str(value).strip() for key, value in record.items() if key is not None and value is not None}
+    missing = [field for field in IMPORT_FIELDS if not record.get(field)]
+    if missing:
+        raise ValueError(f"missing {', '.join(missing)}")
+
+    if not record["age"].isdigit() or not 0 < int(record["age"]) <= 120:
+        raise ValueError("age must be a number between 1 and 120")
+    gender = record["gender"].upper()
+    if gender not in ['M', 'F']:
+        raise ValueError("gender must be M or F")
+    try:
+        weight = float(record["weight"])
+    except ValueError:
+        raise ValueError("weight must be a number")
+    if weight <= 0:
+        raise ValueError("weight must be greater than 0")
+    if not validate_zip_code(record["zip_code"]):
+        raise ValueError("zip code must have the format DDDDXX")
+    if not validate_city(record["city"]):
+        raise ValueError(f"city must be one of {', '.join(CITIES)}")
+    if not validate_email(record["email"]):
+        raise ValueError("invalid email address")
+    # Accept the bare 8 digits that add_member_prompt asks for, as well as the full number
+    phone = record["phone"] if record["phone"].startswith("+") else f"+31-6-{record['phone']}"
+    if not validate_phone(phone):
+        raise ValueError("phone must have the format +31-6-XXXXXXXX")
+
+    return {
+        "first_name": record["first_name"],
+        "last_name": record["last_name"],
+        "age": int(record["age"]),
+        "gender": gender,
+        "weight": weight,
+        "address": f"{record['street']} {record['house_number']}, {record['zip_code']} {record['city']}",
+        "email": record["email"],
+        "phone": phone
+    }
+
+
+def _read_import_file(path: str):
+    """
+    Yield (line number, record) for every member in a CSV (with a header) or JSONL file, one at a time.
+    A JSONL line that cannot be parsed is yielded with a ValueError instead of a record.
+    """
+    with open(path, 'r', newline='', encoding='utf-8') as file:
+        if path.lower().endswith((".jsonl", ".ndjson")):
+            for line_number, line in enumerate(file, start=1):
+                if not line.strip():
+                    continue
+                try:
+                    record = json.loads(line)
+                    if not isinstance(record, dict):
+                        raise ValueError("line is not a JSON object")
+                    yield line_number, record
+                except ValueError as e:
+                    yield line_number, ValueError(f"invalid JSON: {e}")
+        else:
+            reader = csv.DictReader(file)
+            for record in reader:
+                yield reader.line_num, record
+
+
+def _insert_member_chunk(conn, members: list) -> list:
+    """
+    Give a chunk of validated members their membership IDs, then encrypt and insert them, with their
+    search index tokens, in one transaction. Returns the database IDs of the new members.
+    """
+    for member, membership_id in zip(members, allocate_membership_ids(conn, len(members))):
+        member["membership_id"] = membership_id
+    encrypted_members = encrypt_members(members)
+    registration_date = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    columns = ["id", *encrypted_members[0], "registration_date"]
+
+    cur = conn.cursor()
+    # Take the write lock up front, so the IDs handed out below cannot be taken by another session
+    if not conn.in_transaction:
+        cur.execute("BEGIN IMMEDIATE")
+    try:
+        cur.execute("SELECT COALESCE(MAX(id), 0) FROM members")
+        first_id = cur.fetchone()[0] + 1
+        member_ids = list(range(first_id, first_id + len(members)))
+        cur.executemany(
+            f"INSERT INTO members ({', '.join(columns)}) VALUES ({', '.join('?' for _ in columns)})",
+            [(member_id, *values.values(), registration_date) for member_id, values in zip(member_ids, encrypted_members)]
+        )
+        cur.executemany(
+            "INSERT OR IGNORE INTO member_search_index (token, member_id) VALUES (?, ?)",
+            [(token, member_id)
+             for member_id, member in zip(member_ids, members)
+             for field in SEARCHABLE_FIELDS
+             for token in _ngram_tokens(str(member[field]))]
+        )
+        conn.commit()
+    except Error:
+        conn.rollback()
+        raise
+    return member_ids
+
+
+def import_members(conn, path: str, chunk_size: int = IMPORT_CHUNK_SIZE) -> tuple:
+    """
+    Import members from a CSV or JSONL file with the columns in IMPORT_FIELDS.
+    The file is read, validated, encrypted and inserted in chunks of chunk_size members, each chunk in a single
+    transaction with one audit log entry. Invalid rows (and the rows of a chunk that fails to insert) are
+    collected as rejects instead of aborting the import.
+    Returns (number of imported members, list of (line number, reason) rejects).
+    """
+    imported = 0
+    rejects = []
+    chunk, chunk_lines = [], []
+    chunk_number = 0
+
+    def flush_chunk():
+        nonlocal imported, chunk_number
+        if not chunk:
+            return
+        chunk_number += 1
+        try:
+            member_ids = _insert_member_chunk(conn, chunk)
+        except Error as e:
+            logging.error(f"Error importing members from {path}: {e}")
+            rejects.extend((line_number, f"database error: {e}") for line_number in chunk_lines)
+            log_suspicious_activity("System", "Failed to import members",
+                                    f"File: {os.path.basename(path)}, chunk {chunk_number}, {len(chunk)} members")
+        else:
+            imported += len(member_ids)
+            log_activity("System", "Members imported",
+                         f"File: {os.path.basename(path)}, chunk {chunk_number}, {len(member_ids)} members, "
+                         f"IDs {member_ids[0]}-{member_ids[-1]}")
+        chunk.clear()
+        chunk_lines.clear()
+
+    for line_number, record in _read_import_file(path):
+        try:
+            if isinstance(record, ValueError):
+                raise record
+            chunk.append(validate_import_record(record))
+            chunk_lines.append(line_number)
+        except ValueError as e:
+            rejects.append((line_number, str(e)))
+            continue
+        if len(chunk) >= chunk_size:
+            flush_chunk()
+    flush_chunk()
+    return imported, rejects
+
+
+def import_members_prompt(conn):
+    """
+    Prompt for a CSV or JSONL file, import its members and report the rejected rows.
+    """
+    path = input("Enter the path of the CSV or JSONL file to import: ").strip()
+    if not os.path.isfile(path):
+        print("File not found.")
+        return
+    try:
+        imported, rejects = import_members(conn, path)
+    except (OSError, UnicodeDecodeError, csv.Error) as e:
+        print(f"Could not read {path}: {e}")
+        return
+
+    print(f"{imported} members imported, {len(rejects)} rows rejected.")
+    if rejects:
+        report_path = path + ".rejects.csv"
+        with open(report_path, 'w', newline='', encoding='utf-8') as report:
+            writer = csv.writer(report)
+            writer.writerow(["line", "reason"])
+            writer.writerows(rejects)
+        for line_number, reason in rejects[:10]:
+            print(f"  line {line_number}: {reason}")
+        if len(rejects) > 10:
+            print(f"  ... and {len(rejects) - 10} more")
+        print(f"All rejected rows are listed in {report_path}.")
+
+
+def _decrypt_export_batch(rows: list, fields: list) -> list:
+    """
+    Decrypt only the requested fields of a batch of export rows (id, registration_date, record, *encrypted fields),
+    keeping the row order. Records are decrypted whole; per-column rows only decrypt the requested columns.
+    A row that cannot be decrypted becomes None.
+    """
+    encrypted_fields = [field for field in fields if field in MEMBER_FIELDS]
+    encrypted_values = []
+    for row in rows:
+        encrypted_values.extend([row[2]] if row[2] else row[3:])
+    values = iter(decrypt_many(encrypted_values, errors="ignore"))
+
+    members = []
+    for row in rows:
+        if row[2]:
+            record = next(values)
+            decrypted = json.loads(record) if record is not None else None
+        else:
+            decrypted = dict(zip(encrypted_fields, [next(values) for _ in encrypted_fields]))
+            if None in decrypted.values():
+                decrypted = None
+        if decrypted is None:
+            members.append(None)
+            continue
+        decrypted["registration_date"] = row[1]
+        members.append({field: decrypted[field] for field in fields})
+    return members
+
+
+def _export_fields(fields: list = None) -> list:
+    """
+    Return the fields to export (all EXPORT_FIELDS by default), or raise ValueError for unknown fields.
+    """
+    fields = list(fields or EXPORT_FIELDS)
+    unknown = [field for field in fields if field not in EXPORT_FIELDS]
+    if unknown:
+        raise ValueError(f"Unknown member fields: {', '.join(unknown)}")
+    return fields
+
+
+def iter_member_export(conn, fields: list = None, batch_size: int = EXPORT_BATCH_SIZE):
+    """
+    Yield the requested fields of every member, ordered by database ID, as dicts.
+    Rows are fetched batch_size at a time with fetchmany and each batch is decrypted at once (spread over all
+    cores for RSA values), so memory use does not grow with the size of the table. Members that cannot be
+    decrypted are yielded as None. The rows are read on a pooled connection, so the export does not hold up
+    writes on the session connection.
+    """
+    fields = _export_fields(fields)
+    encrypted_fields = [field for field in fields if field in MEMBER_FIELDS]
+
+    with read_connection(conn) as reader:
+        cur = reader.cursor()
+        cur.execute(f"SELECT {', '.join(['id', 'registration_date', 'record', *encrypted_fields])} FROM members ORDER BY id")
+        while True:
+            rows = cur.fetchmany(batch_size)
+            if not rows:
+                break
+            yield from _decrypt_export_batch(rows, fields)
+
+
+def export_members(conn, path: str, fields: list = None, file_format: str = None) -> tuple:
+    """
+    Export members to a CSV or JSONL file (chosen from the extension unless file_format is given),
+    writing each batch as soon as it is decrypted. Only the requested fields are exported.
+    Returns (number of exported members, number of members that could not be decrypted).
+    """
+    # Check the fields before the output file is created
+    fields = _export_fields(fields)
+    file_format = file_format or ("jsonl" if path.lower().endswith((".jsonl", ".ndjson")) else "csv")
+    exported = failed = 0
+
+    with open(path, 'w', newline='', encoding='utf-8') as file:
+        writer = None
+        if file_format == "csv":
+            writer = csv.DictWriter(file, fieldnames=fields)
+            writer.writeheader()
+        for member in iter_member_export(conn, fields):
+            if member is None:
+                failed += 1
+                continue
+            if writer is not None:
+                writer.writerow(member)
+            else:
+                file.write(json.dumps(member) + "\n")
+            exported += 1
+
+    log_activity("System", "Members exported",
+                 f"File: {os.path.basename(path)}, {exported} members, fields: {', '.join(fields)}")
+    return exported, failed
+
+
+def export_members_prompt(conn):
+    """
+    Prompt for an output file and the fields to export, then export all members.
+    """
+    path = input("Enter the path of the CSV or JSONL file to export to: ").strip()
+    if not path:
+        print("No file given.")
+        return
+    print(f"Available fields: {', '.join(EXPORT_FIELDS)}")
+    selection = input("Fields to export, separated by commas (leave empty for all): ").strip()
+    fields = [field.strip() for field in selection.split(",") if field.strip()] or None
+    try:
+        exported, failed = export_members(conn, path, fields)
+    except ValueError as e:
+        print(e)
+        return
+    except OSError as e:
+        print(f"Could not write {path}: {e}")
+        return
+    print(f"{exported} members exported to {path}.")
+    if failed:
+        print(f"{failed} members could not be decrypted and were skipped.")
+
+
+def _matches_search_term(member: dict, search_term: str) -> bool:
+    """
+    Check whether a decrypted member matches the search term with a partial match.
+    """
+    return (search_term.lower() in member["first_name"].lower() or
+            search_term.lower() in member["last_name"].lower() or
+            search_term in member["membership_id"] or
+            search_term.lower() in member["address"].lower() or
+            search_term.lower() in member["email"].lower() or
+            search_term in member["phone"])
+
+
 def search_member(conn, search_key: str) -> list:
     """
     Search for members in the database based on a search key with partial matches.
+    Search keys of at least NGRAM_SIZE characters are narrowed down with the search index first,
+    so only candidate members are decrypted. Returns a list of decrypted member dicts.
     """
-    cur = conn.cursor()
+    # Read on a pooled connection, so the search runs next to writes committed on the session connection
+    with read_connection(conn) as reader:
+        cur = reader.cursor()
+
+        tokens = _ngram_tokens(search_key)
+        if tokens:
+            placeholders = ", ".join("?" for _ in tokens)
+            cur.execute(f"""SELECT member_id FROM member_search_index WHERE token IN ({placeholders})
+                            GROUP BY member_id HAVING COUNT(*) = ?""", (*tokens, len(tokens)))
+            candidate_ids = [row[0] for row in cur.fetchall()]
+            rows = []
+            # Stay below SQLite's limit on the number of query parameters
+            for start in range(0, len(candidate_ids), 500):
+                chunk = candidate_ids[start:start + 500]
+                cur.execute(f"SELECT {MEMBER_COLUMNS} FROM members WHERE id IN ({', '.join('?' for _ in chunk)})", chunk)
+                rows.extend(cur.fetchall())
+        else:
+            # Too short for the n-gram index, fall back to checking every member
+            cur.execute(f"SELECT {MEMBER_COLUMNS} FROM members")
+            rows = cur.fetchall()
 
-    search_key = f"%{search_key}%"  # Prepare for partial matches
-    sql = """SELECT * FROM members WHERE
-             first_name LIKE ? OR last_name LIKE ? OR age LIKE ? OR gender LIKE ? OR weight LIKE ? OR address LIKE ? OR email LIKE ? OR phone LIKE ? OR membership_id LIKE ?"""
-    cur.execute(sql, (search_key, search_key, search_key, search_key, search_key, search_key, search_key, search_key, search_key))
-    rows = cur.fetchall()
-    return rows
+    found_members = []
+    for row, member in zip(rows, decrypt_member_rows(rows)):
+        if member is None:
+            logging.error(f"Error decrypting data for member {row[0]}")
+            print("Error decrypting data for a member.")
+        elif _matches_search_term(member, search_key):
+            found_members.append(member)
+    return found_members
 
 
 def search_member_prompt(conn):
@@ -174,45 +788,7 @@ def search_member_prompt(conn):
     log_activity("System", f"Searching member information", f"Search term: {search_term}")
 
     try:
-        sql_fetch_all = "SELECT first_name, last_name, membership_id, age, gender, weight, address, email, phone FROM members"
-        cur = conn.cursor()
-        cur.execute(sql_fetch_all)
-        rows = cur.fetchall()
-
-        found_members = []
-
-        for row in rows:
-            try:
-                decrypted_first_name = decrypt_data(row[0])
-                decrypted_last_name = decrypt_data(row[1])
-                decrypted_membership_id = decrypt_data(row[2])
-                decrypted_age = decrypt_data(str(row[3]))
-                decrypted_gender = decrypt_data(row[4])
-                decrypted_weight = decrypt_data(str(row[5]))
-                decrypted_address = decrypt_data(row[6])
-                decrypted_email = decrypt_data(row[7])
-                decrypted_phone = decrypt_data(row[8])
-
-                if (search_term.lower() in decrypted_first_name.lower() or
-                    search_term.lower() in decrypted_last_name.lower() or
-                    search_term in decrypted_membership_id or
-                    search_term.lower() in decrypted_address.lower() or
-                    search_term.lower() in decrypted_email.lower() or
-                    search_term in decrypted_phone):
-                    found_members.append({
-                        "first_name": decrypted_first_name,
-                        "last_name": decrypted_last_name,
-                        "membership_id": decrypted_membership_id,
-                        "age": decrypted_age,
-                        "gender": decrypted_gender,
-                        "weight": decrypted_weight,
-                        "address": decrypted_address,
-                        "email": decrypted_email,
-                        "phone": decrypted_phone
-                    })
-            except Exception as e:
-                logging.error(f"Error decrypting data: {e}")
-                print(f"Error decrypting data for a member: {e}")
+        found_members = search_member(conn, search_term)
 
         if found_members:
             print("Found members:")
@@ -231,18 +807,8 @@ def update_member(conn, membership_id: str):
     """
     print("Update member information.")
 
-    sql_fetch_all = "SELECT id, first_name, last_name, membership_id FROM members"
     cur = conn.cursor()
-    cur.execute(sql_fetch_all)
-    rows = cur.fetchall()
-
-    member_id = None
-
-    for row in rows:
-        decrypted_membership_id = decrypt_data(row[3])
-        if decrypted_membership_id == membership_id:
-            member_id = row[0]
-            break
+    member_id = find_member_id(conn, membership_id)
 
     if not member_id:
         print(f"Member with membership ID {membership_id} not found.")
@@ -317,18 +883,28 @@ def update_member(conn, membership_id: str):
             break
         print("Invalid phone number. Use the format +31-6-XXXXXXXX.")
 
-    sql_update = '''UPDATE members SET first_name=?, last_name=?, age=?, gender=?, weight=?, address=?, email=?, phone=? WHERE id=?'''
-    cur.execute(sql_update, (
-        encrypt_data(first_name), 
-        encrypt_data(last_name), 
-        encrypt_data(str(age)), 
-        encrypt_data(gender), 
-        encrypt_data(str(weight)), 
-        encrypt_data(address), 
-        encrypt_data(email), 
-        encrypt_data(phone), 
-        member_id
-    ))
+    values = encrypt_member({
+        "first_name": first_name,
+        "last_name": last_name,
+        "membership_id": membership_id,
+        "age": age,
+        "gender": gender,
+        "weight": weight,
+        "address": address,
+        "email": email,
+        "phone": phone
+    })
+    sql_update = f"UPDATE members SET {', '.join(f'{column}=?' for column in values)} WHERE id=?"
+    cur.execute(sql_update, (*values.values(), member_id))
+    member_cache.invalidate(member_id)
+    index_member(conn, member_id, {
+        "first_name": first_name,
+        "last_name": last_name,
+        "address": address,
+        "email": email,
+        "phone": phone,
+        "membership_id": membership_id
+    })
     conn.commit()
     print(f"Member {first_name} {last_name} successfully updated.")
 
@@ -347,24 +923,17 @@ def delete_member(conn, member_id: str) -> int:
     """
     Delete a member from the database based on their membership ID.
     """
-    sql_fetch_all = "SELECT id, membership_id FROM members"
     cur = conn.cursor()
-    cur.execute(sql_fetch_all)
-    rows = cur.fetchall()
-
-    member_db_id = None
-
-    for row in rows:
-        decrypted_membership_id = decrypt_data(row[1])
-        if decrypted_membership_id == member_id:
-            member_db_id = row[0]
-            break
+    member_db_id = find_member_id(conn, member_id)
 
     if member_db_id:
         sql_delete = 'DELETE FROM members WHERE id = ?'
         cur.execute(sql_delete, (member_db_id,))
+        deleted = cur.rowcount
+        member_cache.invalidate(member_db_id)
+        cur.execute('DELETE FROM member_search_index WHERE member_id = ?', (member_db_id,))
         conn.commit()
-        return cur.rowcount  # Return the number of deleted rows
+        return deleted  # Return the number of deleted rows
     else:
         print(f"Member with membership ID {member_id} not found.")
         return 0
@@ -379,4 +948,40 @@ def delete_member_prompt(conn):
         print(f"Member with membership number {member_id} successfully deleted.")
         log_activity("System", f"Deleted member", f"Membership ID: {member_id}")
     else:
-        print(f"Member with membership number {member_id} not found.")
\ No newline at end of file
+        print(f"Member with membership number {member_id} not found.")
+
+
+def convert_members_to_record_layout(conn, batch_size: int = 100) -> int:
+    """
+    Convert members stored in the per-column layout to the record layout.
+    Works in small committed batches so the application can keep using the database meanwhile.
+    Returns the number of converted members.
+    """
+    converted = 0
+    last_id = 0
+    cur = conn.cursor()
+    while True:
+        cur.execute(
+            f"SELECT {MEMBER_COLUMNS} FROM members WHERE (record IS NULL OR record = '') AND id > ? ORDER BY id LIMIT ?",
+            (last_id, batch_size)
+        )
+        rows = cur.fetchall()
+        if not rows:
+            break
+
+        for row in rows:
+            last_id = row[0]
+            try:
+                values = encrypt_member(decrypt_member_row(row), storage="record")
+            except Exception as e:
+                logging.error(f"Error converting member {row[0]} to the record layout: {e}")
+                continue
+            # Skip the row if it was changed since it was read
+            cur.execute(
+                f"UPDATE members SET {', '.join(f'{column}=?' for column in values)} "
+                f"WHERE id=? AND (record IS NULL OR record = '') AND membership_id=?",
+                (*values.values(), row[0], row[4])
+            )
+            converted += cur.rowcount
+        conn.commit()
+    return converted
@@ -0,0 +1,155 @@
+import os
+import logging
+import argparse
+from sqlite3 import Error
+from encrypt_decrypt import (
+    needs_reencryption, reencrypt_data, needs_reencoding, reencode_data, ensure_data_key, CIPHER_ENCODING
+)
+from database import create_connection
+from log import import_log_file, convert_log_segments, flush_logs
+from member import convert_members_to_record_layout
+
+# Kolommen die versleuteld worden opgeslagen
+USER_ENCRYPTED_COLUMNS = ("username", "role", "first_name", "last_name", "registration_date")
+MEMBER_ENCRYPTED_COLUMNS = ("first_name", "last_name", "age", "gender", "weight", "address", "email", "phone", "membership_id")
+MEMBER_RECORD_COLUMNS = MEMBER_ENCRYPTED_COLUMNS + ("record",)
+LOG_ENCRYPTED_COLUMNS = ("username", "description", "additional_info", "suspicious")
+
+
+def _convert_value(value, needs_conversion, convert, errors, action: str):
+    """
+    Zet een enkele waarde om met convert als needs_conversion aangeeft dat dat nodig is.
+    Geeft None terug als de waarde niet aangepast hoeft te (of kan) worden.
+    """
+    if value is None or value == "":
+        return None
+    if not isinstance(value, bytes):
+        value = str(value)
+    if not needs_conversion(value):
+        return None
+    try:
+        return convert(value)
+    except errors as e:
+        # Bijvoorbeeld onversleutelde waarden uit oudere versies van de applicatie
+        logging.warning(f"Skipping value that could not be {action}: {e}")
+        return None
+
+def _reencrypt_value(value):
+    """
+    Versleutel een enkele waarde opnieuw als deze nog niet in de huidige modus staat.
+    """
+    return _convert_value(value, needs_reencryption, reencrypt_data, Exception, "decrypted during migration")
+
+def _reencode_value(value):
+    """
+    Zet een enkele versleutelde waarde om naar het huidige opslagformaat, zonder te ontsleutelen.
+    """
+    return _convert_value(value, needs_reencoding, reencode_data, ValueError, "decoded during conversion")
+
+def migrate_table(conn, table: str, columns: tuple, convert=_reencrypt_value) -> int:
+    """
+    Zet alle opgegeven kolommen van een tabel om met convert; standaard worden ze opnieuw
+    versleuteld in de huidige versleutelingsmodus. Geeft het aantal bijgewerkte rijen terug.
+    """
+    cur = conn.cursor()
+    cur.execute(f"SELECT id, {', '.join(columns)} FROM {table}")
+    rows = cur.fetchall()
+
+    updated = 0
+    try:
+        for row in rows:
+            changes = {}
+            for column, value in zip(columns, row[1:]):
+                new_value = convert(value)
+                if new_value is not None:
+                    changes[column] = new_value
+            if changes:
+                assignments = ", ".join(f"{column}=?" for column in changes)
+                cur.execute(f"UPDATE {table} SET {assignments} WHERE id=?", (*changes.values(), row[0]))
+                updated += 1
+        conn.commit()
+    except Error as e:
+        conn.rollback()
+        logging.error(f"Error migrating table {table}: {e}")
+        raise
+    return updated
+
+
+def migrate_to_current_mode(database_path: str):
+    """
+    Zet alle versleutelde gegevens in de database (inclusief de logs en de logsegmenten) om naar de huidige
+    versleutelingsmodus.
+    """
+    ensure_data_key()
+    # Een nog niet geïmporteerd CSV-logbestand wordt eerst naar de logs-tabel overgezet
+    import_log_file()
+    flush_logs()
+    conn = create_connection(database_path)
+    if conn is None:
+        print("Could not open the database, migration aborted.")
+        return
+    try:
+        users = migrate_table(conn, "users", USER_ENCRYPTED_COLUMNS)
+        members = migrate_table(conn, "members", MEMBER_ENCRYPTED_COLUMNS)
+        logs = migrate_table(conn, "logs", LOG_ENCRYPTED_COLUMNS)
+    finally:
+        conn.close()
+    logs += convert_log_segments(lambda segment: migrate_table(segment, "logs", LOG_ENCRYPTED_COLUMNS))
+    print(f"Migration complete: {users} users, {members} members and {logs} log entries re-encrypted.")
+
+
+def migrate_members_to_records(database_path: str):
+    """
+    Zet alle leden in de oude per-kolom opslag om naar de record-opslag.
+    """
+    ensure_data_key()
+    conn = create_connection(database_path)
+    if conn is None:
+        print("Could not open the database, migration aborted.")
+        return
+    try:
+        converted = convert_members_to_record_layout(conn)
+    finally:
+        conn.close()
+    print(f"Migration complete: {converted} members converted to the record layout.")
+
+
+def convert_to_current_encoding(database_path: str):
+    """
+    Zet alle versleutelde waarden in de database en de logsegmenten om naar het huidige opslagformaat
+    (CIPHER_ENCODING). Er wordt niets ontsleuteld; daarna worden de bestanden verkleind met VACUUM.
+    """
+    flush_logs()
+    conn = create_connection(database_path)
+    if conn is None:
+        print("Could not open the database, conversion aborted.")
+        return
+    before = os.path.getsize(database_path)
+    try:
+        users = migrate_table(conn, "users", USER_ENCRYPTED_COLUMNS, _reencode_value)
+        members = migrate_table(conn, "members", MEMBER_RECORD_COLUMNS, _reencode_value)
+        logs = migrate_table(conn, "logs", LOG_ENCRYPTED_COLUMNS, _reencode_value)
+        conn.execute("VACUUM")
+    finally:
+        conn.close()
+    logs += convert_log_segments(lambda segment: migrate_table(segment, "logs", LOG_ENCRYPTED_COLUMNS, _reencode_value))
+    after = os.path.getsize(database_path)
+    print(f"Conversion to {CIPHER_ENCODING} complete: {users} users, {members} members and {logs} log entries converted.")
+    print(f"Database size: {before} -> {after} bytes.")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert stored data to a newer storage format.")
+    parser.add_argument("command", choices=["envelope", "records", "encoding"],
+                        help="envelope: re-encrypt all fields with the envelope cipher mode; "
+                             "records: store every member as one encrypted record; "
+                             "encoding: convert stored ciphertext to the compact CIPHER_ENCODING format")
+    parser.add_argument("--database", default="data/unique_meal.db")
+    args = parser.parse_args()
+
+    if args.command == "envelope":
+        migrate_to_current_mode(args.database)
+    elif args.command == "records":
+        migrate_members_to_records(args.database)
+    elif args.command == "encoding":
+        convert_to_current_encoding(args.database)
@@ -0,0 +1,119 @@
+import os
+import gzip
+import sqlite3
+import zipfile
+from contextlib import closing
+import backup
+from encrypt_decrypt import blind_index, encrypt_rsa
+from log import log_activity, flush_logs, rotate_logs, decrypt_log_file
+from member import add_member, delete_member, find_member_id, decrypt_member_row, MEMBER_COLUMNS
+from backup import backup_database_and_logs, restore_backup, restore_member_from_backup, _compress_file
+
+
+def _add(conn, first_name, membership_id):
+    return add_member(conn, first_name, "Tester", 30, "M", 80.0, "Coolsingel 1, 3011AB Rotterdam",
+                      f"{first_name.lower()}@example.com", "+31-6-12345678", membership_id)
+
+
+def _first_name(conn, membership_id):
+    member_id = find_member_id(conn, membership_id)
+    if member_id is None:
+        return None
+    row = conn.execute(f"SELECT {MEMBER_COLUMNS} FROM members WHERE id = ?", (member_id,)).fetchone()
+    return decrypt_member_row(row)["first_name"]
+
+
+def test_restore_member_does_not_replace_member_that_took_over_its_id(conn):
+    _add(conn, "Oldie", "2612345674")
+    old_id = _add(conn, "Leaver", "2676543210")
+    backup_name = os.path.basename(backup_database_and_logs("data/unique_meal.db"))
+
+    delete_member(conn, "2676543210")
+    new_id = _add(conn, "Newbie", "2611111119")
+    assert new_id == old_id
+
+    assert restore_member_from_backup(conn, "data/unique_meal.db", backup_name, "2676543210")
+    assert _first_name(conn, "2611111119") == "Newbie"
+    assert _first_name(conn, "2676543210") == "Leaver"
+    assert find_member_id(conn, "2676543210") != new_id
+    assert conn.execute("SELECT 1 FROM membership_ids WHERE id_index = ?", (blind_index("2676543210"),)).fetchone()
+
+
+def test_restore_member_keeps_free_id(conn):
+    _add(conn, "Oldie", "2612345674")
+    old_id = _add(conn, "Leaver", "2676543210")
+    backup_name = os.path.basename(backup_database_and_logs("data/unique_meal.db"))
+
+    delete_member(conn, "2676543210")
+    assert restore_member_from_backup(conn, "data/unique_meal.db", backup_name, "2676543210")
+    assert find_member_id(conn, "2676543210") == old_id
+    assert _first_name(conn, "2676543210") == "Leaver"
+
+
+def test_restore_member_from_baseline_backup(conn):
+    # A backup in the original format: per-column RSA fields, no record or blind index column, no catalog entry
+    os.makedirs("backups")
+    baseline = "backups/baseline.db"
+    with sqlite3.connect(baseline) as backup_conn:
+        backup_conn.execute("""CREATE TABLE members (id INTEGER PRIMARY KEY, first_name TEXT NOT NULL,
+                               last_name TEXT NOT NULL, age INTEGER, gender TEXT, weight REAL, address TEXT,
+                               email TEXT, phone TEXT, registration_date TEXT NOT NULL, membership_id TEXT NOT NULL)""")
+        for member_id, first_name, membership_id in ((1, "Other", "2412345676"), (2, "Vintage", "2476543214")):
+            backup_conn.execute(
+                "INSERT INTO members VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (member_id, *(encrypt_rsa(str(value)) for value in (
+                    first_name, "Tester", 30, "F", 60.0, "Coolsingel 1, 3011AB Rotterdam", "v@example.com",
+                    "+31-6-12345678")), "2024-10-13 23:14:59", encrypt_rsa(membership_id))
+            )
+    with zipfile.ZipFile("backups/unique_meal.db_20241013_231459.zip", "w") as backup_zip:
+        backup_zip.write(baseline, "unique_meal.db")
+    os.remove(baseline)
+
+    assert restore_member_from_backup(conn, "data/unique_meal.db", "unique_meal.db_20241013_231459.zip", "2476543214")
+    assert _first_name(conn, "2476543214") == "Vintage"
+    assert find_member_id(conn, "2412345676") is None
+
+
+def test_full_restore_drops_segments_made_after_the_backup(conn):
+    backup_name = os.path.basename(backup_database_and_logs("data/unique_meal.db"))
+    for i in range(5):
+        log_activity("tester", f"Before restore {i}")
+    flush_logs()
+    assert rotate_logs(force=True) is not None
+
+    conn = restore_backup("data/unique_meal.db", backup_name, conn)
+    for i in range(3):
+        log_activity("tester", f"After restore {i}")
+    flush_logs()
+
+    ids = [log[0] for log in decrypt_log_file()]
+    assert len(ids) == len(set(ids))
+    rotate_logs()
+    descriptions = [log[4] for log in decrypt_log_file()]
+    assert [d for d in descriptions if d.startswith("After restore")] == [f"After restore {i}" for i in range(3)]
+    assert not [d for d in descriptions if d.startswith("Before restore")]
+    conn.close()
+
+
+def test_compress_file_stores_only_the_recorded_size(tmp_path):
+    path = tmp_path / "system.log"
+    path.write_bytes(b"a" * 100)
+    part_path = tmp_path / "system.log.gz"
+    # Bytes appended after the file was stat'ed belong to the next backup
+    _compress_file(str(path), str(part_path), "deflate", 6, 60, offset=10)
+    with gzip.open(part_path, "rb") as part:
+        assert part.read() == b"a" * 50
+
+
+def test_full_restore_aborts_while_the_database_is_in_use(conn, monkeypatch):
+    monkeypatch.setattr(backup, "RESTORE_LOCK_TIMEOUT", 0.1)
+    backup_name = os.path.basename(backup_database_and_logs("data/unique_meal.db"))
+    _add(conn, "Later", "2676543210")
+
+    # Another session still has the database open
+    with closing(sqlite3.connect("data/unique_meal.db")) as other:
+        other.execute("SELECT COUNT(*) FROM members").fetchone()
+        conn = restore_backup("data/unique_meal.db", backup_name, conn)
+        assert _first_name(conn, "2676543210") == "Later"
+        assert os.path.exists("data/unique_meal.db-wal")
+    conn.close()
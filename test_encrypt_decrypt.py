@@ -0,0 +1,22 @@
+import encrypt_decrypt
+from encrypt_decrypt import encrypt_many, decrypt_many, shutdown_executor, PARALLEL_THRESHOLD
+
+
+def test_rsa_values_round_trip_through_the_process_pool(conn, monkeypatch):
+    monkeypatch.setattr(encrypt_decrypt, "CIPHER_MODE", "rsa")
+    values = [f"value {i}" for i in range(PARALLEL_THRESHOLD + 8)]
+    try:
+        assert decrypt_many(encrypt_many(values)) == values
+    finally:
+        shutdown_executor()
+
+
+def test_parallel_work_falls_back_to_this_process_when_the_pool_is_shut_down(conn, monkeypatch):
+    monkeypatch.setattr(encrypt_decrypt, "CIPHER_MODE", "rsa")
+    values = [f"value {i}" for i in range(PARALLEL_THRESHOLD + 8)]
+    # Like the log writer draining its queue after concurrent.futures has shut down at exit
+    encrypt_decrypt._get_executor().shutdown()
+    try:
+        assert decrypt_many(encrypt_many(values)) == values
+    finally:
+        shutdown_executor()
@@ -0,0 +1,96 @@
+import threading
+import key_rotation
+from encrypt_decrypt import ciphertext_key_id, encrypt_data, decrypt_data, load_key_state
+from key_rotation import start_key_rotation, run_key_rotation
+from log import log_activity, flush_logs, rotate_logs, decrypt_log_file, log_connection
+from member import add_member, find_member_id, decrypt_member_row, MEMBER_COLUMNS
+from migrate import MEMBER_RECORD_COLUMNS, LOG_ENCRYPTED_COLUMNS
+
+MEMBERS = {"2612345674": "Anna", "2676543210": "Bram", "2611111119": "Cees", "2622222224": "Dirk"}
+
+
+def _add_members(conn):
+    for membership_id, first_name in MEMBERS.items():
+        add_member(conn, first_name, "Tester", 30, "M", 80.0, "Coolsingel 1, 3011AB Rotterdam",
+                   f"{first_name.lower()}@example.com", "+31-6-12345678", membership_id)
+
+
+def _key_ids(conn):
+    """
+    The key versions of all encrypted member and log values.
+    """
+    key_ids = set()
+    for row in conn.execute(f"SELECT {', '.join(MEMBER_RECORD_COLUMNS)} FROM members"):
+        key_ids.update(ciphertext_key_id(value) for value in row if value)
+    with log_connection() as live:
+        for row in live.execute(f"SELECT {', '.join(LOG_ENCRYPTED_COLUMNS)} FROM logs"):
+            key_ids.update(ciphertext_key_id(value) for value in row if value)
+    return key_ids
+
+
+def _first_names(conn):
+    names = {}
+    for membership_id in MEMBERS:
+        row = conn.execute(f"SELECT {MEMBER_COLUMNS} FROM members WHERE id = ?",
+                           (find_member_id(conn, membership_id),)).fetchone()
+        names[membership_id] = decrypt_member_row(row)["first_name"]
+    return names
+
+
+def test_ciphertext_key_id_follows_the_active_key(conn):
+    old_value = encrypt_data("before")
+    assert ciphertext_key_id(old_value) == 1
+    key_id = start_key_rotation()
+    assert key_id == 2
+    new_value = encrypt_data("after")
+    assert ciphertext_key_id(new_value) == key_id
+    # Values of the previous key version stay readable during the rotation
+    assert decrypt_data(old_value) == "before"
+    assert decrypt_data(new_value) == "after"
+
+
+def test_key_rotation_round_trip(conn, monkeypatch):
+    monkeypatch.setattr(key_rotation, "ROTATION_PAUSE", 0)
+    # A restore in an earlier test leaves the pause flag of the background rotation set
+    monkeypatch.setattr(key_rotation, "_rotation_stop", threading.Event())
+    _add_members(conn)
+    for i in range(3):
+        log_activity("tester", f"Entry {i}")
+    flush_logs()
+    assert rotate_logs(force=True) is not None
+    log_activity("tester", "Live entry")
+    flush_logs()
+
+    key_id = start_key_rotation()
+    assert run_key_rotation("data/unique_meal.db", batch_size=2, report=lambda message: None)
+
+    state = load_key_state()
+    assert state["active"] == key_id and not state["rotating"]
+    assert _key_ids(conn) == {key_id}
+    assert _first_names(conn) == MEMBERS
+    descriptions = [entry[4] for entry in decrypt_log_file()]
+    assert [d for d in descriptions if "ntry" in d] == ["Entry 0", "Entry 1", "Entry 2", "Live entry"]
+
+
+def test_key_rotation_resumes_after_an_interruption(conn, monkeypatch):
+    monkeypatch.setattr(key_rotation, "ROTATION_PAUSE", 0)
+    monkeypatch.setattr(key_rotation, "_rotation_stop", threading.Event())
+    _add_members(conn)
+    key_id = start_key_rotation()
+
+    def pause_after_first_member_batch(message):
+        if message.startswith("Key rotation: members"):
+            key_rotation._rotation_stop.set()
+
+    assert not run_key_rotation("data/unique_meal.db", batch_size=1, report=pause_after_first_member_batch)
+    assert load_key_state()["rotating"]
+    assert _key_ids(conn) == {1, key_id}
+
+    key_rotation._rotation_stop.clear()
+    batches = []
+    assert run_key_rotation("data/unique_meal.db", batch_size=1, report=batches.append)
+    # The resumed rotation starts after the checkpoint instead of at the first member
+    assert not any(message == "Key rotation: members up to id 1" for message in batches)
+    assert not load_key_state()["rotating"]
+    assert _key_ids(conn) == {key_id}
+    assert _first_names(conn) == MEMBERS
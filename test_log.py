@@ -0,0 +1,83 @@
+import os
+import csv
+import sqlite3
+import pytest
+import log
+from log import LogWriter
+import encrypt_decrypt
+from encrypt_decrypt import encrypt_rsa
+
+
+class _Connection:
+    def close(self):
+        pass
+
+
+def test_log_writer_keeps_and_retries_failed_batches(monkeypatch):
+    attempts = {"connect": 0, "write": 0}
+    written = []
+
+    def connect():
+        attempts["connect"] += 1
+        if attempts["connect"] == 1:
+            raise sqlite3.OperationalError("unable to open database file")
+        return _Connection()
+
+    def write(conn, entries):
+        attempts["write"] += 1
+        if attempts["write"] == 1:
+            raise sqlite3.OperationalError("database is locked")
+        written.extend(entries)
+
+    monkeypatch.setattr(log, "connect_log_database", connect)
+    monkeypatch.setattr(log, "_write_log_entries", write)
+    monkeypatch.setattr(log, "LOG_RETRY_INTERVAL", 0.01)
+
+    writer = LogWriter(flush_interval=60)
+    writer.submit("first")
+    # The connection cannot be opened and then the database is locked: the writer reports both failures
+    assert writer.flush(timeout=5) is False
+    assert writer.flush(timeout=5) is False
+    writer.submit("second")
+    assert writer.flush(timeout=5) is True
+    assert written == ["first", "second"]
+    writer.shutdown()
+
+
+def test_log_writer_rotates_live_logs_while_running(conn, monkeypatch):
+    monkeypatch.setattr(log, "LOG_ROTATION_CHECK_INTERVAL", 0)
+    monkeypatch.setattr(log, "LOG_SEGMENT_MAX_ROWS", 3)
+    # Restart the writer so it picks up the short check interval
+    log.shutdown_log_writer()
+    for i in range(5):
+        log.log_activity("tester", f"Entry {i}")
+    assert log.flush_logs(timeout=10)
+
+    assert log.load_segment_manifest()
+    with log.log_connection() as live:
+        assert live.execute("SELECT COUNT(*) FROM logs").fetchone()[0] < 5
+    assert [entry[4] for entry in log.decrypt_log_file()][-5:] == [f"Entry {i}" for i in range(5)]
+
+
+def test_import_log_file_resumes_after_an_interrupted_run(conn, monkeypatch):
+    # The old log file stored its values as hex text
+    monkeypatch.setattr(encrypt_decrypt, "CIPHER_ENCODING", "hex")
+    rows = [[str(i), "13-10-2024", "23:14:59", *(encrypt_rsa(value) for value in ("tester", f"Old entry {i}", "", "No"))]
+            for i in range(1, 8)]
+    rows.insert(3, ["malformed"])
+    with open("data/logs.csv", "w", newline="", encoding="utf-8") as file:
+        csv.writer(file).writerows(rows)
+
+    def crash(message):
+        raise KeyboardInterrupt
+
+    # The first run stops after the first chunk has been written
+    with pytest.raises(KeyboardInterrupt):
+        log.import_log_file("data/logs.csv", chunk_size=3, report=crash)
+    assert log.import_log_file("data/logs.csv", chunk_size=3, report=lambda message: None) == 4
+
+    assert not os.path.exists("data/logs.csv")
+    assert os.path.exists("data/logs.csv.imported")
+    logs = log.decrypt_log_file()
+    assert [entry[0] for entry in logs] == list(range(1, 8))
+    assert [entry[4] for entry in logs] == [f"Old entry {i}" for i in range(1, 8)]
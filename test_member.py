@@ -0,0 +1,42 @@
+import csv
+import json
+from member import import_members, export_members, IMPORT_FIELDS, EXPORT_FIELDS
+
+ROWS = [
+    ["Anna", "de Vries", "34", "F", "61.5", "Coolsingel", "1", "3011AB", "Rotterdam", "anna@example.com", "12345678"],
+    ["Bram", "Jansen", "", "M", "80", "Lijnbaan", "2", "3012EH", "Rotterdam", "bram@example.com", "23456789"],
+    ["Cees", "Bakker", "52", "m", "92.3", "Damrak", "3", "1012LG", "Amsterdam", "cees@example.com", "+31-6-34567890"],
+    ["Dirk", "Visser", "27", "M", "75", "Neude", "4", "3512AE", "Utrecht", "dirk@example", "45678901"],
+    ["Eva", "Smit", "45", "F", "68", "Grote Markt", "5", "9711LV", "Groningen", "eva@example.com", "56789012"],
+]
+
+
+def test_import_export_round_trip(conn):
+    with open("import.csv", "w", newline="", encoding="utf-8") as file:
+        writer = csv.writer(file)
+        writer.writerow(IMPORT_FIELDS)
+        writer.writerows(ROWS)
+
+    imported, rejects = import_members(conn, "import.csv", chunk_size=2)
+    assert imported == 3
+    # Line numbers count the header; Bram has no age and Dirk an invalid email address
+    assert [line_number for line_number, _ in rejects] == [3, 5]
+
+    assert export_members(conn, "export.jsonl") == (3, 0)
+    with open("export.jsonl", encoding="utf-8") as file:
+        members = [json.loads(line) for line in file]
+    assert [member["first_name"] for member in members] == ["Anna", "Cees", "Eva"]
+    assert members[1]["gender"] == "M"
+    assert members[1]["phone"] == "+31-6-34567890"
+    assert members[2]["address"] == "Grote Markt 5, 9711LV Groningen"
+    assert len({member["membership_id"] for member in members}) == 3
+    assert set(members[0]) == set(EXPORT_FIELDS)
+
+    # A CSV export with a selection of fields contains only those columns
+    assert export_members(conn, "export.csv", ["first_name", "email"]) == (3, 0)
+    with open("export.csv", newline="", encoding="utf-8") as file:
+        assert list(csv.DictReader(file)) == [
+            {"first_name": "Anna", "email": "anna@example.com"},
+            {"first_name": "Cees", "email": "cees@example.com"},
+            {"first_name": "Eva", "email": "eva@example.com"},
+        ]
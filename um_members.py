@@ -3,22 +3,27 @@ import logging
 from sqlite3 import connect
 from datetime import datetime
 from user import (
-    validate_login, add_user_prompt,
+    validate_login, session_is_valid, add_user_prompt,
     update_password, list_users, update_user_prompt, delete_user_prompt,
     reset_user_password, delete_admin_prompt, update_admin_prompt, reset_admin_password_prompt
 )
 from member import (
-    add_member_prompt, search_member_prompt, update_member_prompt, delete_member_prompt
+    add_member_prompt, search_member_prompt, update_member_prompt, delete_member_prompt, import_members_prompt,
+    export_members_prompt
 )
 from log import (
-    log_activity, log_suspicious_activity, get_suspicious_logs, decrypt_log_file, display_logs
+    log_activity, log_suspicious_activity, get_unread_suspicious_logs, mark_logs_read, view_logs_prompt,
+    shutdown_log_writer, import_log_file, backfill_log_username_index, rotate_logs
 )
-from database import create_connection, create_tables, add_super_admin
+from database import create_connection, create_tables, add_super_admin, report_connection_settings
 from backup import backup_database_and_logs, restore_database_from_backup
+from key_rotation import key_rotation_prompt, rotate_keys_in_background, stop_key_rotation
 from encrypt_decrypt import (
     generate_keys, 
     load_private_key, 
-    load_public_key
+    load_public_key,
+    ensure_data_key,
+    load_key_state
 )
 
 # Configure logging
@@ -48,7 +53,8 @@ def main_menu(role):
             ("Add consultant", "C/c", "2"),
             ("Update system admin", "M/m", "3"),
             ("Delete system admin", "X/x", "4"),
-            ("Reset system admin password", "Z/z", "5")
+            ("Reset system admin password", "Z/z", "5"),
+            ("Rotate encryption keys", "K/k", "21")
         ]
     
     if role in ['super_admin', 'system_admin']:
@@ -63,7 +69,9 @@ def main_menu(role):
             ("Register new member", "N/n", "13"),
             ("Search member", "S/s", "14"),
             ("Update member", "P/p", "15"),
-            ("Delete member", "D/d", "16")
+            ("Delete member", "D/d", "16"),
+            ("Import members from file", "I/i", "19"),
+            ("Export members to file", "O/o", "20")
         ]
     
     if role == 'consultant':
@@ -98,6 +106,7 @@ def main_menu(role):
 def login_prompt(conn, max_attempts=3):
     """
     Prompt the user to log in with a username and password.
+    Returns the user ID, role and username of the logged in user.
     """
     attempts = 0
     while attempts < max_attempts:
@@ -110,7 +119,7 @@ def login_prompt(conn, max_attempts=3):
             user_id, role = result
             log_activity(username, "Logged in")
             logging.info("Login successful.")
-            return user_id, role
+            return user_id, role, username
         else:
             log_suspicious_activity(username, "Failed login attempt", f"Attempt {attempts + 1}")
             logging.info(f"Failed login attempt {attempts + 1} for username: {username}")
@@ -136,19 +145,36 @@ def main():
     database = "data/unique_meal.db"
     conn = create_connection(database)
     if conn is not None:
+        report_connection_settings(conn)
         create_tables(conn)
         add_super_admin(conn)
 
-    user_id, role = login_prompt(conn)
+        # Zet het oude CSV-logbestand eenmalig over naar de logs-tabel
+        imported_logs = import_log_file()
+        if imported_logs:
+            print(f"{imported_logs} log entries imported from the old log file.")
+        backfill_log_username_index()
+
+        # Sluit de live logs af in een nieuw segment als ze te groot of te oud geworden zijn
+        rotate_logs()
+
+        # Een onderbroken sleutelrotatie gaat op de achtergrond verder waar ze gebleven was
+        if load_key_state().get("rotating"):
+            rotate_keys_in_background(database)
+            print("Resuming key rotation in the background.")
+
+    user_id, role, username = login_prompt(conn)
     if user_id is None:
         return
 
     if role in ['super_admin', 'system_admin']:
-        suspicious_logs = get_suspicious_logs()
+        # Alleen verdachte activiteiten sinds de vorige keer dat deze admin ze gezien heeft
+        suspicious_logs = get_unread_suspicious_logs(user_id)
         if suspicious_logs:
             print("There are unread suspicious activities!")
             for log_entry in suspicious_logs:
                 print(f"{log_entry[0]} - {log_entry[1]} {log_entry[2]} - {log_entry[3]}: {log_entry[4]} - {log_entry[5]}")
+            mark_logs_read(user_id, suspicious_logs[-1][0])
 
     while True:
         choice = main_menu(role)
@@ -162,6 +188,8 @@ def main():
             delete_admin_prompt(conn)
         elif choice in ['z', '5'] and role == 'super_admin':
             reset_admin_password_prompt(conn)
+        elif choice in ['k', '21'] and role == 'super_admin':
+            key_rotation_prompt(database)
         elif choice in ['v', '6'] and role in ['super_admin', 'system_admin']:
             list_users(conn)
         elif choice in ['u', '7'] and role in ['super_admin', 'system_admin']:
@@ -173,10 +201,14 @@ def main():
         elif choice in ['b', '10'] and role in ['super_admin', 'system_admin']:
             backup_database_and_logs(database)
         elif choice in ['h', '11'] and role in ['super_admin', 'system_admin']:
-            restore_database_from_backup(database)
+            conn = restore_database_from_backup(database, conn)
+            # The restored users table may no longer have this account, or give its ID to someone else
+            if not session_is_valid(conn, user_id, username, role):
+                log_suspicious_activity(username, "Logged out after restore", "Account not in the restored data with the same role")
+                print("Your account is not in the restored data with the same role. Please log in again.")
+                user_id, role, username = login_prompt(conn)
         elif choice in ['l', '12'] and role in ['super_admin', 'system_admin']:
-            logs = decrypt_log_file()
-            display_logs(logs)
+            view_logs_prompt()
         elif choice in ['n', '13'] and role in ['super_admin', 'system_admin', 'consultant']:
             add_member_prompt(conn)
         elif choice in ['s', '14'] and role in ['super_admin', 'system_admin', 'consultant']:
@@ -186,6 +218,10 @@ def main():
             update_member_prompt(conn, member_id)
         elif choice in ['d', '16'] and role in ['super_admin', 'system_admin']:
             delete_member_prompt(conn)
+        elif choice in ['i', '19'] and role in ['super_admin', 'system_admin']:
+            import_members_prompt(conn)
+        elif choice in ['o', '20'] and role in ['super_admin', 'system_admin']:
+            export_members_prompt(conn)
         elif choice in ['w', '17']:
             if role != 'super_admin':
                 update_password(conn, user_id)
@@ -197,7 +233,11 @@ def main():
         else:
             print("Invalid choice. Try again.")
 
+    # Een lopende sleutelrotatie pauzeert na de huidige batch en gaat bij de volgende start verder
+    stop_key_rotation()
     conn.close()
+    # Schrijf de laatste logvermeldingen weg (ook via atexit geregeld bij exit())
+    shutdown_log_writer()
 
 if __name__ == "__main__":
     # Controleer of de 'data' directory bestaat
@@ -213,4 +253,7 @@ if __name__ == "__main__":
         generate_keys()
         print("RSA-sleutels zijn gegenereerd en opgeslagen in de map 'data'.")
 
+    # Genereer de datasleutel voor envelope-versleuteling als deze nog niet bestaat
+    ensure_data_key()
+
     main()  # Start de hoofdapplicatie
\ No newline at end of file
@@ -2,10 +2,11 @@ import logging
 import sqlite3
 from datetime import datetime
 import re
-from encrypt_decrypt import encrypt_data, decrypt_data
+from encrypt_decrypt import encrypt_data, decrypt_data, decrypt_many, blind_index
 from log import log_activity, log_suspicious_activity
 from utils import hash_password
 from sqlite3 import Error
+from database import read_connection
 
 # Validation functions
 def is_valid_username(username):
@@ -100,52 +101,69 @@ def is_valid_password(password):
     return True
 
 
+def find_user(conn, username):
+    """
+    Zoek een gebruiker op via de blind index van de gebruikersnaam.
+    Alleen rijen met dezelfde index worden ontsleuteld om de exacte gebruikersnaam te controleren.
+    Geeft (id, versleutelde gebruikersnaam, wachtwoord-hash, versleutelde rol) terug, of None.
+    """
+    with read_connection(conn) as reader:
+        users = reader.execute("SELECT id, username, password, role FROM users WHERE username_index=?",
+                               (blind_index(username.lower()),)).fetchall()
+    for user in users:
+        if decrypt_data(user[1]) == username:
+            return user
+    return None
+
+
 def validate_login(conn, username, password):
     """
     Valideer de gebruikersnaam en het wachtwoord tegen de opgeslagen referenties.
     """
     try:
-        cursor = conn.cursor()
-        
-        # Haal alle gebruikers op uit de database
-        cursor.execute("SELECT id, username, password, role FROM users")
-        users = cursor.fetchall()
+        # Zoek de gebruiker op via de blind index
+        user = find_user(conn, username)
         
-        for user in users:
-            # Ontsleutel de gebruikersnaam
-            decrypted_username = decrypt_data(user[1])  # Veronderstel dat username versleuteld is
+        if user:
+            # Hash het ingevoerde wachtwoord
+            hashed_password = hash_password(password)
             
-            if decrypted_username == username:
-                # Hash het ingevoerde wachtwoord
-                hashed_password = hash_password(password)
-                
-                # Controleer of het gehashte wachtwoord overeenkomt
-                if user[2] == hashed_password:
-                    # Ontsleutel de rol voordat deze wordt geretourneerd
-                    decrypted_role = decrypt_data(user[3])  # Ontsleutel de rol
-                    return user[0], decrypted_role  # Retourneer user_id en ontsleutelde rol
+            # Controleer of het gehashte wachtwoord overeenkomt
+            if user[2] == hashed_password:
+                # Ontsleutel de rol voordat deze wordt geretourneerd
+                decrypted_role = decrypt_data(user[3])  # Ontsleutel de rol
+                return user[0], decrypted_role  # Retourneer user_id en ontsleutelde rol
         
         return None  # Retourneer None als de inloggegevens ongeldig zijn
     except Exception as e:
         logging.error(f"Error tijdens login: {e}")
         return None
 
+def session_is_valid(conn, user_id, username, role):
+    """
+    Controleer of een ingelogde gebruiker (bijvoorbeeld na het terugzetten van een back-up) nog bestaat met
+    hetzelfde id, dezelfde gebruikersnaam en dezelfde rol. Het id kan in de teruggezette database ontbreken
+    of bij een andere gebruiker horen.
+    """
+    if conn is None:
+        return False
+    try:
+        user = find_user(conn, username)
+        return user is not None and user[0] == user_id and decrypt_data(user[3]) == role
+    except Exception as e:
+        logging.error(f"Error checking the session of {username}: {e}")
+        return False
+
 def username_exists(conn, username):
     """
     Check if a given username already exists in the database.
     """
     lowerCaseUsername = username.lower()
     try:
-        sql = "SELECT username FROM users"
-        cur = conn.cursor()
-        cur.execute(sql)
-        rows = cur.fetchall()
-
-        for row in rows:
-            decrypted_username = decrypt_data(row[0]).lower()
-            if decrypted_username == lowerCaseUsername:
-                return True
-        return False
+        # The blind index is computed over the lowercased username, so no decryption is needed
+        sql = "SELECT 1 FROM users WHERE username_index=?"
+        with read_connection(conn) as reader:
+            return reader.execute(sql, (blind_index(lowerCaseUsername),)).fetchone() is not None
     except Error as e:
         logging.error(f"Error checking for existing username: {e}")
         return False
@@ -188,11 +206,12 @@ def add_user_prompt(conn, default_role=None):
     encrypted_registration_date = encrypt_data(datetime.now().strftime('%Y-%m-%d %H:%M:%S'))  # Encrypt de registratie datum
 
     try:
-        sql = """INSERT INTO users (username, password, role, first_name, last_name, registration_date)
-                 VALUES (?, ?, ?, ?, ?, ?)"""
+        sql = """INSERT INTO users (username, username_index, password, role, first_name, last_name, registration_date)
+                 VALUES (?, ?, ?, ?, ?, ?, ?)"""
         cur = conn.cursor()
         cur.execute(sql, (
             encrypted_username,
+            blind_index(username.lower()),
             hashed_password,
             encrypted_role,
             encrypted_first_name,
@@ -249,9 +268,8 @@ def list_users(conn):
     """
     try:
         sql = "SELECT username, role FROM users"
-        cur = conn.cursor()
-        cur.execute(sql)
-        rows = cur.fetchall()
+        with read_connection(conn) as reader:
+            rows = reader.execute(sql).fetchall()
 
         if not rows:
             print("Geen gebruikers gevonden.")
@@ -261,14 +279,17 @@ def list_users(conn):
         print(f"{'Username':<40} {'Role':<40}")
         print("-" * 80)
         
-        for row in rows:
+        # Ontsleutel alle gebruikersnamen en rollen in één keer
+        decrypted_values = decrypt_many([value for row in rows for value in row], errors="ignore")
+
+        for index, row in enumerate(rows):
             encrypted_username, encrypted_role = row
-            try:
-                decrypted_username = decrypt_data(encrypted_username)
-                decrypted_role = decrypt_data(encrypted_role)
+            decrypted_username = decrypted_values[2 * index]
+            decrypted_role = decrypted_values[2 * index + 1]
+            if decrypted_username is not None and decrypted_role is not None:
                 print(f"{decrypted_username:<40} {decrypted_role:<40}")
-            except Exception as e:
-                logging.error(f"Fout bij het ontsleutelen van gegevens voor gebruiker: {encrypted_username}. Fout: {e}")
+            else:
+                logging.error(f"Fout bij het ontsleutelen van gegevens voor gebruiker: {encrypted_username}.")
                 print(f"Username: [onleesbaar], Role: [onleesbaar]")
     except Error as e:
         logging.error(f"Fout bij het opvragen van gebruikers: {e}")
@@ -299,23 +320,14 @@ def update_user_prompt(conn):
     last_name = input("New Last Name: ")
 
     try:
-        sql_fetch_all = "SELECT id, username FROM users"
         cur = conn.cursor()
-        cur.execute(sql_fetch_all)
-        rows = cur.fetchall()
-
-        user_id = None
+        user = find_user(conn, username)
+        user_id = user[0] if user else None
         encrypted_new_username = encrypt_data(new_username)
 
-        for row in rows:
-            decrypted_username = decrypt_data(row[1])
-            if decrypted_username == username:
-                user_id = row[0]
-                break
-
         if user_id:
-            sql_update = "UPDATE users SET username=?, first_name=?, last_name=? WHERE id=?"
-            cur.execute(sql_update, (encrypted_new_username, first_name, last_name, user_id))
+            sql_update = "UPDATE users SET username=?, username_index=?, first_name=?, last_name=? WHERE id=?"
+            cur.execute(sql_update, (encrypted_new_username, blind_index(new_username.lower()), first_name, last_name, user_id))
             conn.commit()
 
             log_activity(username, "User updated", f"Username changed to {new_username}, Name updated to {first_name} {last_name}")
@@ -336,23 +348,16 @@ def delete_user_prompt(conn):
         username = input("Enter the username of the user you want to delete: ")
         if is_valid_username(username):
             break
-    encrypted_username = None
 
     try:
-        sql = "SELECT username FROM users"
         cur = conn.cursor()
-        cur.execute(sql)
-        rows = cur.fetchall()
-
-        for row in rows:
-            decrypted_username = decrypt_data(row[0])
-            if decrypted_username == username:
-                encrypted_username = row[0]
-                break
+        user = find_user(conn, username)
 
-        if encrypted_username:
-            sql_delete = "DELETE FROM users WHERE username=?"
-            cur.execute(sql_delete, (encrypted_username,))
+        if user:
+            sql_delete = "DELETE FROM users WHERE id=?"
+            cur.execute(sql_delete, (user[0],))
+            # The ID can be reused by a new user, who must not inherit the 'read up to' point of this one
+            cur.execute("DELETE FROM log_watermarks WHERE user_id=?", (user[0],))
             conn.commit()
             log_activity(username, "User deleted", f"User {username} was deleted")
             print(f"User {username} successfully deleted.")
@@ -380,18 +385,9 @@ def reset_user_password(conn):
     hashed_password = hash_password(new_password)
 
     try:
-        sql_fetch_all = "SELECT id, username FROM users"
         cur = conn.cursor()
-        cur.execute(sql_fetch_all)
-        rows = cur.fetchall()
-
-        user_id = None
-
-        for row in rows:
-            decrypted_username = decrypt_data(row[1])
-            if decrypted_username == username:
-                user_id = row[0]
-                break
+        user = find_user(conn, username)
+        user_id = user[0] if user else None
 
         if user_id:
             sql_update = "UPDATE users SET password=? WHERE id=?"
@@ -438,26 +434,21 @@ def update_admin_prompt(conn):
         # Versleutel de nieuwe gebruikersnaam
         encrypted_new_username = encrypt_data(new_username)
 
-        # Zoek de gebruiker in de database
-        sql_fetch = "SELECT id, username, role FROM users"
+        # Zoek de gebruiker in de database via de blind index
         cur = conn.cursor()
-        cur.execute(sql_fetch)
-        rows = cur.fetchall()
+        user = find_user(conn, username)
 
         user_id = None
         decrypted_role = None
 
-        for row in rows:
-            decrypted_username = decrypt_data(row[1])
-            if decrypted_username == username:
-                user_id = row[0]
-                try:
-                    decrypted_role = decrypt_data(row[2])
-                except Exception as e:
-                    logging.error(f"Error decrypting role for user ID {user_id}: {e}")
-                    print("Error decrypting role for the user. Cannot proceed.")
-                    return
-                break
+        if user:
+            user_id = user[0]
+            try:
+                decrypted_role = decrypt_data(user[3])
+            except Exception as e:
+                logging.error(f"Error decrypting role for user ID {user_id}: {e}")
+                print("Error decrypting role for the user. Cannot proceed.")
+                return
 
         if user_id:
             if decrypted_role != 'system_admin':
@@ -469,9 +460,10 @@ def update_admin_prompt(conn):
             encrypted_last_name = encrypt_data(last_name)
 
             # Update de gebruiker in de database
-            sql_update = "UPDATE users SET username=?, first_name=?, last_name=? WHERE id=?"
+            sql_update = "UPDATE users SET username=?, username_index=?, first_name=?, last_name=? WHERE id=?"
             cur.execute(sql_update, (
                 encrypted_new_username,
+                blind_index(new_username.lower()),
                 encrypted_first_name,
                 encrypted_last_name,
                 user_id
@@ -507,29 +499,24 @@ def delete_admin_prompt(conn):
             else:
                 print("Ongeldige gebruikersnaam. Zorg ervoor dat de gebruikersnaam aan de vereisten voldoet.")
         
-        # Zoek de gebruiker in de database
-        sql_fetch_all = "SELECT id, username, role FROM users"
+        # Zoek de gebruiker in de database via de blind index
         cur = conn.cursor()
-        cur.execute(sql_fetch_all)
-        rows = cur.fetchall()
+        user = find_user(conn, username)
 
         user_id = None
         decrypted_role = None
 
-        for row in rows:
-            decrypted_username = decrypt_data(row[1])
-            if decrypted_username == username:
-                try:
-                    decrypted_role = decrypt_data(row[2])
-                except Exception as e:
-                    logging.error(f"Error decrypting role for user ID {row[0]}: {e}")
-                    print("Error decrypting role for the user. Cannot proceed.")
-                    return  # Stop de functie als de rol niet ontsleuteld kan worden
-                if decrypted_role != 'system_admin':
-                    print("This function is only available for system admin accounts.")
-                    return  # Stop de functie als de gebruiker geen system_admin is
-                user_id = row[0]
-                break
+        if user:
+            try:
+                decrypted_role = decrypt_data(user[3])
+            except Exception as e:
+                logging.error(f"Error decrypting role for user ID {user[0]}: {e}")
+                print("Error decrypting role for the user. Cannot proceed.")
+                return  # Stop de functie als de rol niet ontsleuteld kan worden
+            if decrypted_role != 'system_admin':
+                print("This function is only available for system admin accounts.")
+                return  # Stop de functie als de gebruiker geen system_admin is
+            user_id = user[0]
 
         if user_id:
             # Bevestig de verwijdering
@@ -541,6 +528,8 @@ def delete_admin_prompt(conn):
             # Verwijder de gebruiker uit de database
             sql_delete = "DELETE FROM users WHERE id=?"
             cur.execute(sql_delete, (user_id,))
+            # De id kan opnieuw uitgegeven worden; een nieuwe admin mag dit 'gelezen tot'-punt niet erven
+            cur.execute("DELETE FROM log_watermarks WHERE user_id=?", (user_id,))
             conn.commit()
 
             log_activity(username, "System Admin deleted", f"System Admin {username} was deleted")
@@ -570,29 +559,24 @@ def reset_admin_password_prompt(conn):
             else:
                 print("Ongeldige gebruikersnaam. Zorg ervoor dat de gebruikersnaam aan de vereisten voldoet.")
 
-        # Zoek de gebruiker in de database
-        sql_fetch_all = "SELECT id, username, role FROM users"
+        # Zoek de gebruiker in de database via de blind index
         cur = conn.cursor()
-        cur.execute(sql_fetch_all)
-        rows = cur.fetchall()
+        user = find_user(conn, username)
 
         user_id = None
         decrypted_role = None
 
-        for row in rows:
-            decrypted_username = decrypt_data(row[1])
-            if decrypted_username == username:
-                try:
-                    decrypted_role = decrypt_data(row[2])
-                except Exception as e:
-                    logging.error(f"Error decrypting role for user ID {row[0]}: {e}")
-                    print("Error decrypting role for the user. Cannot proceed.")
-                    return  # Stop de functie als de rol niet ontsleuteld kan worden
-                if decrypted_role != 'system_admin':
-                    print("This function is only available for system admin accounts.")
-                    return  # Stop de functie als de gebruiker geen system_admin is
-                user_id = row[0]
-                break
+        if user:
+            try:
+                decrypted_role = decrypt_data(user[3])
+            except Exception as e:
+                logging.error(f"Error decrypting role for user ID {user[0]}: {e}")
+                print("Error decrypting role for the user. Cannot proceed.")
+                return  # Stop de functie als de rol niet ontsleuteld kan worden
+            if decrypted_role != 'system_admin':
+                print("This function is only available for system admin accounts.")
+                return  # Stop de functie als de gebruiker geen system_admin is
+            user_id = user[0]
 
         if user_id:
             # Vraag om het nieuwe wachtwoord